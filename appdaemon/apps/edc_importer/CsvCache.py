@@ -0,0 +1,135 @@
+import hashlib
+import json
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+from typing import Optional
+import numpy as np
+import edc
+from edc import Csv, Ean, IntervalTable, MeasurementTable
+from EdcLogger import EdcLogger
+from Colors import Colors
+
+
+class CsvCache:
+    """Persistent cache of parsed EDC exports.
+
+    A parsed Csv is stored as an uncompressed .npz archive (the interval arrays plus the EAN manifest) named by the
+    SHA-256 of the export file. A byte-identical export - retry, re-export of the same month, manual import -
+    is then loaded from the archive without parsing.
+
+    With ``parseProcesses`` > 0 a cache miss is parsed in a process pool, so a long parse does not hold the GIL
+    shared by all AppDaemon apps. The parsed Csv is pickled back.
+    """
+
+    # bump when the parser or the archive layout changes, older archives are then ignored
+    cacheVersion = 1
+    uiLogger: EdcLogger = 'undefined'
+
+    def __init__(self, cacheDirectory, logger: EdcLogger, maxEntries: int = 24, parseProcesses: int = 0):
+        self.cacheDirectory = Path(cacheDirectory)
+        self.uiLogger = logger
+        self.maxEntries = maxEntries
+        self.parsePool = None
+        if (parseProcesses > 0):
+            #spawn, forking the multi-threaded AppDaemon process is not safe
+            self.parsePool = ProcessPoolExecutor(max_workers=parseProcesses, mp_context=multiprocessing.get_context("spawn"))
+        os.makedirs(self.cacheDirectory, exist_ok=True)
+
+    def close(self):
+        if (self.parsePool != None):
+            self.parsePool.shutdown(wait=False, cancel_futures=True)
+            self.parsePool = None
+
+    def parse(self, dataFile: Path) -> Csv:
+        dataFile = Path(dataFile)
+        cacheFile = self.cacheFile(dataFile)
+        parsedCsv = self.load(cacheFile, dataFile.name)
+        if parsedCsv is not None:
+            self.uiLogger.logAndPrint(f"Export [{dataFile.name}] loaded from cache [{cacheFile.name}]", Colors.GREEN)
+            return parsedCsv
+
+        parsedCsv = self.parseFile(dataFile)
+        try:
+            self.store(cacheFile, parsedCsv)
+            self.evict()
+        except OSError as e:
+            self.uiLogger.logAndPrint(f"Unable to cache parsed export [{cacheFile}]: {e}", Colors.YELLOW)
+        return parsedCsv
+
+    def parseFile(self, dataFile: Path) -> Csv:
+        if (self.parsePool != None):
+            try:
+                return self.parsePool.submit(edc.parse_csv_file, dataFile).result()
+            except BrokenProcessPool as e:
+                self.uiLogger.logAndPrint(f"Parser process failed ({e}), parsing in this process", Colors.YELLOW)
+                self.parsePool = None
+        return edc.parse_csv_file(dataFile)
+
+    def cacheFile(self, dataFile: Path) -> Path:
+        digest = hashlib.sha256()
+        with open(dataFile, "rb") as file:
+            for chunk in iter(lambda: file.read(1024 * 1024), b""):
+                digest.update(chunk)
+        return self.cacheDirectory / f"csv_v{self.cacheVersion}_{digest.hexdigest()}.npz"
+
+    def load(self, cacheFile: Path, filename: str) -> Optional[Csv]:
+        if not cacheFile.exists():
+            return None
+        try:
+            with np.load(cacheFile, allow_pickle=False) as archive:
+                intervals = IntervalTable(
+                    archive["starts"],
+                    archive["sumSharing"],
+                    archive["sumMissed"],
+                    archive["sumProduction"],
+                    MeasurementTable(archive["distributionBefore"], archive["distributionAfter"], archive["distributionMissed"]),
+                    MeasurementTable(archive["consumerBefore"], archive["consumerAfter"], archive["consumerMissed"]),
+                    {int(row): errors for row, errors in json.loads(str(archive["errors"])).items()},
+                )
+                distributionEans = [Ean(str(name), int(index)) for name, index in zip(archive["distributionEans"], archive["distributionIndexes"])]
+                consumerEans = [Ean(str(name), int(index)) for name, index in zip(archive["consumerEans"], archive["consumerIndexes"])]
+        except (OSError, KeyError, ValueError) as e:
+            self.uiLogger.logAndPrint(f"Ignoring unreadable cache file [{cacheFile.name}]: {e}", Colors.YELLOW)
+            return None
+        # touch the entry so that eviction keeps recently used exports
+        os.utime(cacheFile)
+        return Csv(filename, intervals, distributionEans, consumerEans)
+
+    def store(self, cacheFile: Path, parsedCsv: Csv):
+        intervals: IntervalTable = parsedCsv.getIntervals()
+        temporaryFile = cacheFile.with_suffix(".tmp")
+        try:
+            self.__write(temporaryFile, parsedCsv, intervals)
+            os.replace(temporaryFile, cacheFile)
+        finally:
+            temporaryFile.unlink(missing_ok=True)
+
+    def __write(self, temporaryFile: Path, parsedCsv: Csv, intervals: IntervalTable):
+        with open(temporaryFile, "wb") as file:
+            np.savez(
+                file,
+                starts=intervals.starts,
+                sumSharing=intervals.sumSharing,
+                sumMissed=intervals.sumMissed,
+                sumProduction=intervals.sumProduction,
+                distributionBefore=intervals.distributions.before,
+                distributionAfter=intervals.distributions.after,
+                distributionMissed=intervals.distributions.missed,
+                consumerBefore=intervals.consumers.before,
+                consumerAfter=intervals.consumers.after,
+                consumerMissed=intervals.consumers.missed,
+                errors=np.array(json.dumps({int(row): errors for row, errors in intervals.errors.items()})),
+                distributionEans=np.array([ean.name for ean in parsedCsv.distributionEans], dtype=str),
+                distributionIndexes=np.array([ean.csvIndex for ean in parsedCsv.distributionEans], dtype=np.int64),
+                consumerEans=np.array([ean.name for ean in parsedCsv.consumerEans], dtype=str),
+                consumerIndexes=np.array([ean.csvIndex for ean in parsedCsv.consumerEans], dtype=np.int64),
+            )
+
+    def evict(self):
+        entries = sorted(self.cacheDirectory.glob("csv_v*.npz"), key=lambda entry: entry.stat().st_mtime, reverse=True)
+        for entry in entries[self.maxEntries:]:
+            self.uiLogger.logAndPrint(f"Removing cached export [{entry.name}]")
+            entry.unlink(missing_ok=True)
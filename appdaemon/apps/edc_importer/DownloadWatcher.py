@@ -0,0 +1,129 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import time
+from pathlib import Path
+from EdcLogger import EdcLogger
+
+
+class DownloadWatcher:
+    """Waits for a browser download to be completely written.
+
+    Create it before the download is started, every file present at that moment is ignored. The directory is watched
+    with inotify (Linux), without it the directory is polled. A download is complete when no partial file
+    (``.crdownload`` and friends) is left and the file kept the same size and modification time for ``stableTime``
+    seconds. Of the new files the one whose name contains ``namePart`` wins, any other new file is accepted only when
+    it is the only one.
+    """
+
+    partialSuffixes = (".crdownload", ".part", ".partial", ".download", ".tmp")
+    uiLogger: EdcLogger = 'undefined'
+
+    # inotify(7)
+    IN_MODIFY = 0x002
+    IN_CLOSE_WRITE = 0x008
+    IN_MOVED_TO = 0x080
+    IN_CREATE = 0x100
+    IN_NONBLOCK = os.O_NONBLOCK
+    IN_CLOEXEC = 0o2000000
+
+    def __init__(self, directory, namePart: str, logger: EdcLogger, stableTime: float = 1.0, pollInterval: float = 0.25):
+        self.directory = Path(directory)
+        self.namePart = namePart.lower()
+        self.uiLogger = logger
+        self.stableTime = stableTime
+        self.pollInterval = pollInterval
+        self.inotifyFd = None
+        self.openInotify()
+        # after the watch is set up, a file created in between is not missed
+        self.existingFiles = {entry.name for entry in os.scandir(self.directory)}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def openInotify(self):
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+            fd = libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+            if (fd < 0):
+                return
+            if (libc.inotify_add_watch(fd, os.fsencode(self.directory), self.IN_MODIFY | self.IN_CLOSE_WRITE | self.IN_MOVED_TO | self.IN_CREATE) < 0):
+                os.close(fd)
+                return
+            self.inotifyFd = fd
+        except (OSError, AttributeError, TypeError):
+            #no libc or no inotify (not Linux), the directory is polled
+            self.inotifyFd = None
+
+    def close(self):
+        if (self.inotifyFd != None):
+            os.close(self.inotifyFd)
+            self.inotifyFd = None
+
+    def isPartial(self, name: str) -> bool:
+        # Chrome also writes hidden .com.google.Chrome.* temporary files
+        return name.startswith(".") or name.lower().endswith(self.partialSuffixes)
+
+    #returns (candidate file or None, True when a download is still in progress)
+    def scan(self):
+        newFiles = []
+        inProgress = False
+        for entry in os.scandir(self.directory):
+            if (entry.name in self.existingFiles or not entry.is_file()):
+                continue
+            if (self.isPartial(entry.name)):
+                inProgress = True
+            else:
+                newFiles.append(entry)
+        matching = [entry for entry in newFiles if self.namePart in entry.name.lower()]
+        if (len(matching) == 0 and len(newFiles) == 1):
+            matching = newFiles
+        if (len(matching) == 0):
+            return None, inProgress
+        return Path(max(matching, key=lambda entry: entry.stat().st_mtime_ns).path), inProgress
+
+    #blocks until the directory changes or the timeout passes
+    def waitForChange(self, timeout: float):
+        if (self.inotifyFd == None):
+            time.sleep(min(timeout, self.pollInterval))
+            return
+        readable, _, _ = select.select([self.inotifyFd], [], [], max(timeout, 0))
+        if (readable):
+            try:
+                while os.read(self.inotifyFd, 64 * 1024):
+                    pass
+            except BlockingIOError:
+                pass
+
+    def waitForDownload(self, timeout: float) -> Path:
+        deadline = time.monotonic() + timeout
+        candidate = None
+        signature = None
+        stableSince = 0
+        while True:
+            now = time.monotonic()
+            try:
+                path, inProgress = self.scan()
+                stat = path.stat() if path != None else None
+            except FileNotFoundError:
+                #renamed by the browser in between, next scan finds it
+                path, inProgress, stat = None, True, None
+            if (stat != None):
+                if (path != candidate or (stat.st_size, stat.st_mtime_ns) != signature):
+                    candidate = path
+                    signature = (stat.st_size, stat.st_mtime_ns)
+                    stableSince = now
+                elif (not inProgress and stat.st_size > 0 and now - stableSince >= self.stableTime):
+                    self.uiLogger.logAndPrint(f"Download complete [{candidate.name}], {stat.st_size} bytes")
+                    return candidate
+            if (now > deadline):
+                raise TimeoutError(f"Download not completed within {timeout}s, last file [{candidate}]")
+            #wake up for the stability check even when nothing happens in the directory
+            waitTime = deadline - now
+            if (candidate != None):
+                waitTime = min(waitTime, max(stableSince + self.stableTime - now, 0.01))
+            self.waitForChange(waitTime)
@@ -0,0 +1,237 @@
+import base64
+import calendar
+import hashlib
+import html
+import os
+import re
+import secrets
+import shutil
+import threading
+import time
+from pathlib import Path
+from typing import List
+from urllib.parse import urlencode, urljoin, urlparse, parse_qs
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from Colors import Colors
+from EdcLogger import EdcLogger
+import utils
+
+
+class EdcApiClient:
+    """EDC portal exports over plain HTTP, an alternative to the Selenium EdcScraper.
+
+    Logs in like the portal does - Keycloak authorization code flow with PKCE, the login form is posted directly -
+    and then requests the export, waits until it is generated and downloads it with the bearer token, all over one
+    pooled requests session. The token is refreshed when it expires and the login is repeated when the refresh fails.
+
+    The portal API is not documented, every URL is taken from ``endpoints`` (see defaultEndpoints) so it can be
+    adjusted without a code change. ``{id}`` in the report URLs is replaced by the id returned for the export.
+    The default realm, client id and API paths are not verified against the live portal yet (only against a local
+    stub), so ``scraperBackend: api`` is left out of the shipped configuration and the README until they are.
+    """
+
+    exportedFile = "automatic-export"
+    uiLogger: EdcLogger = 'undefined'
+    defaultEndpoints = {
+        "portal": "https://portal.edc-cr.cz/",
+        "keycloak": "https://portal.edc-cr.cz/auth/realms/edc/",
+        "clientId": "edc-portal",
+        "groups": "api/v1/sharing-groups",
+        "exports": "api/v1/data-exports",
+        "download": "api/v1/data-exports/{id}/download",
+    }
+    defaultTimeouts = {
+        "request": 30,   # single HTTP request
+        "export": 120,   # export to be generated
+    }
+
+    def __init__(self, username, password, exportGroup, downloadDirectory, logger: EdcLogger, endpoints = {}, timeouts = {}, pollInterval = 2):
+        self.username = username
+        self.password = password
+        self.exportGroup = exportGroup
+        self.downloadDirectory = downloadDirectory
+        self.uiLogger = logger
+        self.endpoints = {**self.defaultEndpoints, **endpoints}
+        self.timeouts = {**self.defaultTimeouts, **timeouts}
+        self.pollInterval = pollInterval
+        self.sessionLock = threading.RLock()
+        self.session = None
+        self.token = None
+        self.tokenExpires = 0
+        #id of exportGroup, looked up once per session
+        self.groupId = None
+
+    def newSession(self) -> requests.Session:
+        session = requests.Session()
+        retry = Retry(total=3, backoff_factor=0.5, status_forcelist=[502, 503, 504], allowed_methods=["GET"])
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=4, max_retries=retry)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+
+    def keycloakUrl(self, path: str) -> str:
+        return urljoin(self.endpoints["keycloak"], path)
+
+    def apiUrl(self, name: str, **kwargs) -> str:
+        return urljoin(self.endpoints["portal"], self.endpoints[name].format(**kwargs))
+
+    def login(self):
+        self.uiLogger.logAndPrint("Logging in to EDC API")
+        if (self.session == None):
+            self.session = self.newSession()
+        redirectUri = self.endpoints["portal"]
+        verifier = secrets.token_urlsafe(64)
+        challenge = base64.urlsafe_b64encode(hashlib.sha256(verifier.encode()).digest()).rstrip(b"=").decode()
+        authUrl = self.keycloakUrl("protocol/openid-connect/auth") + "?" + urlencode({
+            "client_id": self.endpoints["clientId"],
+            "redirect_uri": redirectUri,
+            "response_type": "code",
+            "scope": "openid",
+            "state": secrets.token_urlsafe(16),
+            "code_challenge": challenge,
+            "code_challenge_method": "S256",
+        })
+        loginPage = self.session.get(authUrl, timeout=self.timeouts["request"])
+        loginPage.raise_for_status()
+        form = re.search(r"<form[^>]*id=\"kc-form-login\"[^>]*>", loginPage.text)
+        action = form and re.search(r"action=\"([^\"]+)\"", form.group(0))
+        if (not action):
+            raise Exception("Keycloak login form not found")
+
+        response = self.session.post(
+            urljoin(loginPage.url, html.unescape(action.group(1))),
+            data={"username": self.username, "password": self.password, "credentialId": ""},
+            allow_redirects=False,
+            timeout=self.timeouts["request"],
+        )
+        code = parse_qs(urlparse(response.headers.get("Location", "")).query).get("code")
+        if (response.status_code not in (302, 303) or not code):
+            raise Exception(f"EDC login failed, HTTP status [{response.status_code}]")
+        self.updateToken({
+            "grant_type": "authorization_code",
+            "code": code[0],
+            "redirect_uri": redirectUri,
+            "client_id": self.endpoints["clientId"],
+            "code_verifier": verifier,
+        })
+
+    def updateToken(self, form: dict):
+        response = self.session.post(self.keycloakUrl("protocol/openid-connect/token"), data=form, timeout=self.timeouts["request"])
+        response.raise_for_status()
+        token = response.json()
+        self.token = token
+        # renew a bit before it really expires
+        self.tokenExpires = time.monotonic() + int(token.get("expires_in", 60)) - 10
+
+    def ensureToken(self):
+        if (self.token != None and time.monotonic() < self.tokenExpires):
+            return
+        if (self.token != None and "refresh_token" in self.token):
+            try:
+                self.updateToken({
+                    "grant_type": "refresh_token",
+                    "refresh_token": self.token["refresh_token"],
+                    "client_id": self.endpoints["clientId"],
+                })
+                return
+            except requests.RequestException as e:
+                self.uiLogger.logAndPrint(f"Token refresh failed: {e}", Colors.YELLOW)
+        self.login()
+
+    #authorized API request, a rejected token leads to one new login
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        self.ensureToken()
+        for attempt in range(2):
+            response = self.session.request(method, url, headers={"Authorization": f"Bearer {self.token['access_token']}"}, timeout=self.timeouts["request"], **kwargs)
+            if (response.status_code != 401 or attempt > 0):
+                break
+            self.login()
+        response.raise_for_status()
+        return response
+
+    def findGroupId(self):
+        if (self.groupId != None):
+            return self.groupId
+        groups = self.request("GET", self.apiUrl("groups")).json()
+        for group in groups:
+            if (str(group.get("name", "")).strip() == self.exportGroup.strip()):
+                self.groupId = group["id"]
+                return self.groupId
+        raise Exception(f"Export group '{self.exportGroup}' not found. Available groups: {[group.get('name') for group in groups]}")
+
+    def exportMonth(self, month: int, year: int, fileName = None):
+        self.uiLogger.logAndPrint(f"Exporting data {year}/{month} over HTTP")
+        lastDay = calendar.monthrange(year, month)[1]
+        response = self.request("POST", self.apiUrl("exports"), json={
+            "groupId": self.findGroupId(),
+            "dateFrom": f"{year:04d}-{month:02d}-01",
+            "dateTo": f"{year:04d}-{month:02d}-{lastDay:02d}",
+            "interval": "monthly" if utils.useMonthExport(month, year) else "daily",
+            "fileName": fileName or self.exportedFile,
+        })
+        return response.json()["id"]
+
+    #polls the download until the export is generated, HTTP 200 means done
+    def downloadExport(self, exportId, fileName = None) -> Path:
+        deadline = time.monotonic() + self.timeouts["export"]
+        while True:
+            self.ensureToken()
+            response = self.session.get(self.apiUrl("download", id=exportId), headers={"Authorization": f"Bearer {self.token['access_token']}"}, timeout=self.timeouts["request"], stream=True)
+            if (response.status_code == 200):
+                break
+            response.close()
+            if (response.status_code not in (202, 204, 404, 409) or time.monotonic() > deadline):
+                raise Exception(f"Export [{exportId}] not available, HTTP status [{response.status_code}]")
+            time.sleep(self.pollInterval)
+
+        os.makedirs(self.downloadDirectory, exist_ok=True)
+        target = Path(self.downloadDirectory) / f"{fileName or self.exportedFile}.csv"
+        temporaryFile = target.with_suffix(".part")
+        try:
+            with response, open(temporaryFile, "wb") as file:
+                for chunk in response.iter_content(64 * 1024):
+                    file.write(chunk)
+            os.replace(temporaryFile, target)
+        finally:
+            temporaryFile.unlink(missing_ok=True)
+        self.uiLogger.logAndPrint(f"Export downloaded [{target}]")
+        return target
+
+    def scrapeData(self, month, year) -> Path:
+        with self.sessionLock:
+            return self.downloadExport(self.exportMonth(month, year))
+
+    #same contract as EdcScraper.scrapeMonths, all exports are requested before the first download
+    def scrapeMonths(self, months: List[tuple], onDownloaded):
+        with self.sessionLock:
+            backfillDirectory = Path(self.downloadDirectory, "backfill")
+            shutil.rmtree(backfillDirectory, ignore_errors=True)
+            os.makedirs(backfillDirectory)
+            exports = [(year, month, self.monthFileName(year, month)) for year, month in months]
+            exportIds = [self.exportMonth(month, year, fileName) for year, month, fileName in exports]
+            for (year, month, fileName), exportId in zip(exports, exportIds):
+                downloadedFile = self.downloadExport(exportId, fileName)
+                onDownloaded(year, month, downloadedFile.replace(backfillDirectory / downloadedFile.name))
+
+    def monthFileName(self, year: int, month: int) -> str:
+        return f"{self.exportedFile}-{year:04d}-{month:02d}"
+
+    def closeSession(self):
+        with self.sessionLock:
+            if (self.session == None):
+                return
+            try:
+                if (self.token != None and "refresh_token" in self.token):
+                    self.session.post(self.keycloakUrl("protocol/openid-connect/logout"), data={
+                        "client_id": self.endpoints["clientId"],
+                        "refresh_token": self.token["refresh_token"],
+                    }, timeout=self.timeouts["request"])
+            except requests.RequestException as e:
+                self.uiLogger.logAndPrint(f"EDC API logout failed: {e}")
+            finally:
+                self.session.close()
+                self.session = None
+                self.token = None
+                self.groupId = None
@@ -1,40 +1,106 @@
-from typing import List, AnyStr
+from typing import List, AnyStr, Union
 from pathlib import Path
-from functools import partial
+from functools import partial, lru_cache
 import json
 import calendar
+import threading
+from concurrent.futures import ThreadPoolExecutor, Future
 from datetime import datetime
-from edc import Csv, Interval, GroupingOptions, Ean, Measurement
-from EdcLogger import EdcLogger
+from edc import Csv, Interval, IntervalTable, GroupingOptions, Ean, Measurement
+from EdcLogger import EdcLogger, BufferedLogger
+from ExportFingerprints import ExportFingerprints
+from RecorderStatistics import RecorderStatistics
+from EntityRegistry import EntityRegistry
+from Colors import Colors
+
+#statistic dates repeat for every EAN and metric, each of them is formatted just once
+@lru_cache(maxsize=65536)
+def formatStatisticDate(statisticDate: datetime) -> str:
+	return statisticDate.strftime('%d.%m.%Y %H:%M')
 
 class EdcExporter:
 
 	hass = 'undefined'
 	dataDirectory = 'undefined'
 	uiLogger: EdcLogger = 'undefined'
+	exportFingerprints: ExportFingerprints = 'undefined'
+	recorderStatistics: RecorderStatistics = 'undefined'
+	entityRegistry: EntityRegistry = 'undefined'
 	exportHeader = "statistic_id;unit;start;state;sum"
 
-	def __init__(self, dataDirectory, logger: EdcLogger, hass = 'undefined'):
+	#deltaExport: upload only rows which changed since the last successful upload
+	#batchedUpload: all statistics of the run go to HA in a few multi-entity files of at most maxRowsPerFile rows
+	#exportBackend: "file" - import_statistics integration reads exported files, "recorder" - rows are sent straight to the recorder, files are the fallback
+	#exportWorkers: (metric, EAN) exports running in parallel, at most maxHaCalls of them talk to HA at the same time
+	def __init__(self, dataDirectory, logger: EdcLogger, hass = 'undefined', deltaExport = False, batchedUpload = False, maxRowsPerFile = 50000, exportBackend = "file", exportWorkers = 1, maxHaCalls = 4):
 		self.hass = hass
+		self.exportWorkers = exportWorkers
+		if (exportWorkers > 1):
+			#logs of the parallel jobs are replayed in the order of the jobs
+			logger = BufferedLogger(logger)
 		self.uiLogger = logger
 		self.dataDirectory = Path(f"{dataDirectory}/")
+		self.batchedUpload = batchedUpload
+		self.maxRowsPerFile = maxRowsPerFile
+		self.haCalls = threading.BoundedSemaphore(maxHaCalls)
+		#(entityName, rows) waiting for the batched upload
+		self.uploadBatch = []
+		self.exportPool = None
+		self.exportJobs = []
+		if (deltaExport):
+			self.exportFingerprints = ExportFingerprints(self.dataDirectory / "state" / "exportFingerprints.json", logger)
+		if (self.hass != 'undefined'):
+			self.entityRegistry = EntityRegistry(self.hass, logger, self.haCalls)
+		if (exportBackend == "recorder" and self.hass != 'undefined'):
+			recorderStatistics = RecorderStatistics(self.hass, logger)
+			if (recorderStatistics.available()):
+				self.recorderStatistics = recorderStatistics
+			else:
+				self.uiLogger.logAndPrint("Direct recorder import needs AppDaemon 4.5+, statistics will be imported from files", Colors.YELLOW)
 		self.uiLogger.logAndPrint("EDC Exporter Initialized")
 		
-	def exportData(self, parsedData: Csv, grouping: GroupingOptions = "1m"):
-		self.uiLogger.logAndPrint(f"Exporting data {grouping}")
-		intervals = parsedData.getGroupedIntervals(grouping)
-		
-		self.exportProducerSharedEnergy(parsedData, intervals, grouping)
-		self.exportConsumerSharedEnergy(parsedData, intervals, grouping)
-		self.exportProducerMissed(parsedData, intervals, grouping)
-		self.exportProducerSoldToNetwork(parsedData, intervals, grouping)
-		self.exportConsumerMissed(parsedData, intervals, grouping)
-		self.exportConsumerPurchaseFromNetwork(parsedData, intervals, grouping)
+	#groupings might be a single grouping or a list of them, all of them are grouped before the export
+	def exportData(self, parsedData: Csv, groupings: Union[GroupingOptions, List[GroupingOptions]] = "1m"):
+		if isinstance(groupings, str):
+			groupings = [groupings]
+		groupedIntervals = parsedData.getGroupedIntervalsBatch(groupings)
+
+		self.uploadBatch = []
+		self.exportJobs = []
+		if (self.entityRegistry != 'undefined'):
+			self.entityRegistry.refresh()
+		if (self.exportWorkers > 1):
+			self.exportPool = ThreadPoolExecutor(max_workers=self.exportWorkers, thread_name_prefix="edc_export")
+			#messages of this thread are replayed between the jobs, so the log reads like a sequential export
+			self.uiLogger.collect()
+		try:
+			for grouping in groupings:
+				self.uiLogger.logAndPrint(f"Exporting data {grouping}")
+				intervals = groupedIntervals[grouping]
+
+				self.exportProducerSharedEnergy(parsedData, intervals, grouping)
+				self.exportConsumerSharedEnergy(parsedData, intervals, grouping)
+				self.exportProducerMissed(parsedData, intervals, grouping)
+				self.exportProducerSoldToNetwork(parsedData, intervals, grouping)
+				self.exportConsumerMissed(parsedData, intervals, grouping)
+				self.exportConsumerPurchaseFromNetwork(parsedData, intervals, grouping)
+			self.completeExportJobs()
+			self.uploadBatchedStatistics()
+			if (self.entityRegistry != 'undefined'):
+				self.entityRegistry.flush()
+		finally:
+			if (self.exportPool != None):
+				self.exportPool.shutdown(wait=True, cancel_futures=True)
+				self.exportPool = None
+				self.uiLogger.replay(self.uiLogger.collected())
+			#keep what was uploaded even when a later upload fails
+			if (self.exportFingerprints != 'undefined'):
+				self.exportFingerprints.save()
 		self.exportProducerEans(parsedData)
 		self.exportConsumerEans(parsedData)
 		
 		
-	def exportProducerSharedEnergy(self, parsedData: Csv, intervals: List[Interval], grouping: GroupingOptions):
+	def exportProducerSharedEnergy(self, parsedData: Csv, intervals: IntervalTable, grouping: GroupingOptions):
 		#create entities
 		self.uiLogger.logAndPrint(f"Exporting Shared energy for producer between EANs.")
 		#it might be consumer resolver....
@@ -43,7 +109,7 @@ class EdcExporter:
 		calculator = partial(self.calculateBeforeAfterDifference)
 		self.exportConsumptionForEans(intervals, parsedData.distributionEans, "shared", grouping, dataResolver, calculator)
 
-	def exportConsumerSharedEnergy(self, parsedData: Csv, intervals: List[Interval], grouping: GroupingOptions):
+	def exportConsumerSharedEnergy(self, parsedData: Csv, intervals: IntervalTable, grouping: GroupingOptions):
 		#create entities
 		self.uiLogger.logAndPrint(f"Exporting Shared energy for consumer between EANs.")
 		#it might be consumer resolver....
@@ -52,25 +118,25 @@ class EdcExporter:
 		self.exportConsumptionForEans(intervals, parsedData.consumerEans, "shared", grouping, dataResolver, calculator)
 		
 	
-	def exportProducerMissed(self, parsedData: Csv, intervals: List[Interval], grouping: GroupingOptions):
+	def exportProducerMissed(self, parsedData: Csv, intervals: IntervalTable, grouping: GroupingOptions):
 		self.uiLogger.logAndPrint(f"Exporting missed opportunity for producer by EANs.")
 		dataResolver = partial(self.resolveProducer)
 		calculator = partial(self.calculateMissed)
 		self.exportConsumptionForEans(intervals, parsedData.distributionEans, "producer_missed", grouping, dataResolver, calculator)
 	
-	def exportProducerSoldToNetwork(self, parsedData: Csv, intervals: List[Interval], grouping: GroupingOptions):
+	def exportProducerSoldToNetwork(self, parsedData: Csv, intervals: IntervalTable, grouping: GroupingOptions):
 		self.uiLogger.logAndPrint(f"Exporting sold energy to network by producer.")
 		dataResolver = partial(self.resolveProducer)
 		calculator = partial(self.calculateAfterMissedDifference)
 		self.exportConsumptionForEans(intervals, parsedData.distributionEans, "producer_sold_network", grouping, dataResolver, calculator)
 
-	def exportConsumerMissed(self, parsedData: Csv, intervals: List[Interval], grouping: GroupingOptions):
+	def exportConsumerMissed(self, parsedData: Csv, intervals: IntervalTable, grouping: GroupingOptions):
 		self.uiLogger.logAndPrint(f"Exporting missed opportunity for consumer by EANs.")
 		dataResolver = partial(self.resolveConsumer)
 		calculator = partial(self.calculateMissed)
 		self.exportConsumptionForEans(intervals, parsedData.consumerEans, "consumer_missed", grouping, dataResolver, calculator)
 
-	def exportConsumerPurchaseFromNetwork(self, parsedData: Csv, intervals: List[Interval], grouping: GroupingOptions):
+	def exportConsumerPurchaseFromNetwork(self, parsedData: Csv, intervals: IntervalTable, grouping: GroupingOptions):
 		self.uiLogger.logAndPrint(f"Exporting purchased energy from network by consumer.")
 		dataResolver = partial(self.resolveConsumer)
 		calculator = partial(self.calculateAfter)
@@ -78,69 +144,113 @@ class EdcExporter:
 
 
 
-	def exportConsumptionForEans(self, intervals: List[Interval], eans: List[Ean], dataType: AnyStr, grouping: GroupingOptions, dataResolver: partial, calculator: partial):
+	def exportConsumptionForEans(self, intervals: IntervalTable, eans: List[Ean], dataType: AnyStr, grouping: GroupingOptions, dataResolver: partial, calculator: partial):
 		for eanIndex, ean in enumerate(eans):
-			self.uiLogger.logAndPrint(f"Exporting {dataType} EAN  [{ean.name}].")
-			entityName = self.createEntity("edc_data", dataType, self.convertGroupinToName(grouping), ean.name)
-			file = self.exportFile(eanIndex, ean.name, entityName, intervals, dataResolver, calculator, dataType, grouping)
-			self.uploadFile(file)
-			
-			if (grouping == "1m"):
-				#update current state just for monthly interval
-				self.updateEntityState(entityName, ean, eanIndex, intervals, dataResolver, calculator)
+			self.submitExportJob(partial(self.exportEan, eanIndex, ean, intervals, dataType, grouping, dataResolver, calculator))
+
+	#returns (entityName, rows) for the batched upload or None
+	def exportEan(self, eanIndex: int, ean: Ean, intervals: IntervalTable, dataType: AnyStr, grouping: GroupingOptions, dataResolver: partial, calculator: partial):
+		self.uiLogger.logAndPrint(f"Exporting {dataType} EAN  [{ean.name}].")
+		entityName = self.createEntity("edc_data", dataType, self.convertGroupinToName(grouping), ean.name)
+		rows = self.statisticRows(eanIndex, entityName, intervals, dataResolver, calculator, grouping)
+		batchItem = None
+		if (len(rows) > 0):
+			if (self.batchedUpload):
+				batchItem = (entityName, rows)
+			else:
+				self.uploadStatistics(f"{dataType}_export_{ean.name}_{grouping}.csv", [(entityName, rows)])
+		
+		if (grouping == "1m"):
+			#update current state just for monthly interval
+			self.updateEntityState(entityName, ean, eanIndex, intervals, dataResolver, calculator)
+		return batchItem
+
+	#runs the job right away or, in parallel mode, on the export pool
+	def submitExportJob(self, job):
+		if (self.exportPool == None):
+			self.completeExportJob(job())
+		else:
+			self.exportJobs.append(self.loggedMessages())
+			self.uiLogger.collect()
+			self.exportJobs.append(self.exportPool.submit(self.runBufferedJob, job))
+
+	#messages logged by this thread so far, as a finished job
+	def loggedMessages(self) -> Future:
+		messages = Future()
+		messages.set_result((None, None, self.uiLogger.collected()))
+		return messages
+
+	def runBufferedJob(self, job):
+		self.uiLogger.collect()
+		try:
+			return job(), None, self.uiLogger.collected()
+		except Exception as e:
+			return None, e, self.uiLogger.collected()
+
+	#waits for the parallel jobs in the order they were submitted, the first failure is raised after all of them finished
+	def completeExportJobs(self):
+		if (self.exportPool == None):
+			return
+		jobs = self.exportJobs + [self.loggedMessages()]
+		self.exportJobs = []
+		firstError = None
+		for job in jobs:
+			batchItem, error, messages = job.result()
+			self.uiLogger.replay(messages)
+			if (error != None):
+				firstError = firstError or error
+			else:
+				self.completeExportJob(batchItem)
+		if (firstError != None):
+			raise firstError
+
+	def completeExportJob(self, batchItem):
+		if (batchItem != None):
+			self.uploadBatch.append(batchItem)
 	
-	def updateEntityState(self, entityName: AnyStr, ean: AnyStr, eanIndex: int, intervals: List[Interval], dataResolver: partial, calculator: partial):
+	def updateEntityState(self, entityName: AnyStr, ean: AnyStr, eanIndex: int, intervals: IntervalTable, dataResolver: partial, calculator: partial):
 		year = datetime.now().year
 		month = datetime.now().month
 
-		for interval in intervals:
-			statisticDate: datetime = self.parseIntervalStart(interval)
+		values = calculator(dataResolver(intervals)[eanIndex])
+		for statisticDate, value in zip(intervals.startDates(), values.tolist()):
 			#just current month
 			if ((statisticDate.month == month) and (statisticDate.year == year)):
 				completeEntityName = f"input_number.{entityName}"
-				data = dataResolver(interval)
-				value = calculator(data[eanIndex])
+				value = float(value)
 				if (value == 0):
 					value = 0.1
 				self.uiLogger.logAndPrint(f"Updating monthly [{statisticDate.year}::{statisticDate.month}] entity [{completeEntityName}] state to [{value}]")
-				if (self.hass != 'undefined'):
-					self.hass.set_state(completeEntityName,state=value)
+				#written together with the other states at the end of the export
+				if (self.entityRegistry != 'undefined'):
+					self.entityRegistry.queueState(completeEntityName, value)
 		
 	#dataType: producer/consumer
 	#interval: hour/day/month
 	def createEntity(self, entityBaseName: AnyStr, dataType: AnyStr, interval: AnyStr, ean: AnyStr):
 		completeEntityName = f"{entityBaseName}_{dataType}_{ean}_{interval}"
 		fullEntityName = f"input_number.{completeEntityName}"
-		if (self.hass != 'undefined'):
-			existingState = self.hass.get_state(fullEntityName)
-			#if (existingState == None):
-			self.uiLogger.logAndPrint(f"Creating entity [{fullEntityName}, existing state: [{existingState}]")
-
-			self.hass.set_state(fullEntityName, state=0.1,attributes={
+		if (self.entityRegistry != 'undefined'):
+			#entities which already exist with the same attributes are not written again
+			created = self.entityRegistry.create(fullEntityName, 0.1, {
 				"unique_id": f"{fullEntityName}",
 				"name": f"EDC {dataType.capitalize()} {interval.capitalize()} for EAN: {ean}",
 				"icon" : "mdi:database-arrow-down",
 				"state_class": "measurement",
 				"unit_of_measurement": "kWh"
 			})
-			#else: 
-		#		self.uiLogger.logAndPrint(f"Entity exists [{fullEntityName}, with state: [{existingState}]")
+			if (created):
+				self.uiLogger.logAndPrint(f"Creating entity [{fullEntityName}]")
 		return completeEntityName
 
 
-	def exportFile(self, i, ean: AnyStr, entityName, intervals: List[Interval], dataResolver, calculator: partial, dataType: AnyStr, grouping: GroupingOptions):
-		fileName = f"{dataType}_export_{ean}_{grouping}.csv"
-		fileName = (self.dataDirectory / fileName)
-		self.uiLogger.logAndPrint(f"Exporting file [{fileName.resolve()}]")
-		exportFile = fileName.open("w", encoding ="utf-8")
-		exportFile.write(f"{self.exportHeader}\n")
-		
-		for interval in intervals:
-			statisticDate: datetime = self.parseIntervalStart(interval)
-			data = dataResolver(interval)
-			value = calculator(data[i])
-
-			self.writeData(exportFile, entityName, statisticDate, value)
+	#rows (statistic date, value) of one entity which should be uploaded
+	def statisticRows(self, i, entityName, intervals: IntervalTable, dataResolver, calculator: partial, grouping: GroupingOptions):
+		#all intervals of the EAN are calculated at once on the columnar data
+		values = calculator(dataResolver(intervals)[i])
+		rows = []
+		for statisticDate, value in zip(intervals.startDates(), values.tolist()):
+			rows.append((statisticDate, value))
 			#in case on month statistic we need to set end date otherwise sometimes HA screw up last day of the month
 			if (grouping == "1m"):
 				lastDay = calendar.monthrange(statisticDate.year, statisticDate.month)[1]
@@ -148,30 +258,84 @@ class EdcExporter:
 				# If last day is in the future, use today instead
 				if lastDayDate > datetime.now():
 					lastDayDate = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
-				self.writeData(exportFile, entityName, lastDayDate, value)
-			
+				rows.append((lastDayDate, value))
+
+		if (self.exportFingerprints != 'undefined'):
+			allRows = len(rows)
+			rows = self.exportFingerprints.changedRows(entityName, rows)
+			if (len(rows) == 0):
+				self.uiLogger.logAndPrint(f"No changed statistics for [{entityName}], skipping upload")
+			else:
+				self.uiLogger.logAndPrint(f"Delta export of [{entityName}]: {len(rows)}/{allRows} rows changed")
+		return rows
+
+	#entityRows: list of (entityName, rows), a single file might contain any number of statistics
+	def exportFile(self, fileName: AnyStr, entityRows) -> Path:
+		fileName = (self.dataDirectory / fileName)
+		self.uiLogger.logAndPrint(f"Exporting file [{fileName.resolve()}]")
+		exportFile = fileName.open("w", encoding ="utf-8")
+		exportFile.write(f"{self.exportHeader}\n")
+		for entityName, rows in entityRows:
+			for statisticDate, value in rows:
+				self.writeData(exportFile, entityName, statisticDate, value)
 		exportFile.close()
 		return fileName
-	
-	def parseIntervalStart(self, interval: Interval) -> datetime:
-		return datetime.strptime(f"{interval.start}", "%Y-%m-%d %H:%M:%S")
+
+	#splits the batch into uploads of at most maxRowsPerFile rows, statistics of one entity are never split
+	def uploadBatchedStatistics(self):
+		batch = self.uploadBatch
+		self.uploadBatch = []
+		fileEntities = []
+		fileRows = 0
+		part = 0
+		for entityName, rows in batch + [(None, [])]:
+			if (len(fileEntities) > 0 and (entityName == None or fileRows + len(rows) > self.maxRowsPerFile)):
+				part += 1
+				self.uiLogger.logAndPrint(f"Batch [{part}] with {len(fileEntities)} statistics and {fileRows} rows")
+				self.uploadStatistics(f"statistics_export_{part}.csv", fileEntities)
+				fileEntities = []
+				fileRows = 0
+			if (entityName != None):
+				fileEntities.append((entityName, rows))
+				fileRows += len(rows)
+
+	#fileName is used when the statistics go through the file import
+	def uploadStatistics(self, fileName: AnyStr, entityRows):
+		uploaded = False
+		if (self.recorderStatistics != 'undefined'):
+			try:
+				with self.haCalls:
+					self.recorderStatistics.importStatistics(entityRows)
+				uploaded = True
+			except Exception as e:
+				self.uiLogger.logAndPrint(f"Direct recorder import failed: {e}. Falling back to file import", Colors.YELLOW)
+		if (not uploaded):
+			file = self.exportFile(fileName, entityRows)
+			uploaded = self.uploadFile(file)
+		if (uploaded and self.exportFingerprints != 'undefined'):
+			for entityName, _ in entityRows:
+				self.exportFingerprints.markUploaded(entityName)
 	
 	def writeData(self, exportFile, entityName, statisticDate, value):
-		statisticDateStr = statisticDate.strftime('%d.%m.%Y %H:%M')
+		statisticDateStr = formatStatisticDate(statisticDate)
 		exportFile.write(f"input_number.{entityName};kWh;{statisticDateStr};{(value):.2f};0\n")
 		
 	
-	def uploadFile(self, file: Path):
+	#returns True when the file was handed over to HA
+	def uploadFile(self, file: Path) -> bool:
 		if (self.hass != 'undefined'):
 			relativePath = str(file.resolve()).replace("/homeassistant/", "")
 			self.uiLogger.logAndPrint(f"Uploading statistic file [{relativePath}]")
-			self.hass.call_service(
-				"import_statistics/import_from_file",
-				filename=relativePath,
-				timezone_identifier="Europe/Vienna",
-				delimiter=";",
-				decimal="."
-			)
+			with self.haCalls:
+				self.hass.call_service(
+					"import_statistics/import_from_file",
+					filename=relativePath,
+					timezone_identifier="Europe/Vienna",
+					delimiter=";",
+					decimal="."
+				)
+			return True
+		return False
 			
 	def exportProducerEans(self, parsedData: Csv):
 		eans = ';'.join(map(lambda ean: ean.name, parsedData.distributionEans))
@@ -192,6 +356,8 @@ class EdcExporter:
 			except:
 				existingEans: set = set([])			
 			
+			if (all(ean.name in existingEans for ean in eans)):
+				return
 			for ean in eans:
 				existingEans.add(ean.name)
 			existingEansStr = json.dumps(list(existingEans))
@@ -200,6 +366,7 @@ class EdcExporter:
 		
 		
 		
+	#works for a single interval as well as for the whole IntervalTable
 	def resolveProducer(self, interval: Interval) -> List[Measurement]:
 		return interval.distributions
 	
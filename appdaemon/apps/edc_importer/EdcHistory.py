@@ -0,0 +1,196 @@
+import json
+import os
+import threading
+import datetime
+from pathlib import Path
+from typing import Dict, List, Optional
+from zoneinfo import ZoneInfo
+import numpy as np
+from edc import Csv, Ean, IntervalTable, MeasurementTable, toTimestamp, fromTimestamp
+from EdcLogger import EdcLogger
+from Colors import Colors
+
+
+class EdcHistory:
+    """Append-only, memory-mapped history of all 15 minute readings.
+
+    A building block for reports over long periods - the app only writes it (``keepHistory``), toCsv reads it back.
+
+    Time is divided into 15 minute UTC slots counted from ``baseTime``. Every EAN has its own file of float64
+    rows (before, after, missed) per slot, ``group.f64`` keeps the interval sums (sharing, missed, production) and
+    ``starts.i64`` the local interval start used for grouping. Slots which were never imported hold NaN/NO_START.
+    Each import overwrites its slots (an EAN missing in the import is cleared there), files only grow at the end (a backfill older than ``baseTime`` rewrites them).
+
+    Opening reads just the manifest, the data files are memory-mapped on first use, so it takes milliseconds no
+    matter how long the history is.
+    """
+
+    SLOT_SECONDS = 15 * 60
+    NO_START = np.iinfo(np.int64).min
+    VALUES = 3
+    uiLogger: EdcLogger = 'undefined'
+
+    def __init__(self, historyDirectory, logger: EdcLogger, timezone: str = "Europe/Prague"):
+        self.historyDirectory = Path(historyDirectory)
+        self.uiLogger = logger
+        self.timezone = ZoneInfo(timezone)
+        # merges from concurrent imports must not interleave
+        self.__lock = threading.Lock()
+        os.makedirs(self.historyDirectory, exist_ok=True)
+        self.__readManifest()
+
+    def __readManifest(self):
+        manifestFile = self.historyDirectory / "manifest.json"
+        if manifestFile.exists():
+            manifest = json.loads(manifestFile.read_text())
+        else:
+            manifest = {"baseTime": None, "slots": 0, "eans": {}}
+        self.baseTime: Optional[int] = manifest["baseTime"]
+        self.slots: int = manifest["slots"]
+        # ean name -> "producer" / "consumer"
+        self.eans: Dict[str, str] = manifest["eans"]
+        self.__maps: Dict[str, np.memmap] = {}
+
+    def __writeManifest(self):
+        manifestFile = self.historyDirectory / "manifest.json"
+        temporaryFile = manifestFile.with_suffix(".tmp")
+        temporaryFile.write_text(json.dumps({"baseTime": self.baseTime, "slots": self.slots, "eans": self.eans}))
+        os.replace(temporaryFile, manifestFile)
+
+    def producerEans(self) -> List[str]:
+        return sorted(name for name, kind in self.eans.items() if kind == "producer")
+
+    def consumerEans(self) -> List[str]:
+        return sorted(name for name, kind in self.eans.items() if kind == "consumer")
+
+    def __file(self, name: str) -> Path:
+        return self.historyDirectory / name
+
+    def __eanFile(self, ean: str) -> str:
+        return f"{self.eans[ean]}_{ean}.f64"
+
+    def __map(self, fileName: str, dtype, columns: int) -> np.memmap:
+        if fileName not in self.__maps:
+            shape = (self.slots, columns) if columns > 1 else (self.slots,)
+            if self.slots == 0:
+                return np.zeros(shape, dtype=dtype)
+            self.__maps[fileName] = np.memmap(self.__file(fileName), dtype=dtype, mode="r+", shape=shape)
+        return self.__maps[fileName]
+
+    def starts(self) -> np.ndarray:
+        return self.__map("starts.i64", np.int64, 1)
+
+    def groupValues(self) -> np.ndarray:
+        return self.__map("group.f64", np.float64, self.VALUES)
+
+    # (slots x [before, after, missed]) of one EAN
+    def eanValues(self, ean: str) -> np.ndarray:
+        return self.__map(self.__eanFile(ean), np.float64, self.VALUES)
+
+    def __dataFiles(self) -> Dict[str, tuple]:
+        files = {"starts.i64": (np.int64, 1, self.NO_START), "group.f64": (np.float64, self.VALUES, np.nan)}
+        for ean in self.eans:
+            files[self.__eanFile(ean)] = (np.float64, self.VALUES, np.nan)
+        return files
+
+    def __flush(self):
+        for valuesMap in self.__maps.values():
+            valuesMap.flush()
+        self.__maps = {}
+
+    def __resize(self, firstSlot: int, slots: int):
+        """Makes the files cover slots [firstSlot, firstSlot + slots) of the current base. New slots are empty."""
+        self.__flush()
+        for fileName, (dtype, columns, empty) in self.__dataFiles().items():
+            path = self.__file(fileName)
+            rowBytes = np.dtype(dtype).itemsize * columns
+            existingRows = path.stat().st_size // rowBytes if path.exists() else 0
+            emptyRow = np.full(columns, empty, dtype=dtype).tobytes()
+            if firstSlot < 0 or existingRows < self.slots:
+                # prepending (backfill before baseTime) or a new EAN - the file is written again
+                existing = path.read_bytes() if path.exists() else b""
+                existing += emptyRow * (self.slots - existingRows)
+                temporaryFile = path.with_suffix(".tmp")
+                with open(temporaryFile, "wb") as file:
+                    file.write(emptyRow * -min(firstSlot, 0))
+                    file.write(existing)
+                    file.write(emptyRow * (slots - self.slots + min(firstSlot, 0)))
+                os.replace(temporaryFile, path)
+            elif slots > existingRows:
+                # growing at the end - append only
+                with open(path, "ab") as file:
+                    file.write(emptyRow * (slots - existingRows))
+        if firstSlot < 0:
+            self.baseTime += firstSlot * self.SLOT_SECONDS
+        self.slots = slots
+
+    def utcSlots(self, starts: np.ndarray) -> np.ndarray:
+        """Converts contiguous local 15 minute interval starts to UTC times.
+
+        Only the first start is converted with the time zone. The others follow the 15 minute cadence - the DST
+        jumps in local time (+75 and -45 minutes) are regular 15 minute steps in UTC.
+        """
+        first = fromTimestamp(starts[0]).replace(tzinfo=self.timezone)
+        firstUtc = int(first.timestamp())
+        steps = np.diff(starts)
+        correction = np.where(steps == 4500, -3600, np.where(steps == -2700, 3600, 0))
+        return firstUtc + (starts - starts[0]) + np.concatenate(([0], np.cumsum(correction)))
+
+    def merge(self, parsedCsv: Csv):
+        intervals: IntervalTable = parsedCsv.getIntervals()
+        utcTimes = self.utcSlots(intervals.starts)
+        with self.__lock:
+            if self.baseTime is None:
+                self.baseTime = int(utcTimes[0])
+            slots = (utcTimes - self.baseTime) // self.SLOT_SECONDS
+
+            for ean in parsedCsv.distributionEans:
+                self.eans.setdefault(ean.name, "producer")
+            for ean in parsedCsv.consumerEans:
+                self.eans.setdefault(ean.name, "consumer")
+            firstSlot = min(int(slots[0]), 0)
+            self.__resize(firstSlot, max(self.slots, int(slots[-1]) + 1) - firstSlot)
+            slots = slots - firstSlot
+
+            self.starts()[slots] = intervals.starts
+            self.groupValues()[slots] = np.stack((intervals.sumSharing, intervals.sumMissed, intervals.sumProduction), axis=1)
+            for eans, measurements in ((parsedCsv.distributionEans, intervals.distributions), (parsedCsv.consumerEans, intervals.consumers)):
+                for column, ean in enumerate(eans):
+                    self.eanValues(ean.name)[slots] = np.stack((measurements.before[:, column], measurements.after[:, column], measurements.missed[:, column]), axis=1)
+            # an EAN which is not in the export any more has no readings for these intervals
+            mergedEans = {ean.name for ean in parsedCsv.distributionEans + parsedCsv.consumerEans}
+            for ean in self.eans:
+                if ean not in mergedEans:
+                    self.eanValues(ean)[slots] = np.nan
+            self.__flush()
+            self.__writeManifest()
+        self.uiLogger.logAndPrint(f"History updated with [{parsedCsv.dateFrom} - {parsedCsv.dateTo}], {self.slots} slots, {len(self.eans)} EANs", Colors.GREEN)
+
+    def toCsv(self, dateFrom: Optional[datetime.datetime] = None, dateTo: Optional[datetime.datetime] = None, filename: str = "history") -> Csv:
+        """Builds a Csv of the imported intervals with local start in [dateFrom, dateTo). EANs missing in part
+        of the history read as 0 there, like empty cells of an export. Per-interval errors are not kept."""
+        starts = self.starts()
+        selected = starts != self.NO_START
+        if dateFrom is not None:
+            selected &= starts >= toTimestamp(dateFrom)
+        if dateTo is not None:
+            selected &= starts < toTimestamp(dateTo)
+        rows = np.flatnonzero(selected)
+        assert len(rows) > 0, "No history for the requested interval"
+
+        def measurements(eans: List[str]) -> MeasurementTable:
+            values = np.zeros((len(rows), len(eans), self.VALUES))
+            for column, ean in enumerate(eans):
+                values[:, column, :] = np.nan_to_num(self.eanValues(ean)[rows], nan=0.0)
+            return MeasurementTable(values[:, :, 0].copy(), values[:, :, 1].copy(), values[:, :, 2].copy())
+
+        groupValues = self.groupValues()[rows]
+        intervals = IntervalTable(
+            np.array(starts[rows]),
+            groupValues[:, 0].copy(),
+            groupValues[:, 1].copy(),
+            groupValues[:, 2].copy(),
+            measurements(self.producerEans()),
+            measurements(self.consumerEans()),
+        )
+        return Csv(filename, intervals, [Ean(name, -1) for name in self.producerEans()], [Ean(name, -1) for name in self.consumerEans()])
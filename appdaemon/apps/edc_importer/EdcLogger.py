@@ -1,4 +1,5 @@
-from typing import AnyStr
+import threading
+from typing import AnyStr, List
 from datetime import datetime as dt
 from Colors import Colors
 
@@ -21,4 +22,39 @@ class EdcLogger:
         timeString = ""
         if (timestamp == True):
             timeString = dt.now().strftime('%Y-%m-%d %H:%M:%S') + ": " 
-        print(f"{timeString} {color}{message}{Colors.RESET}")
\ No newline at end of file
+        print(f"{timeString} {color}{message}{Colors.RESET}")
+
+
+class BufferedLogger:
+    """Logger shared by worker threads. Messages of a thread which collects are kept and replayed later by the
+    owner of the work, so parallel jobs still log in a deterministic order."""
+
+    def __init__(self, logger: EdcLogger):
+        self.logger = logger
+        self.local = threading.local()
+
+    def collect(self):
+        self.local.messages = []
+
+    # stops collecting in this thread
+    def collected(self) -> List:
+        messages = getattr(self.local, "messages", None) or []
+        self.local.messages = None
+        return messages
+
+    def replay(self, messages: List):
+        for method, args in messages:
+            getattr(self.logger, method)(*args)
+
+    def logAndPrint(self, message: AnyStr, color: Colors = Colors.RESET, timestamp = True):
+        self.__write("logAndPrint", message, color, timestamp)
+
+    def print(self, message: AnyStr, color: Colors = Colors.RESET, timestamp = True):
+        self.__write("print", message, color, timestamp)
+
+    def __write(self, method, *args):
+        messages = getattr(self.local, "messages", None)
+        if (messages == None):
+            getattr(self.logger, method)(*args)
+        else:
+            messages.append((method, args))
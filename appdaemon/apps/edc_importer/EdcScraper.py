@@ -1,8 +1,9 @@
 import platform
 import subprocess
-import os,glob
+import os
 import shutil
-import time
+import threading
+from collections import deque
 from datetime import datetime as dt
 from selenium import webdriver
 from selenium.webdriver.chrome.service import Service
@@ -11,13 +12,15 @@ from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.common.keys import Keys
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
-from selenium.common.exceptions import TimeoutException
+from selenium.common.exceptions import TimeoutException, WebDriverException
 from selenium.webdriver.common.action_chains import ActionChains
 import calendar
 import logging
 from pathlib import Path
+from typing import List
 from Colors import Colors
 from EdcLogger import EdcLogger
+from DownloadWatcher import DownloadWatcher
 import utils
 
 
@@ -29,22 +32,48 @@ class EdcScraper:
     browserExecutable = 'undefined'
     exportGroup = 'undefined'
     exportedFile = "automatic-export"
+    # sub-directories of the download directory which survive the clean-up before each scrape
+    persistentDirectories = ["cache", "history", "state", "backfill"]
     uiLogger: EdcLogger = 'undefined' 
+    # seconds to wait for the portal in each step, override by the timeouts argument
+    defaultTimeouts = {
+        "page": 30,      # page (re)load
+        "login": 30,     # Keycloak login round-trip
+        "element": 10,   # element to become clickable / dropdown to open or close
+        "export": 120,   # export to be generated and listed in reports
+        "download": 60,  # export file to be completely downloaded
+    }
+    # never: no debug output, on-failure: debug output only of a failed scrape, always: screenshot of every step
+    screenshotModes = ["never", "on-failure", "always"]
     
-    def __init__(self, browserExecutable, username, password, exportGroup, downloadDirectory, logger: EdcLogger):
+    #sessionIdleTimeout: seconds the logged-in browser is kept for the next scrape, 0 closes it after every scrape
+    #timeouts: per-step wait limits, see defaultTimeouts
+    #screenshotMode: see screenshotModes, screenshotBuffer: steps kept for a failed scrape in on-failure mode
+    def __init__(self, browserExecutable, username, password, exportGroup, downloadDirectory, logger: EdcLogger, sessionIdleTimeout = 600, timeouts = {}, screenshotMode = "on-failure", screenshotBuffer = 10):
         self.browserExecutable = browserExecutable
         self.username = username
         self.password = password
         self.exportGroup = exportGroup
         self.downloadDirectory = downloadDirectory
         self.uiLogger = logger
+        self.sessionIdleTimeout = sessionIdleTimeout
+        self.timeouts = {**self.defaultTimeouts, **timeouts}
+        if (screenshotMode not in self.screenshotModes):
+            raise ValueError(f"Unknown screenshot mode [{screenshotMode}], use one of {self.screenshotModes}")
+        self.screenshotMode = screenshotMode
+        #(step, page source) of the last steps, written only when the scrape fails
+        self.debugSteps = deque(maxlen=screenshotBuffer)
+        #one browser shared by all scrapes, scrapes are serialized on it
+        self.driver = None
+        self.sessionLock = threading.RLock()
+        self.idleTimer = None
         
         self.prepareDataDirectories()
         self.uiLogger.logAndPrint("EDC Scraper Initialized")
         
     def prepareDataDirectories(self):
         os.makedirs(self.downloadDirectory, exist_ok=True)
-        self.cleanUpDirectory(self.downloadDirectory+"/")
+        self.cleanUpDirectory(self.downloadDirectory+"/", self.persistentDirectories)
         os.makedirs(self.downloadDirectory + "/debug", exist_ok=True)
         
     def printInstalledModules(self):
@@ -66,23 +95,122 @@ class EdcScraper:
     def scrapeData(self, month, year):
         scrapeStartTime = dt.now()
         self.uiLogger.logAndPrint("********************* Scraping EDC data  *********************", Colors.CYAN)
-        self.prepareDataDirectories()
-        
-        driver = self.initializeChromeDriver()
+        with self.sessionLock:
+            self.cancelIdleShutdown()
+            self.prepareDataDirectories()
+            self.debugSteps.clear()
+            try:
+                driver = self.acquireSession()
+                fileName = self.monthFileName(year, month)
+                self.exportMonth(driver, month, year, fileName)
+                downloadedFile = self.downloadExport(driver, fileName)
+                self.scheduleIdleShutdown()
+                return Path(downloadedFile)
+            except Exception as e:
+                self.uiLogger.logAndPrint(f"ERROR: Unable to scrape data - exiting {str(e)}", Colors.RED)
+                self.flushDebugSteps(self.driver, "failure")
+                #the page might be in any state, next scrape starts with a fresh browser
+                self.closeSession()
+                raise Exception("Unable to scrape EDC data")
+            finally:
+                scrapeEndTime = dt.now()
+                scrapeDuration = scrapeEndTime - scrapeStartTime
+                self.uiLogger.logAndPrint(f"********************* Finished in {scrapeDuration} *********************", Colors.CYAN)
+
+    #exports several months in one portal session: all exports are requested first and downloaded as they complete,
+    #onDownloaded(year, month, path) is called for each of them right after its download
+    def scrapeMonths(self, months: List[tuple], onDownloaded):
+        scrapeStartTime = dt.now()
+        self.uiLogger.logAndPrint(f"********************* Scraping EDC data for {len(months)} months *********************", Colors.CYAN)
+        with self.sessionLock:
+            self.cancelIdleShutdown()
+            self.prepareDataDirectories()
+            self.debugSteps.clear()
+            #the files stay for the parsing after the scrape, only the previous backfill is removed
+            backfillDirectory = Path(self.downloadDirectory, "backfill")
+            shutil.rmtree(backfillDirectory, ignore_errors=True)
+            os.makedirs(backfillDirectory)
+            try:
+                driver = self.acquireSession()
+                fileNames = {(year, month): self.monthFileName(year, month) for year, month in months}
+                for year, month in months:
+                    self.exportMonth(driver, month, year, fileNames[(year, month)])
+                for year, month in months:
+                    downloadedFile = self.downloadExport(driver, fileNames[(year, month)])
+                    onDownloaded(year, month, downloadedFile.replace(backfillDirectory / downloadedFile.name))
+                self.scheduleIdleShutdown()
+            except Exception as e:
+                self.uiLogger.logAndPrint(f"ERROR: Unable to scrape data - exiting {str(e)}", Colors.RED)
+                self.flushDebugSteps(self.driver, "failure")
+                self.closeSession()
+                raise Exception("Unable to scrape EDC data")
+            finally:
+                scrapeDuration = dt.now() - scrapeStartTime
+                self.uiLogger.logAndPrint(f"********************* Finished in {scrapeDuration} *********************", Colors.CYAN)
+
+    #unique name of the export, the report of this scrape can't be mistaken for an older report in the portal
+    def monthFileName(self, year: int, month: int) -> str:
+        return f"{self.exportedFile}-{year:04d}-{month:02d}-{dt.now().strftime('%Y%m%d-%H%M%S')}"
+
+    #returns the logged-in browser, starts it and logs in only when needed
+    def acquireSession(self):
+        if (self.driver != None and not self.isSessionAlive(self.driver)):
+            self.uiLogger.logAndPrint("Browser session lost, starting a new one", Colors.YELLOW)
+            self.closeSession()
+        if (self.driver == None):
+            self.driver = self.initializeChromeDriver()
+        self.loadMainPage(self.driver)
+        if (self.isLoggedIn(self.driver)):
+            self.uiLogger.logAndPrint("Reusing logged-in browser session", Colors.GREEN)
+        else:
+            self.login(self.driver)
+        return self.driver
+
+    def isSessionAlive(self, driver) -> bool:
         try:
-            self.loadMainPage(driver)
-            self.login(driver)
-            self.exportMonth(driver, month, year)
-            downloadedFile = self.downloadExport(driver)
-            return Path(downloadedFile)
-        except Exception as e:
-            self.uiLogger.logAndPrint(f"ERROR: Unable to scrape data - exiting {str(e)}", Colors.RED)
-            raise Exception("Unable to scrape EDC data")
-        finally:
-            self.logout(driver)
-            scrapeEndTime = dt.now()
-            scrapeDuration = scrapeEndTime - scrapeStartTime
-            self.uiLogger.logAndPrint(f"********************* Finished in {scrapeDuration} *********************", Colors.CYAN)
+            driver.current_url
+            return True
+        except WebDriverException:
+            return False
+
+    #logged out portal offers the login button, expired sessions end up there as well
+    def isLoggedIn(self, driver) -> bool:
+        return len(driver.find_elements(By.XPATH, self.loginButtonXpath)) == 0
+
+    def scheduleIdleShutdown(self):
+        if (self.sessionIdleTimeout <= 0):
+            self.closeSession()
+            return
+        self.idleTimer = threading.Timer(self.sessionIdleTimeout, self.closeIdleSession)
+        self.idleTimer.daemon = True
+        self.idleTimer.start()
+
+    def cancelIdleShutdown(self):
+        if (self.idleTimer != None):
+            self.idleTimer.cancel()
+            self.idleTimer = None
+
+    def closeIdleSession(self):
+        with self.sessionLock:
+            if (self.driver != None):
+                self.uiLogger.logAndPrint(f"Browser idle for {self.sessionIdleTimeout}s, closing it")
+                self.closeSession()
+
+    #logs out and quits the browser
+    def closeSession(self):
+        with self.sessionLock:
+            self.cancelIdleShutdown()
+            if (self.driver == None):
+                return
+            driver = self.driver
+            self.driver = None
+            try:
+                self.logout(driver)
+            finally:
+                try:
+                    driver.quit()
+                except Exception as e:
+                    self.uiLogger.logAndPrint(f"Failed to quit browser: {e}")
         
     def initializeChromeDriver(self):
         chrome_options = Options()
@@ -112,58 +240,65 @@ class EdcScraper:
     def loadMainPage(self, driver):
         try:
             driver.get("https://portal.edc-cr.cz/")  # Change to the website's login page
+            # the app is rendered once it offers either login or the menu of a logged-in user
+            self.waitFor(driver, "page", EC.any_of(
+                EC.presence_of_element_located((By.XPATH, self.loginButtonXpath)),
+                EC.presence_of_element_located((By.XPATH, self.menuButtonXpath))))
             self.uiLogger.logAndPrint("EDC Website loaded")
         except:
             self.uiLogger.logAndPrint(f"ERROR: Unable to load website - exiting", Colors.RED)
             raise Exception("Unable to open website - exiting")
-        time.sleep(2)  # Allow time for the page to load
+
+    def waitFor(self, driver, step, condition):
+        return WebDriverWait(driver, self.timeouts[step]).until(condition, f"Timed out in step [{step}] after {self.timeouts[step]}s")
         
+    loginButtonXpath = "//div[contains(@class, 'MuiBox-root')]//button[contains(text(), 'Přihlášení')]"
+    menuButtonXpath = "//button[@title='Menu']"
+
     def login(self, driver):
         self.uiLogger.logAndPrint("Loading login page")
         try:
-            loginLink = driver.find_element(By.XPATH, "//div[contains(@class, 'MuiBox-root')]//button[contains(text(), 'Přihlášení')]")
-            loginLink.click()
-            time.sleep(3)  # Allow time for the page to load
+            self.clickOnElement(driver, self.loginButtonXpath)
+            # Keycloak login form
+            username_field = self.waitFor(driver, "login", EC.visibility_of_element_located((By.XPATH, "//input[@id='username']")))
             self.createScreenshot(driver, "pre_login")
                        
-            username_field = driver.find_element(By.XPATH, "//input[@id='username']")
             password_field = driver.find_element(By.XPATH, "//input[@id='password']")
-            loginButton = driver.find_element(By.XPATH, "//button[@id='kc-login']")
             # Enter login credentials and click the button
             username_field.send_keys(self.username)
             password_field.send_keys(self.password)
             # Wait until the login button is clickable
-            wait = WebDriverWait(driver, 10)  # 10-second timeout
-            loginButton = wait.until(EC.element_to_be_clickable((By.XPATH, "//button[@id='kc-login']")))
+            loginButton = self.waitFor(driver, "element", EC.element_to_be_clickable((By.XPATH, "//button[@id='kc-login']")))
             
             self.createScreenshot(driver, "login")
             loginButton.click()
-            time.sleep(2)
+            # back in the portal as a logged-in user
+            self.waitFor(driver, "login", EC.presence_of_element_located((By.XPATH, self.menuButtonXpath)))
             self.createScreenshot(driver, "logged")
         except:
             self.uiLogger.logAndPrint(f"ERROR: Failed to enter login details or find and click the login button", Colors.RED)
             raise Exception("Failed to find or click the login button")
-        # Allow time for login processing
-        time.sleep(2)
         
-    def exportMonth(self, driver, month=dt.now().month, year=dt.now().year):
+    def exportMonth(self, driver, month, year, fileName):
         self.uiLogger.logAndPrint(f"Exporting data {year}/{month}")
         lastDay = calendar.monthrange(year, month)[1]
         try:
             driver.get("https://portal.edc-cr.cz/sprava-dat/zobrazeni-dat")
-            time.sleep(2)
+            groupLabelXpath = "//label[@title='Výběr dat pro skupinu sdílení.']"
+            self.waitFor(driver, "page", EC.element_to_be_clickable((By.XPATH, groupLabelXpath)))
             self.createScreenshot(driver, "export_page")
-            self.clickOnElement(driver, "//label[@title='Výběr dat pro skupinu sdílení.']")
-            time.sleep(3)
+            self.clickOnElement(driver, groupLabelXpath)
             self.createScreenshot(driver, "export_group")
 
             self.clickOnElement(driver, "//span[normalize-space()='Vyberte']/..")
-            time.sleep(1)  # Wait for dropdown to open and populate
+            # Wait for dropdown to open and populate
+            optionXpath = "//li[@role='option']"
+            self.waitFor(driver, "element", EC.visibility_of_all_elements_located((By.XPATH, optionXpath)))
 
             # Find export group option by iterating through options
             # This safely handles special characters like apostrophes, quotes, etc.
             self.uiLogger.logAndPrint(f"Searching for export group: [{self.exportGroup}]")
-            options = driver.find_elements(By.XPATH, "//li[@role='option']")
+            options = driver.find_elements(By.XPATH, optionXpath)
 
             target_option = None
             for option in options:
@@ -178,7 +313,8 @@ class EdcScraper:
 
             self.uiLogger.logAndPrint(f"Found export group, clicking...")
             target_option.click()
-            time.sleep(1)  # Wait for selection to process
+            # Wait for selection to process - the dropdown closes
+            self.waitFor(driver, "element", EC.invisibility_of_element_located((By.XPATH, optionXpath)))
 
             exportTypeXpath = "//span[normalize-space()='Denní hodnoty']"
             #for now use only daily since month values are crappy 
@@ -207,51 +343,41 @@ class EdcScraper:
             self.fillDateSegment(driver, day_to_xpath, f"{lastDay:02d}", f"{month:02d}", f"{year:04d}", "dateTo")
 
             self.createScreenshot(driver, "dateTo_filled")
-            time.sleep(1)  # Allow date pickers to update
             self.createScreenshot(driver, "export_data")
             self.clickOnElement(driver, "//button[normalize-space()='Export']")
             self.createScreenshot(driver, "export_confirm")
-            fileNameField = driver.find_element(By.XPATH, "//input[@id='fileName']")
+            fileNameField = self.waitFor(driver, "element", EC.visibility_of_element_located((By.XPATH, "//input[@id='fileName']")))
             fileNameField.clear()
-            fileNameField.send_keys(self.exportedFile)
+            fileNameField.send_keys(fileName)
             #confirm export dialog
             self.clickOnElement(driver, "//button[normalize-space()='Exportovat']")
-            time.sleep(10) # wait for export
-            #go to reports
+            #go to reports once the export is requested
+            self.clickOnElement(driver, "//button[normalize-space()='Přejít na reporty']", "export")
             self.createScreenshot(driver, "report_dialog")
-            self.clickOnElement(driver, "//button[normalize-space()='Přejít na reporty']")
         except:
             self.uiLogger.logAndPrint(f"ERROR: Failed to export data", Colors.RED)
             logging.exception("Failed")
             raise Exception("Failed to export data")
-        # Allow time for login processing
-        time.sleep(5)
         
     def useMonthExport(self, month: int, year: int)-> bool:
-        now = dt.now()
-        lastMonthsInterval = utils.getLastMonths(dt.today(), 2)[::-1]
-        lastMonthYear = lastMonthsInterval[0][0]
-        lastMonth = lastMonthsInterval[0][1]
-        #if (((now.month -1) == month) and (now.day <= 9)) or (month == now.month):
-        if ((month == now.month and now.year == year) or (month == lastMonth and year == lastMonthYear and now.day <=9)):
-            #there is 5 days period to adjust month data plus a Bulgarian constant
-            return False
-        return True
+        return utils.useMonthExport(month, year)
 
-    def downloadExport(self, driver):
-        self.clickOnElement(driver, "//table[contains(@class,'MuiTable-root')]//tr[1]//p[text()='Stáhnout']")
-        
-        files = glob.glob(self.downloadDirectory + '/*')
-        maxFile = max(files, key=os.path.getctime)
-        path = Path(maxFile)
-        newPath = path.rename(Path(path.parent, f"{self.exportedFile}.csv"))
+    #downloads the report exported as fileName
+    def downloadExport(self, driver, fileName) -> Path:
+        reportXpath = f"(//table[contains(@class,'MuiTable-root')]//tr[.//*[contains(text(), '{fileName}')]])[1]"
+        #files already in the directory are ignored, only the new download of the export counts
+        with DownloadWatcher(self.downloadDirectory, fileName, self.uiLogger) as watcher:
+            # the download link shows up once the export is generated
+            self.clickOnElement(driver, f"{reportXpath}//p[text()='Stáhnout']", "export")
+            path = watcher.waitForDownload(self.timeouts["download"])
+        newPath = path.replace(Path(path.parent, f"{fileName}.csv"))
         return newPath
 
-    def clickOnElement(self, driver, xpath):
+    #waits until the element is clickable, step selects the timeout
+    def clickOnElement(self, driver, xpath, step = "element"):
         self.uiLogger.logAndPrint(f"   :clicking on xpath[{xpath}]", Colors.YELLOW, False)
-        link = driver.find_element(By.XPATH, xpath)
+        link = self.waitFor(driver, step, EC.element_to_be_clickable((By.XPATH, xpath)))
         link.click()
-        time.sleep(1)
 
     def fillDateSegment(self, driver, xpath, day, month, year, segment_name="segment"):
         """
@@ -267,28 +393,21 @@ class EdcScraper:
             self.uiLogger.logAndPrint(f"   :filling {segment_name} with value [{day}.{month}.{year}]", Colors.YELLOW, False)
 
             # Wait for segment to be clickable
-            segment = WebDriverWait(driver, 10).until(
-                EC.element_to_be_clickable((By.XPATH, xpath))
-            )
+            segment = self.waitFor(driver, "element", EC.element_to_be_clickable((By.XPATH, xpath)))
 
             # Click to focus and select the segment (MUI auto-selects on click)
             segment.click()
-            time.sleep(0.2)  # Small delay for focus to settle
+            self.waitFor(driver, "element", lambda d: d.switch_to.active_element == segment)
 
             # Type new value (MUI auto-advances to next field when complete)
             segment.send_keys(str(Keys.HOME))
-            time.sleep(0.3)
             segment.send_keys(str(Keys.LEFT))
-            time.sleep(0.3)
             segment.send_keys(str(Keys.LEFT))
-            time.sleep(0.3)
             segment.send_keys(str(day))
-            time.sleep(0.3)
-            time.sleep(0.3)
             segment.send_keys(str(month))
-            time.sleep(0.3)        
             segment.send_keys(str(year))
-            time.sleep(0.3)  # Wait for auto-advance
+            # Wait until the picker took the whole date
+            self.waitFor(driver, "element", lambda d: str(year) in (segment.get_attribute("value") or ""))
 
             self.uiLogger.logAndPrint(f"   :{segment_name} filled successfully", Colors.GREEN, False)
             return True
@@ -301,26 +420,47 @@ class EdcScraper:
         self.uiLogger.logAndPrint(f"Logging out")
         try:
             #self.loadMainPage(driver) #just in case reload the app
-            menuLink = driver.find_element(By.XPATH, "//button[@title='Menu']")
             self.createScreenshot(driver, "before_logout")
-            menuLink.click()
-            time.sleep(1)
-            
-            logoutLink = driver.find_element(By.XPATH, "//p[contains(text(), 'Odhlásit')]")
-            logoutLink.click()
-            time.sleep(1)
+            self.clickOnElement(driver, self.menuButtonXpath)
+            self.clickOnElement(driver, "//p[contains(text(), 'Odhlásit')]")
+            self.waitFor(driver, "page", EC.presence_of_element_located((By.XPATH, self.loginButtonXpath)))
             self.createScreenshot(driver, "after_logout")
         except:
             if (failInError == False):
                 self.logout(driver, True)
                 
     def createScreenshot(self, driver, page):
-        body = driver.find_element(By.TAG_NAME, 'body')
-        body.screenshot(self.downloadDirectory+f"/debug/{page}.png")
+        if (self.screenshotMode == "always"):
+            body = driver.find_element(By.TAG_NAME, 'body')
+            body.screenshot(self.downloadDirectory+f"/debug/{page}.png")
+        elif (self.screenshotMode == "on-failure"):
+            #the page source costs no rendering, the screenshot is taken only of the failed page
+            try:
+                self.debugSteps.append((page, driver.page_source))
+            except WebDriverException:
+                pass
+
+    #writes the buffered steps and a screenshot of the current page after a failure
+    def flushDebugSteps(self, driver, page):
+        if (self.screenshotMode == "never"):
+            return
+        steps = list(self.debugSteps)
+        self.debugSteps.clear()
+        try:
+            for index, (step, source) in enumerate(steps):
+                with open(self.downloadDirectory+f"/debug/{index:02d}_{step}.html", "w", encoding="utf-8") as file:
+                    file.write(source)
+            if (driver != None):
+                driver.save_screenshot(self.downloadDirectory+f"/debug/{page}.png")
+            self.uiLogger.logAndPrint(f"Debug output of the failed scrape written to {self.downloadDirectory}/debug")
+        except Exception as e:
+            self.uiLogger.logAndPrint(f"Unable to write debug output: {e}", Colors.YELLOW)
             
-    def cleanUpDirectory(self, folderPath):
+    def cleanUpDirectory(self, folderPath, keep = []):
         self.uiLogger.logAndPrint(f"Clean-up directory {folderPath}")
         for filename in os.listdir(folderPath):
+            if filename in keep:
+                continue
             file_path = os.path.join(folderPath, filename)
             try:
                 if os.path.isfile(file_path) or os.path.islink(file_path):
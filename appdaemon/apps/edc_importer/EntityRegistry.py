@@ -0,0 +1,76 @@
+import threading
+from typing import Dict
+from EdcLogger import EdcLogger
+
+
+class EntityRegistry:
+    """Entities the exporter keeps in Home Assistant.
+
+    ``refresh`` reads all states of the domain at once. An entity which already exists with the same attributes is
+    not written again. State updates are queued (the last value of an entity wins) and ``flush`` writes only the
+    states which differ from HA, so an unchanged group costs no HA calls at all. The parallel export uses it from
+    several threads, the states are read and written under a lock.
+    """
+
+    uiLogger: EdcLogger = 'undefined'
+
+    def __init__(self, hass, logger: EdcLogger, haCalls: threading.BoundedSemaphore, domain: str = "input_number"):
+        self.hass = hass
+        self.uiLogger = logger
+        self.haCalls = haCalls
+        self.domain = domain
+        # entity -> {"state": ..., "attributes": {...}} as known to HA
+        self.states: Dict[str, dict] = {}
+        self.pendingStates: Dict[str, float] = {}
+        self.lock = threading.Lock()
+
+    def refresh(self):
+        with self.haCalls:
+            states = self.hass.get_state(self.domain, attribute="all")
+        with self.lock:
+            self.states = dict(states or {})
+            self.pendingStates = {}
+
+    def isCurrent(self, entityId: str, attributes: dict) -> bool:
+        with self.lock:
+            existing = self.states.get(entityId)
+        if (existing == None):
+            return False
+        existingAttributes = existing.get("attributes", {})
+        return all(existingAttributes.get(key) == value for key, value in attributes.items())
+
+    def create(self, entityId: str, state, attributes: dict) -> bool:
+        """Creates the entity unless it already exists with these attributes, returns True when it was written."""
+        if (self.isCurrent(entityId, attributes)):
+            return False
+        with self.haCalls:
+            self.hass.set_state(entityId, state=state, attributes=attributes)
+        with self.lock:
+            self.states[entityId] = {"state": state, "attributes": dict(attributes)}
+        return True
+
+    def queueState(self, entityId: str, state: float):
+        with self.lock:
+            self.pendingStates[entityId] = state
+
+    def flush(self) -> int:
+        with self.lock:
+            pendingStates = self.pendingStates
+            self.pendingStates = {}
+        written = 0
+        for entityId, state in pendingStates.items():
+            with self.lock:
+                existing = self.states.get(entityId, {}).get("state")
+            try:
+                unchanged = existing != None and float(existing) == state
+            except (TypeError, ValueError):
+                unchanged = False
+            if (unchanged):
+                continue
+            with self.haCalls:
+                self.hass.set_state(entityId, state=state)
+            with self.lock:
+                self.states.setdefault(entityId, {"attributes": {}})["state"] = state
+            written += 1
+        self.uiLogger.logAndPrint(f"Entity states written: {written}, unchanged: {len(pendingStates) - written}")
+        return written
@@ -0,0 +1,76 @@
+import json
+import os
+import threading
+from datetime import datetime, timedelta
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, List, Tuple
+from EdcLogger import EdcLogger
+from Colors import Colors
+
+
+class ExportFingerprints:
+    """Statistic rows last uploaded to Home Assistant, per entity.
+
+    A row is identified by its start and fingerprinted by the value as written to the export file, so the exporter
+    can leave out rows HA already has. Rows more than ``retentionDays`` older than the newest row of the entity are
+    forgotten (a re-import of such an old month is then uploaded in full). Delete the state file to force a full upload.
+    The parallel export calls it from several threads, the state is guarded by a lock.
+    """
+
+    uiLogger: EdcLogger = 'undefined'
+
+    def __init__(self, stateFile, logger: EdcLogger, retentionDays: int = 100):
+        self.stateFile = Path(stateFile)
+        self.uiLogger = logger
+        self.retentionDays = retentionDays
+        # entity -> {start: value}
+        self.uploaded: Dict[str, Dict[str, str]] = {}
+        # entity -> rows of the export file waiting for the upload
+        self.pending: Dict[str, Dict[str, str]] = {}
+        self.__lock = threading.Lock()
+        if self.stateFile.exists():
+            try:
+                self.uploaded = json.loads(self.stateFile.read_text())
+            except ValueError as e:
+                self.uiLogger.logAndPrint(f"Ignoring unreadable export state [{self.stateFile}]: {e}", Colors.YELLOW)
+
+    @staticmethod
+    @lru_cache(maxsize=65536)
+    def rowKey(statisticDate: datetime) -> str:
+        return statisticDate.strftime("%Y-%m-%d %H:%M")
+
+    @staticmethod
+    def rowValue(value) -> str:
+        return f"{value:.2f}"
+
+    def changedRows(self, entityName: str, rows: List[Tuple[datetime, float]]) -> List[Tuple[datetime, float]]:
+        """Returns rows which are new or whose value differs from the last upload, they become pending for the entity."""
+        with self.__lock:
+            uploaded = dict(self.uploaded.get(entityName, {}))
+        changed = []
+        pending = {}
+        for statisticDate, value in rows:
+            key = self.rowKey(statisticDate)
+            fingerprint = self.rowValue(value)
+            if uploaded.get(key) != fingerprint:
+                changed.append((statisticDate, value))
+                pending[key] = fingerprint
+        with self.__lock:
+            self.pending[entityName] = pending
+        return changed
+
+    def markUploaded(self, entityName: str):
+        with self.__lock:
+            self.uploaded.setdefault(entityName, {}).update(self.pending.pop(entityName, {}))
+
+    def save(self):
+        with self.__lock:
+            for entityName, rows in self.uploaded.items():
+                if rows:
+                    cutoff = self.rowKey(datetime.strptime(max(rows), "%Y-%m-%d %H:%M") - timedelta(days=self.retentionDays))
+                    self.uploaded[entityName] = {key: value for key, value in rows.items() if key >= cutoff}
+            os.makedirs(self.stateFile.parent, exist_ok=True)
+            temporaryFile = self.stateFile.with_suffix(".tmp")
+            temporaryFile.write_text(json.dumps(self.uploaded))
+            os.replace(temporaryFile, self.stateFile)
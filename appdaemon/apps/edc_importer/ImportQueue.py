@@ -0,0 +1,90 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List
+from EdcLogger import EdcLogger
+
+
+class ImportJob:
+
+    def __init__(self, months: List[tuple], groupings: List, retries: int, attempt: int):
+        self.months = list(months)
+        self.groupings = list(groupings)
+        self.retries = retries
+        self.attempt = attempt
+
+
+class ImportQueue:
+    """Import jobs of the app, coalesced per (year, month).
+
+    A job for a month which is already queued is merged into the queued job: its groupings are added to a single
+    month job, a queued range only gives the month up to a job of its own when new groupings are requested for it
+    (the other months of the range keep their groupings). A job for a month which is being imported with the same
+    or more groupings is dropped. A range is split: only its months which are neither queued nor running are
+    imported by the new job. Jobs run one at a time on a single thread, so there is never more than one browser -
+    the shared EdcScraper session - open for the imports.
+    """
+
+    uiLogger: EdcLogger = 'undefined'
+
+    def __init__(self, runner: Callable, logger: EdcLogger):
+        self.runner = runner
+        self.uiLogger = logger
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="edc-import")
+        self.lock = threading.Lock()
+        self.pending: Dict[tuple, ImportJob] = {}
+        # (year, month) -> groupings being imported
+        self.running: Dict[tuple, List] = {}
+
+    def submit(self, months: List[tuple], groupings: List, retries: int = 0, attempt: int = 0) -> bool:
+        """Queues the import of the months, returns False when all of them are already queued or running."""
+        with self.lock:
+            newMonths = []
+            jobs = []
+            for month in months:
+                if (month in self.running and all(grouping in self.running[month] for grouping in groupings)):
+                    self.uiLogger.logAndPrint(f"Import of [{month[0]}/{month[1]}] is running, request ignored")
+                elif (month in self.pending):
+                    job = self.pending[month]
+                    missing = [grouping for grouping in groupings if grouping not in job.groupings]
+                    if (len(job.months) == 1 or len(missing) == 0):
+                        job.groupings += missing
+                        job.retries = max(job.retries, retries)
+                        self.uiLogger.logAndPrint(f"Import of [{month[0]}/{month[1]}] is already queued, request merged")
+                    else:
+                        #the other months of the queued range must not get the new groupings
+                        job.months.remove(month)
+                        splitJob = ImportJob([month], job.groupings + missing, max(job.retries, retries), job.attempt)
+                        self.pending[month] = splitJob
+                        jobs.append(splitJob)
+                        self.uiLogger.logAndPrint(f"Import of [{month[0]}/{month[1]}] is queued in a range, queued separately with groupings {splitJob.groupings}")
+                else:
+                    newMonths.append(month)
+            if (len(newMonths) > 0):
+                job = ImportJob(newMonths, groupings, retries, attempt)
+                for month in newMonths:
+                    self.pending[month] = job
+                jobs.append(job)
+        for job in jobs:
+            self.executor.submit(self.run, job)
+        return len(jobs) > 0
+
+    def run(self, job: ImportJob):
+        with self.lock:
+            #months might have been split off while the job was queued
+            months = list(job.months)
+            groupings = list(job.groupings)
+            for month in months:
+                if (self.pending.get(month) is job):
+                    del self.pending[month]
+                self.running[month] = groupings
+        if (len(months) == 0):
+            return
+        try:
+            self.runner(months, groupings, job.retries, job.attempt)
+        finally:
+            with self.lock:
+                for month in months:
+                    self.running.pop(month, None)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
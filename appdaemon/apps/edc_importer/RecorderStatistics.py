@@ -0,0 +1,69 @@
+import asyncio
+from datetime import datetime
+from typing import List, Tuple
+from zoneinfo import ZoneInfo
+from EdcLogger import EdcLogger
+
+
+class RecorderStatistics:
+    """Imports statistic rows straight into the Home Assistant recorder.
+
+    Uses the ``recorder/import_statistics`` websocket command over the websocket of the AppDaemon HASS plugin
+    (AppDaemon 4.5+), one message per statistic, all messages of a call sent concurrently. Rows are the
+    (naive local start, value) pairs of the file export, written as ``state`` with ``sum`` 0 like the file import does.
+    """
+
+    uiLogger: EdcLogger = 'undefined'
+
+    def __init__(self, hass, logger: EdcLogger, timezone: str = "Europe/Vienna", timeout: int = 120):
+        self.hass = hass
+        self.uiLogger = logger
+        self.timezone = ZoneInfo(timezone)
+        self.timeout = timeout
+
+    def plugin(self):
+        try:
+            return self.hass.AD.plugins.get_plugin_object(self.hass.namespace)
+        except AttributeError:
+            return None
+
+    # the websocket API of the plugin is not available in older AppDaemon versions
+    def available(self) -> bool:
+        return hasattr(self.plugin(), "websocket_send_json")
+
+    def statisticsMessage(self, entityName: str, rows: List[Tuple[datetime, float]], unit: str = "kWh") -> dict:
+        statisticId = f"input_number.{entityName}"
+        return {
+            "type": "recorder/import_statistics",
+            "metadata": {
+                "statistic_id": statisticId,
+                "source": "recorder",
+                "name": None,
+                "unit_of_measurement": unit,
+                "has_mean": False,
+                "has_sum": True,
+            },
+            "stats": [
+                {
+                    "start": statisticDate.replace(tzinfo=self.timezone).isoformat(),
+                    "state": round(float(value), 2),
+                    "sum": 0,
+                }
+                for statisticDate, value in rows
+            ],
+        }
+
+    def importStatistics(self, entityRows: List[Tuple[str, List[Tuple[datetime, float]]]]):
+        """Sends all statistics and waits for HA to accept them, raises when any of them is rejected."""
+        plugin = self.plugin()
+        messages = [self.statisticsMessage(entityName, rows) for entityName, rows in entityRows]
+
+        async def send():
+            return await asyncio.gather(*(plugin.websocket_send_json(silent=True, **message) for message in messages))
+
+        # AppDaemon callbacks run in worker threads, the websocket lives in the AppDaemon event loop
+        results = asyncio.run_coroutine_threadsafe(send(), self.hass.AD.loop).result(self.timeout)
+        failed = [entityName for (entityName, _), result in zip(entityRows, results) if not (result and result.get("success"))]
+        if failed:
+            raise RuntimeError(f"Recorder rejected {len(failed)} of {len(messages)} statistics, first [{failed[0]}]")
+        self.uiLogger.logAndPrint(f"Imported {len(messages)} statistics with {sum(len(rows) for _, rows in entityRows)} rows into recorder")
@@ -6,12 +6,20 @@ import copy
 import functools
 import threading
 import sys
+import os
+import io
+import shutil
+import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+from collections.abc import Sequence
 
 # Define types/interfaces as classes or TypedDicts for structure and type hinting
 # Python doesn't have direct interface equivalents, using classes for data structures
 # Union types are represented using typing.Literal
 
-from typing import List, Dict, Any, Optional, Set, Literal, TypedDict
+from typing import List, Dict, Any, Optional, Set, Literal, TypedDict, Tuple, Iterator
 
 DisplayUnit = Literal["kWh", "kW"]
 ProduceConsume = Literal["produce", "consume"]
@@ -54,6 +62,376 @@ class Interval:
         self.errors = errors
 
 
+# Interval starts are kept as naive (wall clock) timestamps - seconds since this epoch
+TIMESTAMP_EPOCH = datetime.datetime(1970, 1, 1)
+ONE_SECOND = datetime.timedelta(seconds=1)
+
+
+def toTimestamp(date: datetime.datetime) -> int:
+    return (date - TIMESTAMP_EPOCH) // ONE_SECOND
+
+
+def fromTimestamp(timestamp: int) -> datetime.datetime:
+    return TIMESTAMP_EPOCH + datetime.timedelta(seconds=int(timestamp))
+
+
+def _cellProperty(name: str) -> property:
+    def getter(self) -> float:
+        return float(getattr(self._table, name)[self._row, self._column])
+
+    def setter(self, value: float):
+        getattr(self._table, name)[self._row, self._column] = value
+
+    return property(getter, setter)
+
+
+def _rowProperty(name: str) -> property:
+    def getter(self) -> float:
+        return float(getattr(self._table, name)[self._row])
+
+    def setter(self, value: float):
+        getattr(self._table, name)[self._row] = value
+
+    return property(getter, setter)
+
+
+class MeasurementTable:
+    """Before/after/missed values of a set of EANs stored as float64 arrays shaped (intervals x EANs).
+
+    Indexing by EAN returns a Measurement whose attributes are the whole columns, so calculators written
+    for a single Measurement work on all intervals at once.
+    """
+
+    def __init__(self, before: np.ndarray, after: np.ndarray, missed: np.ndarray):
+        self.before = before
+        self.after = after
+        self.missed = missed
+
+    @staticmethod
+    def zeros(intervals: int, eans: int) -> 'MeasurementTable':
+        return MeasurementTable(np.zeros((intervals, eans)), np.zeros((intervals, eans)), np.zeros((intervals, eans)))
+
+    def __len__(self) -> int:
+        return self.before.shape[1]
+
+    def __getitem__(self, ean: int) -> Measurement:
+        return Measurement(self.before[:, ean], self.after[:, ean], self.missed[:, ean])
+
+    def rows(self, rows) -> 'MeasurementTable':
+        return MeasurementTable(self.before[rows], self.after[rows], self.missed[rows])
+
+    def copy(self) -> 'MeasurementTable':
+        return MeasurementTable(self.before.copy(), self.after.copy(), self.missed.copy())
+
+    # Reorders the EAN columns, column i of the result is column order[i]
+    def permuteColumns(self, order: List[int]):
+        self.before = self.before[:, order]
+        self.after = self.after[:, order]
+        self.missed = self.missed[:, order]
+
+
+class MeasurementView(Measurement):
+    """Measurement of one EAN in one interval. Reads and writes go straight to the backing MeasurementTable."""
+
+    def __init__(self, table: MeasurementTable, row: int, column: int):
+        self._table = table
+        self._row = row
+        self._column = column
+
+    before = _cellProperty("before")
+    after = _cellProperty("after")
+    missed = _cellProperty("missed")
+
+
+class MeasurementRow(Sequence):
+    """Measurements of all EANs of a MeasurementTable in one interval."""
+
+    def __init__(self, table: MeasurementTable, row: int):
+        self._table = table
+        self._row = row
+
+    def __len__(self) -> int:
+        return len(self._table)
+
+    def __getitem__(self, column: int) -> MeasurementView:
+        if column < 0:
+            column += len(self)
+        if column < 0 or column >= len(self):
+            raise IndexError("EAN index out of range")
+        return MeasurementView(self._table, self._row, column)
+
+
+class IntervalView(Interval):
+    """Interval backed by one row of an IntervalTable. Views are created on access and hold no values."""
+
+    def __init__(self, table: 'IntervalTable', row: int):
+        self._table = table
+        self._row = row
+
+    @property
+    def start(self) -> datetime.datetime:
+        return self._table.startAt(self._row)
+
+    sumSharing = _rowProperty("sumSharing")
+    sumMissed = _rowProperty("sumMissed")
+    sumProduction = _rowProperty("sumProduction")
+
+    @property
+    def distributions(self) -> MeasurementRow:
+        return MeasurementRow(self._table.distributions, self._row)
+
+    @property
+    def consumers(self) -> MeasurementRow:
+        return MeasurementRow(self._table.consumers, self._row)
+
+    @property
+    def errors(self) -> List[str]:
+        return self._table.errors.get(self._row, [])
+
+
+class IntervalTable(Sequence):
+    """Columnar storage of intervals.
+
+    ``starts`` holds the interval starts as int64 timestamps (see toTimestamp), the sums are float64 vectors and
+    the per-EAN values are MeasurementTables. Only intervals with errors have an entry in ``errors``.
+    Items of the sequence are IntervalView objects, so the table can be used wherever List[Interval] was.
+    """
+
+    def __init__(
+        self,
+        starts: np.ndarray,
+        sumSharing: np.ndarray,
+        sumMissed: np.ndarray,
+        sumProduction: np.ndarray,
+        distributions: MeasurementTable,
+        consumers: MeasurementTable,
+        errors: Optional[Dict[int, List[str]]] = None,
+    ):
+        self.starts = starts
+        self.sumSharing = sumSharing
+        self.sumMissed = sumMissed
+        self.sumProduction = sumProduction
+        self.distributions = distributions
+        self.consumers = consumers
+        self.errors = errors if errors is not None else {}
+        self._startDates: Optional[List[datetime.datetime]] = None
+
+    @staticmethod
+    def fromIntervals(intervals: List[Interval]) -> 'IntervalTable':
+        assert_condition(len(intervals) > 0, "No intervals")
+        builder = IntervalTableBuilder(len(intervals[0].distributions), len(intervals[0].consumers))
+        for interval in intervals:
+            builder.append(interval)
+        return builder.build()
+
+    @staticmethod
+    def concatenate(tables: List['IntervalTable']) -> 'IntervalTable':
+        assert_condition(len(tables) > 0, "No intervals")
+        if len(tables) == 1:
+            return tables[0]
+
+        def concatenateTable(measurements: List[MeasurementTable]) -> MeasurementTable:
+            return MeasurementTable(
+                np.concatenate([m.before for m in measurements]),
+                np.concatenate([m.after for m in measurements]),
+                np.concatenate([m.missed for m in measurements]),
+            )
+
+        errors: Dict[int, List[str]] = {}
+        offset = 0
+        for table in tables:
+            for row, rowErrors in table.errors.items():
+                errors[offset + row] = rowErrors
+            offset += len(table)
+        return IntervalTable(
+            np.concatenate([table.starts for table in tables]),
+            np.concatenate([table.sumSharing for table in tables]),
+            np.concatenate([table.sumMissed for table in tables]),
+            np.concatenate([table.sumProduction for table in tables]),
+            concatenateTable([table.distributions for table in tables]),
+            concatenateTable([table.consumers for table in tables]),
+            errors,
+        )
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def __getitem__(self, row: int) -> IntervalView:
+        if row < 0:
+            row += len(self)
+        if row < 0 or row >= len(self):
+            raise IndexError("Interval index out of range")
+        return IntervalView(self, row)
+
+    @staticmethod
+    def zeros(intervals: int, distributions: int, consumers: int) -> 'IntervalTable':
+        return IntervalTable(
+            np.zeros(intervals, dtype=np.int64),
+            np.zeros(intervals),
+            np.zeros(intervals),
+            np.zeros(intervals),
+            MeasurementTable.zeros(intervals, distributions),
+            MeasurementTable.zeros(intervals, consumers),
+        )
+
+    # returns a copy with the given number of rows, new rows are zero
+    def resized(self, intervals: int) -> 'IntervalTable':
+        result = IntervalTable.zeros(intervals, len(self.distributions), len(self.consumers))
+        rows = min(intervals, len(self))
+        result.starts[:rows] = self.starts[:rows]
+        for name in ("sumSharing", "sumMissed", "sumProduction"):
+            getattr(result, name)[:rows] = getattr(self, name)[:rows]
+        for target, source in ((result.distributions, self.distributions), (result.consumers, self.consumers)):
+            for name in ("before", "after", "missed"):
+                getattr(target, name)[:rows] = getattr(source, name)[:rows]
+        result.errors = {row: errors for row, errors in self.errors.items() if row < rows}
+        return result
+
+    def setInterval(self, row: int, interval: Interval):
+        self.starts[row] = toTimestamp(interval.start)
+        self._startDates = None
+        self.sumSharing[row] = interval.sumSharing
+        self.sumMissed[row] = interval.sumMissed
+        self.sumProduction[row] = interval.sumProduction
+        for table, measurements in ((self.distributions, interval.distributions), (self.consumers, interval.consumers)):
+            for column, measurement in enumerate(measurements):
+                table.before[row, column] = measurement.before
+                table.after[row, column] = measurement.after
+                table.missed[row, column] = measurement.missed
+        if len(interval.errors) > 0:
+            self.errors[int(row)] = list(interval.errors)
+        else:
+            self.errors.pop(int(row), None)
+
+    def startAt(self, row: int) -> datetime.datetime:
+        return fromTimestamp(self.starts[row])
+
+    # All interval starts as datetimes, converted at once and kept for the next callers
+    def startDates(self) -> List[datetime.datetime]:
+        if self._startDates is None:
+            self._startDates = self.starts.astype("datetime64[s]").tolist()
+        return self._startDates
+
+    def groupStarts(self, grouping: GroupingOptions) -> np.ndarray:
+        """Returns the first row of every group. A group is a run of consecutive rows sharing the same 1h/1d/1m bucket."""
+        if grouping == "15m":
+            return np.arange(len(self))
+        elif grouping == "1h":
+            keys = self.starts // 3600
+        elif grouping == "1d":
+            keys = self.starts // 86400
+        elif grouping == "1m":
+            keys = self.starts.astype("datetime64[s]").astype("datetime64[M]").astype(np.int64)
+        else:
+            raise ValueError("Unknown grouping option")  # TS throw new Error()
+        return np.flatnonzero(np.concatenate(([True], keys[1:] != keys[:-1])))
+
+    def accumulateRows(self, groupStarts: np.ndarray) -> 'IntervalTable':
+        """Merges consecutive rows into groups beginning at groupStarts. Rows are added in order, like accumulateInterval."""
+        groupStarts = np.asarray(groupStarts, dtype=np.int64)
+
+        def accumulateTable(table: MeasurementTable) -> MeasurementTable:
+            return MeasurementTable(
+                segmentedSum(table.before, groupStarts),
+                segmentedSum(table.after, groupStarts),
+                segmentedSum(table.missed, groupStarts),
+            )
+
+        errors: Dict[int, List[str]] = {}
+        errorRows = sorted(self.errors)
+        for group, row in zip(np.searchsorted(groupStarts, errorRows, side="right") - 1, errorRows):
+            errors.setdefault(int(group), []).extend(self.errors[row])
+
+        sums = segmentedSum(np.stack((self.sumSharing, self.sumMissed, self.sumProduction), axis=1), groupStarts)
+        return IntervalTable(
+            self.starts[groupStarts],
+            sums[:, 0].copy(),
+            sums[:, 1].copy(),
+            sums[:, 2].copy(),
+            accumulateTable(self.distributions),
+            accumulateTable(self.consumers),
+            errors,
+        )
+
+
+def segmentedSum(values: np.ndarray, groupStarts: np.ndarray) -> np.ndarray:
+    """Sums the rows of every group of consecutive rows beginning at groupStarts.
+
+    Rows are added strictly in order, so the result is bit-identical to accumulating intervals one by one
+    (np.add.reduceat sums pairwise and would not be). Few long groups (months) are accumulated group by group,
+    many short groups (hours, days) are reduced together with one vectorized addition per row offset.
+    """
+    lengths = np.diff(np.append(groupStarts, len(values)))
+    if len(groupStarts) < lengths.max(initial=0):
+        result = np.empty((len(groupStarts),) + values.shape[1:], dtype=values.dtype)
+        for group, start in enumerate(groupStarts):
+            result[group] = np.add.accumulate(values[start:start + lengths[group]], axis=0)[-1]
+        return result
+
+    result = values[groupStarts]
+    for offset in range(1, int(lengths.max(initial=1))):
+        active = np.flatnonzero(lengths > offset)
+        if len(active) == len(groupStarts):
+            result += values[groupStarts + offset]
+        else:
+            result[active] += values[groupStarts[active] + offset]
+    return result
+
+
+def toFixedPoint(kwh: np.ndarray) -> np.ndarray:
+    """kWh to whole hundredths like math_round(kwh * 100) (round half to even, 0.07*100 = 7.000000000000001).
+
+    The hundredths stay in float64: integers are exact there far beyond any energy in an export and the sharing
+    kernel then needs no int/float conversions.
+    """
+    return np.rint(kwh * 100)
+
+
+def shareRounds(toShare: np.ndarray, consumed: np.ndarray, allocationsFraction: np.ndarray, iterations: int) -> np.ndarray:
+    """EDC sharing of all intervals at once, in fixed point hundredths of kWh (see toFixedPoint).
+
+    toShare holds the production of every interval, consumed is (consumers x intervals). Every round each consumer
+    in turn gets min(its remaining consumption, trunc(energy at the start of the round * its allocation)), exactly
+    like the interval by interval loop of simulateSharing - only the loop over intervals is vectorized.
+    Returns the shared energy as (consumers x iterations x intervals).
+    """
+    toShare = toShare.copy()
+    consumed = consumed.copy()
+    shared = np.empty((consumed.shape[0], iterations, len(toShare)))
+    energyThisRound = np.empty(len(toShare))
+    for iteration in range(iterations):
+        energyThisRound[:] = toShare
+        for i in range(consumed.shape[0]):
+            share = shared[i, iteration]
+            # The EDC manual explicitly says they truncate down here
+            np.multiply(energyThisRound, allocationsFraction[i], out=share)
+            np.trunc(share, out=share)
+            np.minimum(consumed[i], share, out=share)
+            consumed[i] -= share
+            toShare -= share
+    return shared
+
+
+class IntervalTableBuilder:
+    """Packs intervals appended one by one into the arrays of an IntervalTable."""
+
+    def __init__(self, distributions: int, consumers: int, capacity: int = 3000):
+        self.__size = 0
+        self.__table = IntervalTable.zeros(capacity, distributions, consumers)
+
+    def __len__(self) -> int:
+        return self.__size
+
+    def append(self, interval: Interval):
+        if self.__size == len(self.__table):
+            self.__table = self.__table.resized(len(self.__table) * 2)
+        self.__table.setInterval(self.__size, interval)
+        self.__size += 1
+
+    def build(self) -> IntervalTable:
+        return self.__table.resized(self.__size)
+
+
 class OptimizedAllocation(TypedDict):
     weights: List[float]
     sharing: List[float]
@@ -247,8 +625,12 @@ def parseKwh(data: str) -> float:
 
 def getDate(explodedLine: List[str]) -> datetime.datetime:
     assert_condition(len(explodedLine) > 3, f'Cannot extract date - whole line is: "{";".join(explodedLine)}"')
-    day, month, year = explodedLine[0].split(".")
-    hour, minute = explodedLine[1].split(":")
+    return parseDateTime(explodedLine[0], explodedLine[1])
+
+
+def parseDateTime(date: str, time: str) -> datetime.datetime:
+    day, month, year = date.split(".")
+    hour, minute = time.split(":")
     # Note: Python month is 1-12, TS month is 0-11
     return datetime.datetime(
         int(year),
@@ -259,6 +641,57 @@ def getDate(explodedLine: List[str]) -> datetime.datetime:
     )
 
 
+# Characters of plain decimal kWh cells (float() alone would accept also e.g. "1e3", "inf" or "1_0")
+KWH_CHARACTERS = str.maketrans("", "", "0123456789.;-")
+
+
+def decodeKwhCells(explodedLines: List[List[str]], columns: int) -> Optional[np.ndarray]:
+    """Converts the kWh cells (everything after the date and times) of many lines to floats at once.
+
+    Czech decimal commas are replaced in one pass over the joined cells and all cells are converted by a single
+    np.array call, which parses every cell exactly like float(). Empty cells become NaN. Returns None when the cells
+    contain anything but plain decimal numbers - those lines are left to parseKwh, which reports the offending cell.
+    """
+    text = ";".join([";".join(line[3:3 + columns]) for line in explodedLines]).replace(",", ".")
+    if len(text.translate(KWH_CHARACTERS)) > 0:
+        return None
+    text = text.replace(";;", ";nan;").replace(";;", ";nan;")
+    if text.startswith(";"):
+        text = "nan" + text
+    if text.endswith(";"):
+        text = text + "nan"
+    cells = text.split(";")
+    if len(cells) != len(explodedLines) * columns:
+        return None
+    try:
+        values = np.array(cells, dtype=np.float64)
+    except ValueError:
+        # a malformed number like "1.2.3" or "-"
+        return None
+    return values.reshape(len(explodedLines), columns)
+
+
+def decodeStarts(dates: List[str], times: List[str]) -> np.ndarray:
+    """Converts the date and time columns to timestamps.
+
+    Each distinct date and time is parsed only once (a month has ~30 dates and 96 times) and the timestamp of every
+    line is assembled from them arithmetically, so no datetime is created per line.
+    """
+    uniqueDates, dateIndexes = np.unique(np.array(dates), return_inverse=True)
+    uniqueTimes, timeIndexes = np.unique(np.array(times), return_inverse=True)
+    days = np.array([toTimestamp(parseDateTime(date, "0:0")) for date in uniqueDates], dtype=np.int64)
+    seconds = np.array([toTimestamp(parseDateTime("1.1.1970", time)) for time in uniqueTimes], dtype=np.int64)
+    return days[dateIndexes.reshape(-1)] + seconds[timeIndexes.reshape(-1)]
+
+
+def sumColumns(values: np.ndarray) -> np.ndarray:
+    # Adds columns one by one starting from 0 - the same order as sumContainer over the measurements of a line
+    result = np.zeros(len(values))
+    for column in range(values.shape[1]):
+        result = result + values[:, column]
+    return result
+
+
 class Settings:
     displayUnit: DisplayUnit = "kWh"
     anonymizeEans = False
@@ -336,108 +769,86 @@ class Csv:
     consumerEans: List[Ean] = []
 
     filename: str
-    dateFrom: datetime.datetime
-    dateTo: datetime.datetime
+    dateFrom: Optional[datetime.datetime]
+    dateTo: Optional[datetime.datetime]
 
     # readonly #intervals: Interval[]; # TS private field
-    _Csv__intervals: List[Interval]  # Python name mangling for private
+    _Csv__intervals: Optional[IntervalTable]  # Python name mangling for private
 
-    # Used for optimizing sharing
-    # readonly #flatConsumed: Uint32Array; # TS private field, commented out
-    # _Csv__flatConsumed: List[int] # Python equivalent, commented out
+    # Used for optimizing sharing: production of the first distribution EAN and (consumers x intervals) consumption
+    # in fixed point, built on first use (see getFixedPointData)
+    _Csv__fixedPoint: Optional[Tuple[np.ndarray, np.ndarray]] = None
 
-    def __init__(self, filename: str, intervals: List[Interval], distributionEans: List[Ean], consumerEans: List[Ean]):
+    def __init__(
+        self,
+        filename: str,
+        intervals: Optional[IntervalTable],
+        distributionEans: List[Ean],
+        consumerEans: List[Ean],
+        fixedPoint: Optional[Tuple[np.ndarray, np.ndarray]] = None,
+    ):
         self.filename = filename
-        self._Csv__intervals = intervals
-        self.dateFrom = intervals[0].start
-        # self.dateTo = structuredClone(last(intervals).start); # TS structuredClone
-        self.dateTo = structured_clone(last(intervals).start)
-        self.dateTo = self.dateTo + datetime.timedelta(minutes=14)  # TS setMinutes
-
         # Copy EAN lists before sorting
         self.distributionEans = list(distributionEans)
         self.consumerEans = list(consumerEans)
+        self.__intervals = None
+        self.__fixedPoint = fixedPoint
+        # Without intervals (see fromFixedPoint) the EANs are in the order of the fixed point data and there are no dates
+        self.dateFrom = None
+        self.dateTo = None
+        if intervals is None:
+            assert_condition(fixedPoint is not None, "Csv needs the intervals or the fixed point data")
+            return
+
+        if not isinstance(intervals, IntervalTable):
+            intervals = IntervalTable.fromIntervals(intervals)
+        self.__intervals = intervals
+        self.dateFrom = intervals.startAt(0)
+        self.dateTo = intervals.startAt(len(intervals) - 1)
+        self.dateTo = self.dateTo + datetime.timedelta(minutes=14)  # TS setMinutes
 
-        # Sort columns
-        newDistributionEans: List[Ean] = []
-        newConsumerEans: List[Ean] = []
-
-        def findSmallestEan(eans: List[Ean]) -> int:
-            result = 0
-            for i in range(1, len(eans)):
-                if eans[i].name < eans[result].name:
-                    result = i
-            if result != 0:
-                console_log("Swapping EANs: ", eans[result].name, eans[0].name)
-            return result
-
-        while len(self.distributionEans) > 0:
-            index = findSmallestEan(self.distributionEans)
-            newDistributionEans.append(self.distributionEans[index])
-            for i in self._Csv__intervals:
-                # i.distributions.push(i.distributions[index]); # TS push
-                array_push(i.distributions, i.distributions[index])
-                # i.distributions.splice(index, 1); # TS splice
-                array_splice(i.distributions, index, 1)
-            # this.distributionEans.splice(index, 1); # TS splice
-            array_splice(self.distributionEans, index, 1)
-
-        while len(self.consumerEans) > 0:
-            index = findSmallestEan(self.consumerEans)
-            newConsumerEans.append(self.consumerEans[index])
-            for i in self._Csv__intervals:
-                # i.consumers.push(i.consumers[index]); # TS push
-                array_push(i.consumers, i.consumers[index])
-                # i.consumers.splice(index, 1); # TS splice
-                array_splice(i.consumers, index, 1)
-            # this.consumerEans.splice(index, 1); # TS splice
-            array_splice(self.consumerEans, index, 1)
-
-        self.distributionEans = newDistributionEans
-        self.consumerEans = newConsumerEans
-
-        # this.#flatConsumed = new Uint32Array(this.intervals.length * this.consumerEans.length); # Commented out
-        # self._Csv__flatConsumed = array_fill(len(self._Csv__intervals) * len(self.consumerEans), 0) # Python equivalent, commented out
-        # for (let i = 0; i < this.intervals.length; ++i) { # Commented out
-        #    for (let j = 0; j < this.consumerEans.length; ++j) { # Commented out
-        #        this.#flatConsumed[i * this.consumerEans.length + j] = Math.round( # Commented out
-        #            this.intervals[i].consumers[j].before * 100, # Commented out
-        #        ); # Commented out
-        #    } # Commented out
-        # } # Commented out
-
-    def getGroupedIntervals(self, grouping: GroupingOptions) -> List[Interval]:
+        # Sort columns by EAN name - one stable sort permutation applied to all intervals at once
+        def sortOrder(eans: List[Ean]) -> List[int]:
+            return sorted(range(len(eans)), key=lambda i: eans[i].name)
+
+        distributionOrder = sortOrder(self.distributionEans)
+        consumerOrder = sortOrder(self.consumerEans)
+        self.__intervals.distributions.permuteColumns(distributionOrder)
+        self.__intervals.consumers.permuteColumns(consumerOrder)
+        self.distributionEans = [self.distributionEans[i] for i in distributionOrder]
+        self.consumerEans = [self.consumerEans[i] for i in consumerOrder]
+        # the fixed point data follows the sorted columns
+        self.__fixedPoint = None
+
+    # A Csv of only the fixed point data (toShare, consumed) of getFixedPointData, its EANs in the same order. It has no
+    # intervals and no dates - enough for simulating and optimizing the sharing, e.g. in a worker process.
+    @classmethod
+    def fromFixedPoint(cls, distributionEans: List[Ean], consumerEans: List[Ean], toShare: np.ndarray, consumed: np.ndarray) -> 'Csv':
+        return cls("", None, distributionEans, consumerEans, fixedPoint=(toShare, consumed))
+
+    # The 15 minute intervals themselves (not a copy like getGroupedIntervals("15m")), must not be modified
+    def getIntervals(self) -> IntervalTable:
+        return self._Csv__intervals
+
+    # (toShare, consumed) of the 15 minute intervals as used by shareRounds, computed once per Csv, must not be modified
+    def getFixedPointData(self) -> Tuple[np.ndarray, np.ndarray]:
+        if self.__fixedPoint is None:
+            intervals = self.__intervals
+            toShare = toFixedPoint(intervals.distributions.before[:, 0])
+            consumed = np.ascontiguousarray(toFixedPoint(intervals.consumers.before).T)
+            toShare.flags.writeable = False
+            consumed.flags.writeable = False
+            self.__fixedPoint = (toShare, consumed)
+        return self.__fixedPoint
+
+    def getGroupedIntervals(self, grouping: GroupingOptions) -> IntervalTable:
         #dateFrom, dateTo = self._Csv__getDayFilterDates()
         timer = performance_now()
-        result: List[Interval] = []
-        for i in range(len(self._Csv__intervals)):
-            #if self._Csv__intervals[i].start < dateFrom or self._Csv__intervals[i].start > dateTo:
-            #    continue
-
-            mergeToLast = False
-            if len(result) > 0:
-                dateLast = self._Csv__intervals[i - 1].start
-                dateThis = self._Csv__intervals[i].start
-                if grouping == "15m":
-                    mergeToLast = False
-                elif grouping == "1h":
-                    mergeToLast = dateThis.hour == dateLast.hour
-                elif grouping == "1d":
-                    mergeToLast = dateThis.day == dateLast.day
-                elif grouping == "1m":
-                    mergeToLast = dateThis.month == dateLast.month
-                else:
-                    raise ValueError("Unknown grouping option")  # TS throw new Error()
-
-            if mergeToLast:
-                accumulateInterval(last(result), self._Csv__intervals[i])
-            else:
-                # result.push(structuredClone(this.#intervals[i])); # TS push, structuredClone
-                array_push(result, structured_clone(self._Csv__intervals[i]))
-
+        intervals = self._Csv__intervals
+        result = intervals.accumulateRows(intervals.groupStarts(grouping))
         console_log(
             "Merging intervals",
-            len(self._Csv__intervals),
+            len(intervals),
             "=>",
             len(result),
             "elapsed",
@@ -446,21 +857,29 @@ class Csv:
         )
         return result
     
+    def getGroupedIntervalsBatch(self, groupings: List[GroupingOptions]) -> Dict[GroupingOptions, IntervalTable]:
+        """Groups the intervals for all requested groupings, like getGroupedIntervals of each grouping.
+
+        Every grouping is summed from the 15 minute intervals in their original order, not from the grouping below it,
+        so the sums stay bit-identical to getGroupedIntervals and to the per-grouping export.
+        """
+        intervals = self.__intervals
+        return {grouping: intervals.accumulateRows(intervals.groupStarts(grouping)) for grouping in groupings}
+
     def calculateSummary(self, grouping: GroupingOptions) -> Summary:
-        grouped_intervals: List[Interval] = self.getGroupedIntervals(grouping)
+        grouped_intervals: IntervalTable = self.getGroupedIntervals(grouping)
         distributionStats = [EanStats() for _ in range(len(self.distributionEans))]
         consumerStats = [EanStats() for _ in range(len(self.consumerEans))]
-    
-        def accumulate(to: EanStats, from_: 'Measurement') -> None:
-            to.original_balance += from_.before
-            to.adjusted_balance += from_.after
-            to.missed_due_to_allocation += from_.missed
-    
-        for interval in grouped_intervals:
-            for i in range(len(interval.distributions)):
-                accumulate(distributionStats[i], interval.distributions[i])
-            for i in range(len(interval.consumers)):
-                accumulate(consumerStats[i], interval.consumers[i])
+
+        def accumulate(to: List[EanStats], from_: MeasurementTable) -> None:
+            before, after, missed = (segmentedSum(values, np.zeros(1, dtype=np.int64))[0] for values in (from_.before, from_.after, from_.missed))
+            for i in range(len(to)):
+                to[i].original_balance += float(before[i])
+                to[i].adjusted_balance += float(after[i])
+                to[i].missed_due_to_allocation += float(missed[i])
+
+        accumulate(distributionStats, grouped_intervals.distributions)
+        accumulate(consumerStats, grouped_intervals.consumers)
         return Summary(distributionStats, consumerStats)
 
     # return number of days in the data
@@ -496,31 +915,15 @@ class Csv:
             # resultDetailed.push(Array<number>(allocations.length).fill(0)); # TS push, Array.fill
             array_push(resultDetailed, array_fill(len(allocations), 0.0))
 
-        # Filter the intervals by time by calling getGroupedIntervals
-        for interval in self.getGroupedIntervals("15m"):
-            # To fixed point. Note that the rounding is necessary even here. 0.07*100 = 7.000000000000001
-            toShare = math_round(interval.distributions[0].before * 100)
-            # const consumed: number[] = interval.consumers.map((c) => Math.round(c.before * 100)); # TS map, Math.round
-            consumed: List[int] = array_map(interval.consumers, lambda c: math_round(c.before * 100))
-
-            for iteration in range(iterations):
-                energyThisRound = toShare
-                for i in range(len(consumed)):
-                    # Allocations are in %, so we need to divide by 100. The EDC manual explicitly says they truncate down here
-                    # const shared = Math.min( # TS Math.min
-                    #    consumed[i],
-                    #    Math.trunc(energyThisRound * (allocations[i] / 100)), # TS Math.trunc
-                    # );
-                    shared = math_min(
-                       consumed[i],
-                       math_trunc(energyThisRound * (allocations[i] / 100)),
-                    )
-                    consumed[i] -= shared
-                    toShare -= shared
-                    resultDetailed[iteration][i] += shared
-                    assert_condition(shared >= 0)
-                    assert_condition(toShare >= 0)
-                    assert_condition(consumed[i] >= 0)
+        toShare, consumed = self.getFixedPointData()
+        # Allocations are in %, so we need to divide by 100
+        shared = shareRounds(toShare, consumed, np.array(allocations) / 100, iterations)
+        assert_condition(bool((shared >= 0).all()))
+        # sums of whole hundredths, exact in any order
+        sharedPerRound = shared.sum(axis=2)
+        for iteration in range(iterations):
+            for i in range(len(allocations)):
+                resultDetailed[iteration][i] += int(sharedPerRound[i, iteration])
 
         # Go back from fixed point to floats
         # const resultEan = Array<number>(allocations.length).fill(0); # TS Array.fill
@@ -541,7 +944,7 @@ class Csv:
     # Fast version computing only final profit
     def simulateSharingFast(
         self,
-        filteredIntervals: List[Interval],
+        filteredIntervals: Optional[List[Interval]],
         allocations: List[float],
         costsPerKwh: List[float],
         iterations: int,
@@ -551,46 +954,33 @@ class Csv:
         assert_condition(len(self.distributionEans) == 1)
 
         # const allocationsFraction = allocations.map((i) => i / 100); # TS map
-        allocationsFraction: List[float] = array_map(allocations, lambda i: i / 100)
-        # const allocationsFraction = new Uint32Array(allocations.length); # Commented out
-        # for (let i = 0; i < allocations.length; ++i) { # Commented out
-        #    allocationsFraction[i] = allocations[i] / 100; # Commented out
-        # } # Commented out
+        allocationsFraction = np.array(allocations) / 100
 
         # We will run everything in integers multiplier by 100 to get fixed point 2 decimal places exact arithmetic
+        if filteredIntervals is None or filteredIntervals is self.__intervals:
+            toShare, consumed = self.getFixedPointData()
+        else:
+            if not isinstance(filteredIntervals, IntervalTable):
+                filteredIntervals = IntervalTable.fromIntervals(filteredIntervals)
+            # To fixed point. Note that the rounding is necessary even here. 0.07*100 = 7.000000000000001
+            toShare = toFixedPoint(filteredIntervals.distributions.before[:, 0])
+            consumed = np.ascontiguousarray(toFixedPoint(filteredIntervals.consumers.before).T)
 
-        # const flatConsumed = new Uint32Array(this.#flatConsumed); # Commented out
-        # flatConsumed = list(self._Csv__flatConsumed) # Python equivalent, commented out
-
-        # const profitPerEan = Array<number>(allocations.length).fill(0); # TS Array.fill
+        shared = shareRounds(toShare, consumed, allocationsFraction, iterations)
+        # profitPerEan[i] += shared * costsPerKwh[i] interval by interval, round by round - a running sum keeps that order
         profitPerEan: List[float] = array_fill(len(allocations), 0.0)
-        for interval in filteredIntervals:
-            # To fixed point. Note that the rounding is necessary even here. 0.07*100 = 7.000000000000001
-            toShare = math_round(interval.distributions[0].before * 100)
-
-            # const consumed = interval.consumers.map((c) => Math.round(c.before * 100)); # TS map, Math.round
-            consumed: List[int] = array_map(interval.consumers, lambda c: math_round(c.before * 100))
-
-            for iteration in range(iterations):
-                energyThisRound = toShare
-                for i in range(len(consumed)):
-                    # Allocations are in %, so we need to divide by 100. The EDC manual explicitly says they truncate down here
-                    # const shared = Math.min( # TS Math.min
-                    #    consumed[i],
-                    #    Math.trunc(energyThisRound * allocationsFraction[i]), # TS Math.trunc
-                    # );
-                    shared = math_min(
-                        consumed[i],
-                        math_trunc(energyThisRound * allocationsFraction[i]),
-                    )
-                    consumed[i] -= shared
-                    toShare -= shared
-                    profitPerEan[i] += shared * costsPerKwh[i]
-                    # console.log(shared); # Commented out
+        profits = np.empty((shared.shape[2], iterations))
+        for i in range(len(allocations)):
+            if len(profits) > 0:
+                np.multiply(shared[i].T, costsPerKwh[i], out=profits)
+                profitPerEan[i] = float(np.add.accumulate(profits.reshape(-1), out=profits.reshape(-1))[-1])
 
         return sumContainer(profitPerEan) / 100
 
-    # progressCallback is called at the end with final value
+    # progressCallback is called after every restart with the best result so far and at the end with final value.
+    # Restarts run in parallel on a pool of worker processes (os.cpu_count() by default, 1 runs them one by one in a
+    # background thread). The fixed point data is written once to a memory-mapped file the workers open read-only,
+    # instead of being pickled into every task. Returns the thread coordinating the restarts.
     def optimizeAllocation(
         self,
         sharingRounds: int,
@@ -599,39 +989,58 @@ class Csv:
         maxFails: int,
         restarts: int,
         progressCallback: callable,  # (resultSoFar: OptimizedAllocation, iteration: number) => void
-    ):
+        workers: Optional[int] = None,
+    ) -> threading.Thread:
         startTime = time.time()  # Using time.time() for wall clock time as in TS Date.now()
-        result = self._Csv__optimizeAllocationIteration(sharingRounds, costsPerKwh, algorithm, maxFails)
-
-        progress = 0
-
-        def iterate():
-            nonlocal progress, result  # Allow modifying outer scope variables
-            progress += 1
-            newResult = self._Csv__optimizeAllocationIteration(
-                sharingRounds,
-                costsPerKwh,
-                algorithm,
-                maxFails,
-            )
-            console_log(
-                f"Restart {progress} Achieved sharing {sumContainer(newResult['sharing'])} yielding {sumContainer(newResult['profit'])} CZK",
+        workers = workers or os.cpu_count() or 1
+        # the first result plus restarts (at least one) compared to it, as the chained setTimeout version did
+        iterations = 1 + max(restarts, 1)
+
+        def report(results: Iterator[OptimizedAllocation]):
+            result = None
+            for progress, newResult in enumerate(results):
+                if result is None:
+                    result = newResult
+                    continue
+                console_log(
+                    f"Restart {progress} Achieved sharing {sumContainer(newResult['sharing'])} yielding {sumContainer(newResult['profit'])} CZK",
+                )
+                if sumContainer(newResult['profit']) > sumContainer(result['profit']):
+                    result = newResult
+                # progressCallback(result, progress); # Call the callback
+                progressCallback(result, progress)
+            console_log("optimizeAllocation TOTAL took ", time.time() - startTime, " s")  # Using seconds for time.time()
+
+        def iterateInThread():
+            report(
+                self.__optimizeAllocationIteration(sharingRounds, costsPerKwh, algorithm, maxFails)
+                for _ in range(iterations)
             )
-            if sumContainer(newResult['profit']) > sumContainer(result['profit']):
-                result = newResult
-
-            # progressCallback(result, progress); # Call the callback
-            progressCallback(result, progress)
 
-            if progress < restarts:
-                # setTimeout(iterate, 0); # TS setTimeout
-                # Use threading.Timer to simulate non-blocking scheduling
-                threading.Timer(0, iterate).start()
-            else:
-                console_log("optimizeAllocation TOTAL took ", time.time() - startTime, " s")  # Using seconds for time.time()
-
-        # setTimeout(iterate, 0); # TS setTimeout
-        threading.Timer(0, iterate).start()  # Start the first iteration
+        def iterateInPool():
+            dataDirectory = tempfile.mkdtemp(prefix="edc-optimize-")
+            try:
+                toShare, consumed = self.getFixedPointData()
+                np.save(os.path.join(dataDirectory, "toShare.npy"), toShare)
+                np.save(os.path.join(dataDirectory, "consumed.npy"), consumed)
+                # spawn, forking a multi-threaded process is not safe
+                with ProcessPoolExecutor(max_workers=min(workers, iterations), mp_context=multiprocessing.get_context("spawn")) as pool:
+                    tasks = [
+                        pool.submit(
+                            optimizeAllocationRestart, dataDirectory, self.distributionEans, self.consumerEans,
+                            sharingRounds, costsPerKwh, algorithm, maxFails,
+                            # every worker gets its own random sequence
+                            random.getrandbits(64),
+                        )
+                        for _ in range(iterations)
+                    ]
+                    report(task.result() for task in as_completed(tasks))
+            finally:
+                shutil.rmtree(dataDirectory, ignore_errors=True)
+
+        thread = threading.Thread(target=iterateInThread if workers <= 1 else iterateInPool, name="edc-optimize", daemon=True)
+        thread.start()
+        return thread
 
     def getFilteredCsv(self) -> str:
         timeStart = datetime.datetime.now().timestamp() * 1000  # Get milliseconds timestamp
@@ -693,6 +1102,18 @@ class Csv:
 
         return [dateFrom, dateTo]
 
+    # One restart of optimizeAllocation from random weights, seeded so that a worker process repeats it exactly
+    def optimizeAllocationRestart(
+        self,
+        sharingRounds: int,
+        costsPerKwh: List[float],
+        algorithm: OptimizationAlgorithm,
+        maxFails: int,
+        seed: int,
+    ) -> OptimizedAllocation:
+        random.seed(seed)
+        return self.__optimizeAllocationIteration(sharingRounds, costsPerKwh, algorithm, maxFails)
+
     # private #optimizeAllocationIteration( # TS private method
     def _Csv__optimizeAllocationIteration(# Python name mangling
         self,
@@ -746,7 +1167,8 @@ class Csv:
 
             return result
 
-        filteredIntervals = self.getGroupedIntervals("15m")
+        # the intervals themselves, simulateSharingFast then uses the cached fixed point data
+        filteredIntervals = self.getIntervals()
 
         bestSharingProfit = self.simulateSharingFast(
             filteredIntervals,
@@ -872,14 +1294,31 @@ def math_abs(x: float) -> float:
     return abs(x)
 
 
-def parse_csv(csv: str, filename: str) -> Csv:
-    csv = csv.replace("\r\n", "\n")
-    lines = csv.split("\n")
-    assert_condition(len(lines) > 0, "CSV file is empty")
-    header = lines[0].split(";")
+def optimizeAllocationRestart(
+    dataDirectory: str,
+    distributionEans: List[Ean],
+    consumerEans: List[Ean],
+    sharingRounds: int,
+    costsPerKwh: List[float],
+    algorithm: OptimizationAlgorithm,
+    maxFails: int,
+    seed: int,
+) -> OptimizedAllocation:
+    """One optimizeAllocation restart in a worker process, on the fixed point data mapped from dataDirectory."""
+    csv = Csv.fromFixedPoint(
+        distributionEans,
+        consumerEans,
+        np.load(os.path.join(dataDirectory, "toShare.npy"), mmap_mode="r"),
+        np.load(os.path.join(dataDirectory, "consumed.npy"), mmap_mode="r"),
+    )
+    return csv.optimizeAllocationRestart(sharingRounds, costsPerKwh, algorithm, maxFails, seed)
+
+
+def parse_csv_header(line: str) -> Tuple[List[Ean], List[Ean]]:
+    header = line.split(";")
     assert_condition(
         len(header) > 3,
-        f"CSV file has invalid header - less than 3 elements. Is there an extra empty line? The entire line is \"{lines[0]}\"",
+        f"CSV file has invalid header - less than 3 elements. Is there an extra empty line? The entire line is \"{line}\"",
     )
     assert_condition(header[0] == "Datum" and header[1] == "Cas od" and header[2] == "Cas do")
     assert_condition(
@@ -905,189 +1344,326 @@ def parse_csv(csv: str, filename: str) -> Csv:
             consumer_eans.append(Ean(ean_number, i))
         assert_condition(before.startswith("IN-") and after.startswith("OUT-"), before, after)
 
-    # Maps from time to missing sharing for that time slot
-    intervals: List[Interval] = []
+    return distributor_eans, consumer_eans
+
+
+def check_interval_step(date_start: datetime.datetime, last_start: datetime.datetime, i: int):
+    minutes_this = date_start.hour * 60 + date_start.minute
+    minutes_last = last_start.hour * 60 + last_start.minute
+    minutes_diff = minutes_this - minutes_last
+
+    # Using if/elif/else to translate switch
+    if minutes_diff == -1425:  # Day break
+        pass  # break
+    elif minutes_diff == 15:  # 15 minutes - regular
+        pass  # break
+    elif minutes_diff == 75:  # 1:15 - missing 1 hour (4 entries) due to DST adjustment
+        assert_condition(date_start.hour == 3)
+        pass  # break
+    elif minutes_diff == -45:  # -0:45 - missing 1 hour due to DST adjustment
+        assert_condition(date_start.hour == 2)
+        pass  # break
+    else:
+        assert_condition(False, f"Unexpected time difference: {minutes_diff} minutes at line {i}", date_start)
 
-    for i in range(1, len(lines)):
-        if len(lines[i].strip()) == 0:
-            continue
-        exploded_line = lines[i].split(";")
 
-        expected_length = 3 + (len(consumer_eans) + len(distributor_eans)) * 2
-        # In some reports there is an empty field at the end of the line
-        assert_condition(
-            len(exploded_line) == expected_length or
-                (len(exploded_line) == expected_length + 1 and last(exploded_line) == ""),
-            f"Wrong number of items: {len(exploded_line)}, expected: {expected_length}, line number: {i}. Last item on line is \"{last(exploded_line)}\"",
-        )
-        date_start = getDate(exploded_line)
-
-        if len(intervals) > 0:
-            last_start = last(intervals).start
-            minutes_this = date_start.hour * 60 + date_start.minute
-            minutes_last = last_start.hour * 60 + last_start.minute
-            minutes_diff = minutes_this - minutes_last
-
-            # Using if/elif/else to translate switch
-            if minutes_diff == -1425:  # Day break
-                pass  # break
-            elif minutes_diff == 15:  # 15 minutes - regular
-                pass  # break
-            elif minutes_diff == 75:  # 1:15 - missing 1 hour (4 entries) due to DST adjustment
-                assert_condition(date_start.hour == 3)
-                print("DST!!!!!!!!!!!!!!!!!!!!!!!!!!", date_start)
-                pass  # break
-            elif minutes_diff == -45:  # -0:45 - missing 1 hour due to DST adjustment
-                assert_condition(date_start.hour == 2)
-                print("DST!!!!!!!!!!!!!!!!!!!!!!!!!!", date_start)
-                pass  # break
-            else:
-                assert_condition(False, f"Unexpected time difference: {minutes_diff} minutes at line {i}", date_start)
+def parse_csv_line(exploded_line: List[str], i: int, date_start: datetime.datetime, distributor_eans: List[Ean], consumer_eans: List[Ean]) -> Interval:
+    distributed: List[Measurement] = []
+    consumed: List[Measurement] = []
 
-        distributed: List[Measurement] = []
-        consumed: List[Measurement] = []
+    errors: List[str] = []
 
-        errors: List[str] = []
-
-        def parse_pair(cell_before: str, cell_after: str, ean: Ean) -> tuple[float, float]:
-            before = parseKwh(cell_before)
-            # In "Aktuální hodnoty", the after value could be missing while before value is present. Let's assume no sharing in that case
-            if cell_after == "" and cell_before != "":
-                error = f"Pro EAN {ean.name} chybí hodnota pro ponížená data. Sdílení pro tento časový úsek bude nastaveno na 0."
-                logWarning(error, date_start)
-                errors.append(error)
-                return (before, before)
-            else:
-                # When EAN is added in the middle of the report time frame, both before and after are missing. We will return zeroes
-                return (before, parseKwh(cell_after))
-
-        for ean in distributor_eans:
-            before, after = parse_pair(exploded_line[ean.csvIndex], exploded_line[ean.csvIndex + 1], ean)
-            if after > before:
-                error = f"Výroba zdroje {ean.name} je po započítání sdílení VYŠŠÍ o {after - before} kWh. Sdílení pro tento časový úsek bude nastaveno na 0."
-                logWarning(error, date_start)
-                errors.append(error)
-                after = before
-            if before < 0 or after < 0:
-                # Note: The original TS code had before / after here, which is likely a typo
-                # and should probably be just the values themselves or a difference.
-                # Translating literally but noting the potential issue.
-                error = f"Výrobní zdroj {ean.name} odebírá energii ze sítě ({before} / {after} kWh). Odběr/výroba pro tento časový úsek bude nastavena na 0."
-                logWarning(error, date_start)
-                errors.append(error)
-                before = max(0.0, before)
-                after = max(0.0, after)
-            distributed.append(Measurement(before=before, after=after, missed=0.0))
-
-        for ean in consumer_eans:
-            before, after = parse_pair(exploded_line[ean.csvIndex], exploded_line[ean.csvIndex + 1], ean)
-            before *= -1
-            after *= -1
-            if after > before:
-                error = f"Odběrovému EAN {ean.name} se po započítání sdílení ZVÝŠILA spotřeba o {after - before} kWh. Sdílení pro tento časový úsek bude nastaveno na 0."
-                logWarning(error, date_start)
-                errors.append(error)
-                after = before
-            if before < 0 or after < 0:
-                # Note: The original TS code had before / after here, which is likely a typo
-                # and should probably be just the values themselves or a difference.
-                # Translating literally but noting the potential issue.
-                error = f"Odběrový EAN {ean.name} dodává energii do sítě ({before} / {after} kWh). Odběr/výroba pro tento časový úsek bude nastavena na 0."
-                logWarning(error, date_start)
-                errors.append(error)
-                before = max(0.0, before)
-                after = max(0.0, after)
-            consumed.append(Measurement(before=before, after=after, missed=0.0))
-
-        sum_distributors_after = sumContainer(val.after for val in distributed)
-        sum_distributors_before = sumContainer(val.before for val in distributed)
-        sum_consumers_after = sumContainer(val.after for val in consumed)
-        sum_consumers_before = sumContainer(val.before for val in consumed)
-        sum_shared = sum_distributors_before - sum_distributors_after
-        assert_condition(sum_shared >= 0, sum_shared, "Line", i)
+    def parse_pair(cell_before: str, cell_after: str, ean: Ean) -> tuple[float, float]:
+        before = parseKwh(cell_before)
+        # In "Aktuální hodnoty", the after value could be missing while before value is present. Let's assume no sharing in that case
+        if cell_after == "" and cell_before != "":
+            error = f"Pro EAN {ean.name} chybí hodnota pro ponížená data. Sdílení pro tento časový úsek bude nastaveno na 0."
+            logWarning(error, date_start)
+            errors.append(error)
+            return (before, before)
+        else:
+            # When EAN is added in the middle of the report time frame, both before and after are missing. We will return zeroes
+            return (before, parseKwh(cell_after))
 
-        if abs(sum_shared - (sum_consumers_before - sum_consumers_after)) > 0.0001:
-            sum_shared_consumers = sum_consumers_before - sum_consumers_after
-            error = f"Energie nasdílená od výrobních zdrojů ({printKWh(sum_shared)}) neodpovídá energii nasdílené do odběratelských míst ({printKWh(sum_shared_consumers)})!. V reportu se použije nižší z hodnot."
+    for ean in distributor_eans:
+        before, after = parse_pair(exploded_line[ean.csvIndex], exploded_line[ean.csvIndex + 1], ean)
+        if after > before:
+            error = f"Výroba zdroje {ean.name} je po započítání sdílení VYŠŠÍ o {after - before} kWh. Sdílení pro tento časový úsek bude nastaveno na 0."
             logWarning(error, date_start)
             errors.append(error)
-            if sum_shared > sum_shared_consumers:
-                # Avoid division by zero if sum_shared is 0
-                fix_distributors = sum_shared_consumers / sum_shared if sum_shared != 0 else 0.0
-                print("Fixing distributors", fix_distributors)
-                assert_condition(
-                    fix_distributors <= 1 and fix_distributors >= 0 and not math.isnan(fix_distributors),
-                    sum_shared_consumers,
-                    sum_shared,
-                )
-                for j in distributed:
-                    j.after *= fix_distributors
-            else:
-                # Avoid division by zero if sum_shared_consumers is 0
-                fix_consumers = sum_shared / sum_shared_consumers if sum_shared_consumers != 0 else 0.0
-                print("Fixing consumers", fix_consumers)
-                assert_condition(
-                    fix_consumers <= 1 and fix_consumers >= 0 and not math.isnan(fix_consumers),
-                    sum_shared,
-                    sum_shared_consumers,
-                )
-                for j in consumed:
-                    j.after *= fix_consumers
-
-                # Different attempt to fix it:
-                # Coefficient is sum of missed consumption / sum of consumed
-                # const coefficient = (sumSharedConsumers - sumShared) / sumConsumersBefore;
-                # console.log("Fixing consumers", coefficient);
-                # assert_condition(coefficient > 0, sumShared, sumSharedConsumers);
-                # for (const j of consumed) {
-                #    j.after += j.before * coefficient;
-                # }
-
-        # If there is still some power left after sharing, we check that all consumers have 0 adjusted power.
-        # If there was some consumer left with non-zero power, it means there was energy that could have been
-        # shared, but wasn't due to bad allocation.
-        sum_missed = 0.0
-
-        def any_over_threshold(measurements: List[Measurement]) -> bool:
-            for measurement in measurements:
-                # There are plenty of intervals where distribution before and after are both 0.01 and no sharing is performed...:
-                if measurement.after > 0:
-                    return True
-            return False
-
-        # Recalculate sums after potential fixing
-        sum_consumers_after_fixed = sumContainer(val.after for val in consumed)
-        sum_distributors_after_fixed = sumContainer(val.after for val in distributed)
-
-        if any_over_threshold(distributed) and any_over_threshold(consumed):
-            sum_missed = min(sum_consumers_after_fixed, sum_distributors_after_fixed)
-            # Avoid division by zero
-            if sum_consumers_after_fixed != 0:
-                for c in consumed:
-                    c.missed = (c.after / sum_consumers_after_fixed) * sum_missed
-                    assert_condition(not math.isnan(c.missed))
-            else:
-                for c in consumed:
-                    c.missed = 0.0  # If sum is 0, all after values must be 0, so missed is 0
-
-            # Avoid division by zero
-            if sum_distributors_after_fixed != 0:
-                for p in distributed:
-                    p.missed += (p.after / sum_distributors_after_fixed) * sum_missed
-                    assert_condition(not math.isnan(p.missed))
-            else:
-                for p in distributed:
-                    p.missed += 0.0  # If sum is 0, all after values must be 0, so missed is 0
+            after = before
+        if before < 0 or after < 0:
+            # Note: The original TS code had before / after here, which is likely a typo
+            # and should probably be just the values themselves or a difference.
+            # Translating literally but noting the potential issue.
+            error = f"Výrobní zdroj {ean.name} odebírá energii ze sítě ({before} / {after} kWh). Odběr/výroba pro tento časový úsek bude nastavena na 0."
+            logWarning(error, date_start)
+            errors.append(error)
+            before = max(0.0, before)
+            after = max(0.0, after)
+        distributed.append(Measurement(before=before, after=after, missed=0.0))
+
+    for ean in consumer_eans:
+        before, after = parse_pair(exploded_line[ean.csvIndex], exploded_line[ean.csvIndex + 1], ean)
+        before *= -1
+        after *= -1
+        if after > before:
+            error = f"Odběrovému EAN {ean.name} se po započítání sdílení ZVÝŠILA spotřeba o {after - before} kWh. Sdílení pro tento časový úsek bude nastaveno na 0."
+            logWarning(error, date_start)
+            errors.append(error)
+            after = before
+        if before < 0 or after < 0:
+            # Note: The original TS code had before / after here, which is likely a typo
+            # and should probably be just the values themselves or a difference.
+            # Translating literally but noting the potential issue.
+            error = f"Odběrový EAN {ean.name} dodává energii do sítě ({before} / {after} kWh). Odběr/výroba pro tento časový úsek bude nastavena na 0."
+            logWarning(error, date_start)
+            errors.append(error)
+            before = max(0.0, before)
+            after = max(0.0, after)
+        consumed.append(Measurement(before=before, after=after, missed=0.0))
+
+    sum_distributors_after = sumContainer(val.after for val in distributed)
+    sum_distributors_before = sumContainer(val.before for val in distributed)
+    sum_consumers_after = sumContainer(val.after for val in consumed)
+    sum_consumers_before = sumContainer(val.before for val in consumed)
+    sum_shared = sum_distributors_before - sum_distributors_after
+    assert_condition(sum_shared >= 0, sum_shared, "Line", i)
+
+    if abs(sum_shared - (sum_consumers_before - sum_consumers_after)) > 0.0001:
+        sum_shared_consumers = sum_consumers_before - sum_consumers_after
+        error = f"Energie nasdílená od výrobních zdrojů ({printKWh(sum_shared)}) neodpovídá energii nasdílené do odběratelských míst ({printKWh(sum_shared_consumers)})!. V reportu se použije nižší z hodnot."
+        logWarning(error, date_start)
+        errors.append(error)
+        if sum_shared > sum_shared_consumers:
+            # Avoid division by zero if sum_shared is 0
+            fix_distributors = sum_shared_consumers / sum_shared if sum_shared != 0 else 0.0
+            assert_condition(
+                fix_distributors <= 1 and fix_distributors >= 0 and not math.isnan(fix_distributors),
+                sum_shared_consumers,
+                sum_shared,
+            )
+            for j in distributed:
+                j.after *= fix_distributors
+        else:
+            # Avoid division by zero if sum_shared_consumers is 0
+            fix_consumers = sum_shared / sum_shared_consumers if sum_shared_consumers != 0 else 0.0
+            assert_condition(
+                fix_consumers <= 1 and fix_consumers >= 0 and not math.isnan(fix_consumers),
+                sum_shared,
+                sum_shared_consumers,
+            )
+            for j in consumed:
+                j.after *= fix_consumers
+
+            # Different attempt to fix it:
+            # Coefficient is sum of missed consumption / sum of consumed
+            # const coefficient = (sumSharedConsumers - sumShared) / sumConsumersBefore;
+            # console.log("Fixing consumers", coefficient);
+            # assert_condition(coefficient > 0, sumShared, sumSharedConsumers);
+            # for (const j of consumed) {
+            #    j.after += j.before * coefficient;
+            # }
+
+    # If there is still some power left after sharing, we check that all consumers have 0 adjusted power.
+    # If there was some consumer left with non-zero power, it means there was energy that could have been
+    # shared, but wasn't due to bad allocation.
+    sum_missed = 0.0
+
+    def any_over_threshold(measurements: List[Measurement]) -> bool:
+        for measurement in measurements:
+            # There are plenty of intervals where distribution before and after are both 0.01 and no sharing is performed...:
+            if measurement.after > 0:
+                return True
+        return False
+
+    # Recalculate sums after potential fixing
+    sum_consumers_after_fixed = sumContainer(val.after for val in consumed)
+    sum_distributors_after_fixed = sumContainer(val.after for val in distributed)
+
+    if any_over_threshold(distributed) and any_over_threshold(consumed):
+        sum_missed = min(sum_consumers_after_fixed, sum_distributors_after_fixed)
+        # Avoid division by zero
+        if sum_consumers_after_fixed != 0:
+            for c in consumed:
+                c.missed = (c.after / sum_consumers_after_fixed) * sum_missed
+                assert_condition(not math.isnan(c.missed))
+        else:
+            for c in consumed:
+                c.missed = 0.0  # If sum is 0, all after values must be 0, so missed is 0
+
+        # Avoid division by zero
+        if sum_distributors_after_fixed != 0:
+            for p in distributed:
+                p.missed += (p.after / sum_distributors_after_fixed) * sum_missed
+                assert_condition(not math.isnan(p.missed))
+        else:
+            for p in distributed:
+                p.missed += 0.0  # If sum is 0, all after values must be 0, so missed is 0
+
+    return Interval(
+        start=date_start,
+        sumSharing=sum_shared,
+        sumMissed=sum_missed,
+        sumProduction=sum_distributors_before,
+        distributions=distributed,
+        consumers=consumed,
+        errors=errors,
+    )
+
+
+class CsvReader:
+    """Streaming reader of EDC exports.
+
+    The source is a file path, a binary file object or a text stream. The header is read and validated when the
+    reader is created, data lines are then decoded lazily - rows() yields the split lines and batches() yields
+    IntervalTables of at most batchSize intervals, so the whole export is never held in memory as text.
+    """
+
+    def __init__(self, source, filename: Optional[str] = None, batchSize: int = 2976):
+        if isinstance(source, (str, os.PathLike)):
+            self.__file = open(source, "r", encoding="utf-8", newline=None)
+            self.__ownsFile = True
+            filename = filename if filename is not None else os.path.basename(source)
+        elif isinstance(source, io.TextIOBase):
+            self.__file = source
+            self.__ownsFile = False
+        else:
+            self.__file = io.TextIOWrapper(source, encoding="utf-8", newline=None)
+            self.__ownsFile = False
+        self.filename = filename if filename is not None else getattr(source, "name", "")
+        self.batchSize = batchSize
+        try:
+            self.distributorEans, self.consumerEans = parse_csv_header(self.__file.readline().rstrip("\r\n"))
+        except BaseException:
+            self.close()
+            raise
+
+    def close(self):
+        if self.__ownsFile:
+            self.__file.close()
+
+    def __enter__(self) -> 'CsvReader':
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    # yields (line number, exploded line) of all non empty data lines
+    def rows(self) -> Iterator[Tuple[int, List[str]]]:
+        expected_length = 3 + (len(self.consumerEans) + len(self.distributorEans)) * 2
+        for i, line in enumerate(self.__file, start=1):
+            line = line.rstrip("\r\n")
+            if len(line.strip()) == 0:
+                continue
+            exploded_line = line.split(";")
+            # In some reports there is an empty field at the end of the line
+            assert_condition(
+                len(exploded_line) == expected_length or
+                    (len(exploded_line) == expected_length + 1 and last(exploded_line) == ""),
+                f"Wrong number of items: {len(exploded_line)}, expected: {expected_length}, line number: {i}. Last item on line is \"{last(exploded_line)}\"",
+            )
+            yield i, exploded_line
+
+    def batches(self) -> Iterator[IntervalTable]:
+        self.__lastStart: Optional[int] = None
+        lineNumbers: List[int] = []
+        explodedLines: List[List[str]] = []
+        for i, exploded_line in self.rows():
+            lineNumbers.append(i)
+            explodedLines.append(exploded_line)
+            if len(explodedLines) == self.batchSize:
+                yield self.__decodeBatch(lineNumbers, explodedLines)
+                lineNumbers = []
+                explodedLines = []
+        if len(explodedLines) > 0:
+            yield self.__decodeBatch(lineNumbers, explodedLines)
+
+    def __decodeBatch(self, lineNumbers: List[int], explodedLines: List[List[str]]) -> IntervalTable:
+        """Decodes a batch of lines column-wise.
+
+        Regular lines are computed on whole columns. Lines needing attention - unexpected time step (DST), missing
+        or inconsistent values - go through check_interval_step/parse_csv_line, which log and record the errors.
+        """
+        starts = decodeStarts([line[0] for line in explodedLines], [line[1] for line in explodedLines])
+        previousStarts = np.concatenate(([starts[0] if self.__lastStart is None else self.__lastStart], starts[:-1]))
+        minutesDiff = (starts % 86400) // 60 - (previousStarts % 86400) // 60
+        irregularSteps = (minutesDiff != 15) & (minutesDiff != -1425)
+        if self.__lastStart is None:
+            irregularSteps[0] = False
+
+        columns = (len(self.distributorEans) + len(self.consumerEans)) * 2
+        cells = decodeKwhCells(explodedLines, columns)
+        if cells is None:
+            # not plain numbers - parse every line separately
+            table = IntervalTable.zeros(len(explodedLines), len(self.distributorEans), len(self.consumerEans))
+            irregularValues = np.ones(len(explodedLines), dtype=bool)
+        else:
+            table, irregularValues = self.__decodeValues(starts, cells)
+
+        for row in np.flatnonzero(irregularSteps | irregularValues):
+            date_start = fromTimestamp(starts[row])
+            if irregularSteps[row]:
+                check_interval_step(date_start, fromTimestamp(previousStarts[row]), lineNumbers[row])
+            if irregularValues[row]:
+                table.setInterval(row, parse_csv_line(explodedLines[row], lineNumbers[row], date_start, self.distributorEans, self.consumerEans))
+
+        self.__lastStart = starts[-1]
+        return table
+
+    def __decodeValues(self, starts: np.ndarray, cells: np.ndarray) -> Tuple[IntervalTable, np.ndarray]:
+        """Vectorized parse_csv_line. Returns the table and a mask of lines it does not handle - lines producing
+        errors or warnings, which have to be parsed by parse_csv_line."""
+        empty = np.isnan(cells)
+        kwh = np.where(empty, 0.0, cells)
+        distributionColumns = [ean.csvIndex - 3 for ean in self.distributorEans]
+        consumerColumns = [ean.csvIndex - 3 for ean in self.consumerEans]
+        beforeColumns = distributionColumns + consumerColumns
+        # after value missing while before value is present
+        irregular = (empty[:, [column + 1 for column in beforeColumns]] & ~empty[:, beforeColumns]).any(axis=1)
+
+        distributions = MeasurementTable(
+            kwh[:, distributionColumns],
+            kwh[:, [column + 1 for column in distributionColumns]],
+            np.zeros((len(kwh), len(distributionColumns))),
+        )
+        consumers = MeasurementTable(
+            kwh[:, consumerColumns] * -1,
+            kwh[:, [column + 1 for column in consumerColumns]] * -1,
+            np.zeros((len(kwh), len(consumerColumns))),
+        )
+        for measurements in (distributions, consumers):
+            irregular |= (measurements.after > measurements.before).any(axis=1)
+            irregular |= ((measurements.before < 0) | (measurements.after < 0)).any(axis=1)
+
+        sum_distributors_after = sumColumns(distributions.after)
+        sum_distributors_before = sumColumns(distributions.before)
+        sum_consumers_after = sumColumns(consumers.after)
+        sum_consumers_before = sumColumns(consumers.before)
+        sum_shared = sum_distributors_before - sum_distributors_after
+        irregular |= sum_shared < 0
+        irregular |= np.abs(sum_shared - (sum_consumers_before - sum_consumers_after)) > 0.0001
 
-        intervals.append(Interval(
-            start=date_start,
-            sumSharing=sum_shared,
-            sumMissed=sum_missed,
-            sumProduction=sum_distributors_before,
-            distributions=distributed,
-            consumers=consumed,
-            errors=errors,
-        ))
+        # missed sharing - see parse_csv_line
+        missing = (distributions.after > 0).any(axis=1) & (consumers.after > 0).any(axis=1)
+        sum_missed = np.where(missing, np.minimum(sum_consumers_after, sum_distributors_after), 0.0)
+        consumers.missed = np.where(missing[:, None], (consumers.after / np.where(missing, sum_consumers_after, 1.0)[:, None]) * sum_missed[:, None], 0.0)
+        distributions.missed = np.where(missing[:, None], (distributions.after / np.where(missing, sum_distributors_after, 1.0)[:, None]) * sum_missed[:, None], 0.0)
+
+        return IntervalTable(starts, sum_shared, sum_missed, sum_distributors_before, distributions, consumers), irregular
+
+    def read(self) -> Csv:
+        try:
+            intervals = IntervalTable.concatenate(list(self.batches()))
+        finally:
+            self.close()
+        return Csv(self.filename, intervals, self.distributorEans, self.consumerEans)
+
+
+def parse_csv(csv: str, filename: str) -> Csv:
+    return CsvReader(io.StringIO(csv, newline=None), filename).read()
 
-    return Csv(filename, intervals, distributor_eans, consumer_eans)
 
+# source is a file path or a binary file object
+def parse_csv_file(source, filename: Optional[str] = None) -> Csv:
+    return CsvReader(source, filename).read()
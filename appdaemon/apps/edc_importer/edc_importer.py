@@ -5,11 +5,16 @@ import utils
 from appdaemon.plugins.hass import Hass
 import platform
 from datetime import datetime as dt
-import time
 import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from EdcScraper import EdcScraper
+from EdcApiClient import EdcApiClient
 import edc
 from EdcExporter import EdcExporter
+from CsvCache import CsvCache
+from ImportQueue import ImportQueue
+from EdcHistory import EdcHistory
 from Colors import Colors
 from typing import List
 from edc import GroupingOptions
@@ -18,22 +23,50 @@ from edc import GroupingOptions
 class EDCImporter(Hass):
 
     edcScraper = 'undefined'
+    edcApiClient: EdcApiClient = 'undefined'
     edcExporter = 'undefined'
+    csvCache: CsvCache = 'undefined'
+    edcHistory: EdcHistory = 'undefined'
     defaultGroupings = ["1h", "1d", "1m"]
     uiLogger: EdcLogger = 'undefined'
     daily_handle = None
+    importQueue: ImportQueue = 'undefined'
+    exportLock: threading.Lock = 'undefined'
     
     def initialize(self):
         self.log("Initializing...")
         logger = EdcLogger(self)
         self.uiLogger = logger
 
-        self.edcScraper = EdcScraper("/usr/bin/chromedriver", self.args["username"], self.args["password"], self.args["exportGroup"], self.args["dataDirectory"], logger)
-        self.edcExporter = EdcExporter(self.args["dataDirectory"], logger, self)
+        self.edcScraper = EdcScraper("/usr/bin/chromedriver", self.args["username"], self.args["password"], self.args["exportGroup"], self.args["dataDirectory"], logger,
+            sessionIdleTimeout=int(self.args.get("browserIdleTimeout", 600)),
+            timeouts=self.args.get("scraperTimeouts", {}),
+            screenshotMode=self.args.get("screenshots", "on-failure"))
+        if (self.args.get("scraperBackend", "browser") == "api"):
+            self.edcApiClient = EdcApiClient(self.args["username"], self.args["password"], self.args["exportGroup"], self.args["dataDirectory"], logger,
+                endpoints=self.args.get("edcApi", {}))
+        self.edcExporter = EdcExporter(self.args["dataDirectory"], logger, self,
+            deltaExport=self.args.get("deltaExport", False),
+            batchedUpload=self.args.get("batchedUpload", False),
+            maxRowsPerFile=int(self.args.get("maxRowsPerFile", 50000)),
+            exportBackend=self.args.get("exportBackend", "file"),
+            exportWorkers=int(self.args.get("exportWorkers", 1)),
+            maxHaCalls=int(self.args.get("maxHaCalls", 4)))
+        #exports share the entity registry and fingerprints of the exporter, they run one at a time
+        self.exportLock = threading.Lock()
+        self.csvCache = CsvCache(f"{self.args['dataDirectory']}/cache", logger, parseProcesses=int(self.args.get("parseProcesses", 0)))
+        if (self.args.get("keepHistory", False)):
+            self.edcHistory = EdcHistory(f"{self.args['dataDirectory']}/history", logger)
+        self.backfillWorkers = int(self.args.get("backfillWorkers", 2))
+        self.importRetries = int(self.args.get("importRetries", 3))
+        self.importRetryDelay = int(self.args.get("importRetryDelay", 30))
+        #imports run here, never in the AppDaemon callback threads
+        self.importQueue = ImportQueue(self.runImport, logger)
 
         self.listen_event(self.importEdcDataEventHandler, "edc_import")
         self.listen_event(self.importEdcDailyDataEventHandler, "edc_import_daily")
         self.listen_event(self.importEdcMonthlyDataEventHandler, "edc_import_month")
+        self.listen_event(self.importEdcRangeEventHandler, "edc_import_range")
         self.listen_event(self.printScraperInfo, "edc_scraper_info")
         self.listen_event(self.printServicesEventHandler, "edc_print_services")
 
@@ -65,6 +98,40 @@ class EDCImporter(Hass):
         self.printSystemInfo()
         self.log("EDC Initialized")
         
+    def terminate(self):
+        if (self.importQueue != 'undefined'):
+            self.importQueue.shutdown()
+        if (self.csvCache != 'undefined'):
+            self.csvCache.close()
+        if (self.edcApiClient != 'undefined'):
+            self.edcApiClient.closeSession()
+        if (self.edcScraper != 'undefined'):
+            self.edcScraper.closeSession()
+
+    #HTTP export only with scraperBackend: api (experimental, endpoints not verified yet), the browser is the fallback
+    def scrapeExport(self, month, year):
+        if (self.edcApiClient != 'undefined'):
+            try:
+                return self.edcApiClient.scrapeData(month, year)
+            except Exception as e:
+                self.uiLogger.logAndPrint(f"HTTP export failed: {e}. Falling back to browser", Colors.YELLOW)
+        return self.edcScraper.scrapeData(month, year)
+
+    #like scrapeExport for several months, the browser exports only the months the HTTP backend did not deliver
+    def scrapeMonthsExport(self, months, onDownloaded):
+        delivered = []
+        def downloaded(year, month, dataFile):
+            delivered.append((year, month))
+            onDownloaded(year, month, dataFile)
+
+        if (self.edcApiClient != 'undefined'):
+            try:
+                self.edcApiClient.scrapeMonths(months, downloaded)
+                return
+            except Exception as e:
+                self.uiLogger.logAndPrint(f"HTTP export failed: {e}. Falling back to browser", Colors.YELLOW)
+        self.edcScraper.scrapeMonths([month for month in months if month not in delivered], downloaded)
+
     def printSystemInfo(self):
         self.uiLogger.print("System Information:")
         self.uiLogger.print(f"Platform: {platform.system()}")
@@ -139,20 +206,12 @@ class EDCImporter(Hass):
             month = lastMonth
             year = lastMonthYear
             
-        try:
-            self.executeEdcImport(month, year, self.defaultGroupings)
-        except Exception:
-            time.sleep(30)
-            # call it again in case of failure
-            self.executeEdcImport(month, year, self.defaultGroupings)
+        # retried in case of failure
+        self.scheduleImport([(year, month)], self.defaultGroupings, self.importRetries)
         
         if (day >=8 and day <=10):
             #download whole previous month. God knows when it's ready in EDC
-            try:
-                self.executeEdcImport(lastMonth, lastMonthYear, self.defaultGroupings)
-            except Exception:
-                time.sleep(30)
-                self.executeEdcImport(lastMonth, lastMonthYear, self.defaultGroupings)
+            self.scheduleImport([(lastMonthYear, lastMonth)], self.defaultGroupings, self.importRetries)
         
     def printScraperInfo(self, data, **kwargs):
         self.edcScraper.printInstalledModules()
@@ -161,10 +220,7 @@ class EDCImporter(Hass):
         
     def importEdcDataForDefaultInterval(self):
         downloadIntervals= utils.getLastMonths(dt.today(), 2)[::-1]
-        for downloadInterval in downloadIntervals:
-            year = downloadInterval[0]
-            month = downloadInterval[1]
-            self.executeEdcImport(month, year, self.defaultGroupings) 
+        self.scheduleImport(downloadIntervals, self.defaultGroupings)
     
     def importEdcDataEventHandler(self, event_name, data, kwargs):
         self.importEdcDataForDefaultInterval()
@@ -186,9 +242,65 @@ class EDCImporter(Hass):
         else:
             year = dt.now().year
         
-        self.executeEdcImport(month, year, groupings)
+        self.scheduleImport([(year, month)], groupings)
         
         
+    #data: start and optional end month as "YYYY-MM" (end defaults to the current month), optional grouping
+    def importEdcRangeEventHandler(self, event_name, data, kwargs):
+        try:
+            start = self.parseMonth(data['start'])
+            end = self.parseMonth(data['end']) if 'end' in data else (dt.now().year, dt.now().month)
+        except (KeyError, ValueError) as e:
+            self.uiLogger.logAndPrint(f"Invalid edc_import_range parameters {data}: {e}. Expected start: YYYY-MM, end: YYYY-MM", Colors.RED)
+            return
+
+        if 'grouping' in data:
+            groupings = [data['grouping']]
+        else:
+            groupings = self.defaultGroupings
+
+        months = utils.getMonthRange(start, end)
+        if (len(months) == 0):
+            self.uiLogger.logAndPrint(f"Empty month range {start} - {end}", Colors.YELLOW)
+            return
+        self.scheduleImport(months, groupings)
+
+    def parseMonth(self, value) -> tuple:
+        year, month = [int(part) for part in str(value).split("-")[:2]]
+        if (month < 1 or month > 12):
+            raise ValueError(f"Invalid month [{value}]")
+        return (year, month)
+
+    #queues the import and returns at once, a failed import is scheduled again up to retries times with a doubling delay
+    def scheduleImport(self, months: List[tuple], groupings: List[GroupingOptions], retries = 0, attempt = 0):
+        self.importQueue.submit(months, groupings, retries, attempt)
+
+    def runImport(self, months: List[tuple], groupings: List[GroupingOptions], retries, attempt):
+        try:
+            if (len(months) == 1):
+                self.executeEdcImport(months[0][1], months[0][0], groupings)
+            else:
+                self.executeEdcImportRange(months, groupings)
+        except Exception as e:
+            if (attempt >= retries):
+                self.uiLogger.logAndPrint(f"Import of {months} failed: {e}", Colors.RED)
+                return
+            delay = self.importRetryDelay * 2 ** attempt
+            self.uiLogger.logAndPrint(f"Import of {months} failed, retry {attempt + 1}/{retries} in {delay}s", Colors.YELLOW)
+            self.run_in(self.retryImportCallback, delay, months=months, groupings=groupings, retries=retries, attempt=attempt + 1)
+
+    def retryImportCallback(self, **kwargs):
+        self.scheduleImport(kwargs["months"], kwargs["groupings"], kwargs["retries"], kwargs["attempt"])
+
+    def updateHistory(self, parsedCsv):
+        if (self.edcHistory == 'undefined'):
+            return
+        # history is an addition to the import, a failure there must not stop the export
+        try:
+            self.edcHistory.merge(parsedCsv)
+        except Exception as e:
+            self.uiLogger.logAndPrint(f"Unable to update history: {e}", Colors.YELLOW)
+
     def executeEdcImport(self, month, year, groupings: List[GroupingOptions]):
         edcStartTime = dt.now()
         groupingsNames =  "[%s]"%','.join(map(lambda grouping: self.edcExporter.convertGroupinToName(grouping), groupings))
@@ -199,18 +311,8 @@ class EDCImporter(Hass):
             self.set_state("binary_sensor.edc_running", state="on")
             
             self.set_state("input_text.edc_script_parameters", state=scriptParameters)
-            dataFile = self.edcScraper.scrapeData(month, year)
-
-            csvDataFromFile = dataFile.read_text()
-            fileLenght = len(csvDataFromFile)
-            if (fileLenght < 200):
-                #approx 2 lines
-                self.uiLogger.logAndPrint(f"EDC export contains no data len[{fileLenght}]. Ignoring....")
-                return
-            
-            parsedCsv = edc.parse_csv(csvDataFromFile, dataFile.name)
-            for grouping in groupings:
-                self.edcExporter.exportData(parsedCsv, grouping)
+            dataFile = self.scrapeExport(month, year)
+            self.importDataFile(dataFile, groupings)
 
             self.set_state("input_text.edc_script_status", state=f"OK")
 
@@ -236,3 +338,69 @@ class EDCImporter(Hass):
             self.uiLogger.logAndPrint(f"********************* Finished in {edcDuration} *********************", Colors.CYAN)
         
 
+    #parse + export of one downloaded export, parsing may run in parallel, exports are serialized
+    def importDataFile(self, dataFile, groupings: List[GroupingOptions]):
+        fileLenght = dataFile.stat().st_size
+        if (fileLenght < 200):
+            #approx 2 lines
+            self.uiLogger.logAndPrint(f"EDC export contains no data len[{fileLenght}]. Ignoring....")
+            return
+
+        parsedCsv = self.csvCache.parse(dataFile)
+        self.updateHistory(parsedCsv)
+        with self.exportLock:
+            self.edcExporter.exportData(parsedCsv, groupings)
+
+    #all months are exported in one portal session, each month is parsed and exported as soon as it is downloaded
+    def executeEdcImportRange(self, months: List[tuple], groupings: List[GroupingOptions]):
+        edcStartTime = dt.now()
+        groupingsNames =  "[%s]"%','.join(map(lambda grouping: self.edcExporter.convertGroupinToName(grouping), groupings))
+        scriptParameters = f"Interval [{months[0][0]}/{months[0][1]} - {months[-1][0]}/{months[-1][1]}] :: Grouping [{groupingsNames}]"
+        self.uiLogger.logAndPrint(f"******************** Starting EDC data load [{scriptParameters}]  *********************", Colors.CYAN)
+        importError = ""
+        imports = []
+        pool = ThreadPoolExecutor(max_workers=max(self.backfillWorkers, 1), thread_name_prefix="edc-backfill")
+        try:
+            self.set_state("binary_sensor.edc_running", state="on")
+            self.set_state("input_text.edc_script_parameters", state=scriptParameters)
+
+            def downloaded(year, month, dataFile):
+                self.uiLogger.logAndPrint(f"Export [{year}/{month}] downloaded, importing")
+                imports.append(((year, month), pool.submit(self.importDataFile, dataFile, groupings)))
+            try:
+                self.scrapeMonthsExport(months, downloaded)
+            finally:
+                #months already downloaded are imported even when the scrape fails later
+                failed = []
+                for (year, month), future in imports:
+                    try:
+                        future.result()
+                    except Exception as e:
+                        self.uiLogger.logAndPrint(f"Import of [{year}/{month}] failed: {e}", Colors.RED)
+                        failed.append(f"{year}/{month}")
+            if (len(failed) > 0):
+                raise Exception(f"Import failed for months {failed}")
+
+            self.set_state("input_text.edc_script_status", state=f"OK")
+
+        except Exception as e:
+            importError = str(e)
+            self.set_state("input_text.edc_script_status", state=f"Failed",
+                attributes={
+                    "error": importError
+                })
+
+            self.uiLogger.logAndPrint(f"******************** Script failed : {importError} *********************", Colors.RED)
+            raise Exception("Unable to scrape EDC data")
+        finally:
+            pool.shutdown(wait=True)
+            edcEndTime = dt.now()
+            edcDuration = edcEndTime - edcStartTime
+
+            self.set_state("input_text.edc_script_duration", state=f"{str(edcDuration).split('.')[0]} :: {edcEndTime:%d/%m/%Y}",
+                attributes={
+                    "script_parameters": scriptParameters,
+                    "error": importError
+                })
+            self.set_state("binary_sensor.edc_running", state="off")
+            self.uiLogger.logAndPrint(f"********************* Finished in {edcDuration} *********************", Colors.CYAN)
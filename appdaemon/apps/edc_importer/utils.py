@@ -1,4 +1,5 @@
 from dateutil.relativedelta import relativedelta
+from datetime import datetime as dt
 from typing import List
 
 def getLastMonths(start_date, months) -> List[tuple]:
@@ -9,3 +10,22 @@ def getLastMonthsImpl(start_date, months):
         yield (start_date.year,start_date.month)
         start_date += relativedelta(months = -1)
 
+def useMonthExport(month: int, year: int) -> bool:
+    now = dt.now()
+    lastMonthsInterval = getLastMonths(dt.today(), 2)[::-1]
+    lastMonthYear = lastMonthsInterval[0][0]
+    lastMonth = lastMonthsInterval[0][1]
+    #if (((now.month -1) == month) and (now.day <= 9)) or (month == now.month):
+    if ((month == now.month and now.year == year) or (month == lastMonth and year == lastMonthYear and now.day <=9)):
+        #there is 5 days period to adjust month data plus a Bulgarian constant
+        return False
+    return True
+
+#(year, month) of all months from start to end, both included
+def getMonthRange(start: tuple, end: tuple) -> List[tuple]:
+    months = []
+    year, month = start
+    while ((year, month) <= tuple(end)):
+        months.append((year, month))
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return months
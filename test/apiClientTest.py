@@ -0,0 +1,134 @@
+import unittest
+import json
+import threading
+import tempfile
+from pathlib import Path
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+from EdcApiClient import EdcApiClient
+from EdcLogger import EdcLogger
+
+
+EXPORT = "Datum;Cas od;Cas do;IN-859182400999999933-O;OUT-859182400999999933-O\n01.04.2025;00:00;00:15;-0,01;0,0;\n"
+
+
+class StubPortal(BaseHTTPRequestHandler):
+    """Keycloak login + EDC export API, just enough for EdcApiClient."""
+
+    pendingPolls = 2
+    authorizations = []
+    groupRequests = 0
+    exports = []
+
+    def log_message(self, format, *args):
+        pass
+
+    def reply(self, status, body = b"", contentType = "application/json", headers = {}):
+        self.send_response(status)
+        self.send_header("Content-Type", contentType)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def form(self):
+        return parse_qs(self.rfile.read(int(self.headers["Content-Length"])).decode())
+
+    def authorized(self):
+        StubPortal.authorizations.append(self.headers.get("Authorization"))
+        return self.headers.get("Authorization") == "Bearer access-1"
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == "/auth/realms/edc/protocol/openid-connect/auth":
+            redirect = parse_qs(url.query)["redirect_uri"][0]
+            page = f'<html><form id="kc-form-login" class="x" action="/auth/realms/edc/login-actions/authenticate?session_code=1&amp;redirect={redirect}" method="post"></form></html>'
+            self.reply(200, page.encode(), "text/html")
+        elif not self.authorized():
+            self.reply(401)
+        elif url.path == "/api/v1/sharing-groups":
+            StubPortal.groupRequests += 1
+            self.reply(200, json.dumps([{"id": 3, "name": "Other"}, {"id": 7, "name": "My group"}]).encode())
+        elif url.path == "/api/v1/data-exports/42/download":
+            if StubPortal.pendingPolls > 0:
+                StubPortal.pendingPolls -= 1
+                self.reply(202)
+            else:
+                self.reply(200, EXPORT.encode(), "text/csv")
+        else:
+            self.reply(404)
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path == "/auth/realms/edc/login-actions/authenticate":
+            form = self.form()
+            if form.get("username") == ["user"] and form.get("password") == ["secret"]:
+                redirect = parse_qs(url.query)["redirect"][0]
+                self.reply(302, headers={"Location": f"{redirect}?state=x&code=code-1"})
+            else:
+                self.reply(200, b"<html>Invalid credentials</html>", "text/html")
+        elif url.path == "/auth/realms/edc/protocol/openid-connect/token":
+            form = self.form()
+            assert form["code"] == ["code-1"] and "code_verifier" in form
+            self.reply(200, json.dumps({"access_token": "access-1", "refresh_token": "refresh-1", "expires_in": 300}).encode())
+        elif url.path == "/api/v1/data-exports" and self.authorized():
+            request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            StubPortal.exports.append((request["groupId"], request["dateFrom"], request["dateTo"]))
+            self.reply(200, json.dumps({"id": 42}).encode())
+        else:
+            self.reply(404)
+
+
+class TestApiClient(unittest.TestCase):
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), StubPortal)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        portal = f"http://127.0.0.1:{self.server.server_port}/"
+        self.endpoints = {"portal": portal, "keycloak": f"{portal}auth/realms/edc/"}
+        self.directory = tempfile.TemporaryDirectory()
+        StubPortal.groupRequests = 0
+        StubPortal.exports = []
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.directory.cleanup()
+
+    def test_downloadExport(self):
+        StubPortal.pendingPolls = 2
+        client = EdcApiClient("user", "secret", "My group", self.directory.name, EdcLogger(), endpoints=self.endpoints, pollInterval=0.01)
+        exportFile = client.scrapeData(4, 2025)
+        self.assertEqual(exportFile, Path(self.directory.name) / "automatic-export.csv")
+        self.assertEqual(exportFile.read_text(), EXPORT)
+        self.assertEqual(StubPortal.pendingPolls, 0)
+        self.assertEqual(StubPortal.exports, [(7, "2025-04-01", "2025-04-30")])
+        self.assertTrue(all(authorization == "Bearer access-1" for authorization in StubPortal.authorizations))
+        client.closeSession()
+
+    def test_groupIdCached(self):
+        StubPortal.pendingPolls = 0
+        client = EdcApiClient("user", "secret", "My group", self.directory.name, EdcLogger(), endpoints=self.endpoints, pollInterval=0.01)
+        downloaded = []
+        client.scrapeMonths([(2025, 3), (2025, 4)], lambda year, month, dataFile: downloaded.append((year, month, dataFile.name)))
+        client.scrapeData(4, 2025)
+        #the export group is looked up once for all months
+        self.assertEqual(StubPortal.groupRequests, 1)
+        self.assertEqual(StubPortal.exports, [(7, "2025-03-01", "2025-03-31"), (7, "2025-04-01", "2025-04-30"), (7, "2025-04-01", "2025-04-30")])
+        self.assertEqual(downloaded, [(2025, 3, "automatic-export-2025-03.csv"), (2025, 4, "automatic-export-2025-04.csv")])
+        #and again after a new login
+        client.closeSession()
+        client.scrapeData(4, 2025)
+        self.assertEqual(StubPortal.groupRequests, 2)
+        client.closeSession()
+
+    def test_invalidCredentials(self):
+        client = EdcApiClient("user", "wrong", "My group", self.directory.name, EdcLogger(), endpoints=self.endpoints)
+        with self.assertRaises(Exception):
+            client.scrapeData(4, 2025)
+        client.closeSession()
+
+
+if __name__ == '__main__':
+    unittest.main()
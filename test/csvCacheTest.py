@@ -0,0 +1,102 @@
+import unittest
+import os
+import tempfile
+from pathlib import Path
+from unittest import mock
+from concurrent.futures.process import BrokenProcessPool
+import numpy as np
+import edc
+from CsvCache import CsvCache
+from EdcLogger import EdcLogger
+
+EXPORT = """Datum;Cas od;Cas do;IN-859182400999999933-O;OUT-859182400999999933-O;IN-859182400699999332-D;OUT-859182400699999332-D
+01.04.2025;00:00;00:15;-0,01;0,0;0,01;0,0;
+01.04.2025;00:15;00:30;-0,02;-0,01;0,01;0,0;
+01.04.2025;00:30;00:45;-0,03;-0,03;0,0;0,0;
+01.04.2025;00:45;01:00;-0,05;-0,04;0,01;0,0;
+"""
+
+
+class TestCsvCache(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.cacheDirectory = Path(self.directory.name) / "cache"
+        self.cache = CsvCache(self.cacheDirectory, EdcLogger(), maxEntries=2)
+
+    def tearDown(self):
+        self.cache.close()
+        self.directory.cleanup()
+
+    def writeExport(self, name: str, trailingLines: int = 0) -> Path:
+        exportFile = Path(self.directory.name) / name
+        exportFile.write_text(EXPORT + "\n" * trailingLines)
+        return exportFile
+
+    def assertSameCsv(self, parsedCsv: edc.Csv, expectedCsv: edc.Csv):
+        self.assertEqual([ean.name for ean in parsedCsv.distributionEans], [ean.name for ean in expectedCsv.distributionEans])
+        self.assertEqual([ean.name for ean in parsedCsv.consumerEans], [ean.name for ean in expectedCsv.consumerEans])
+        intervals, expected = parsedCsv.getIntervals(), expectedCsv.getIntervals()
+        for name in ["starts", "sumSharing", "sumMissed", "sumProduction"]:
+            self.assertTrue(np.array_equal(getattr(intervals, name), getattr(expected, name)), name)
+        for table, expectedTable in [(intervals.distributions, expected.distributions), (intervals.consumers, expected.consumers)]:
+            for name in ["before", "after", "missed"]:
+                self.assertTrue(np.array_equal(getattr(table, name), getattr(expectedTable, name)), name)
+
+    def test_cacheHit(self):
+        exportFile = self.writeExport("automatic-export.csv")
+        parsedCsv = self.cache.parse(exportFile)
+        self.assertEqual(len(list(self.cacheDirectory.glob("csv_v*.npz"))), 1)
+        #a byte-identical export is not parsed again
+        with mock.patch("edc.parse_csv_file", side_effect=AssertionError("parsed instead of loaded")):
+            cachedCsv = self.cache.parse(self.writeExport("automatic-export-2025-04.csv"))
+        self.assertSameCsv(cachedCsv, parsedCsv)
+        self.assertEqual(cachedCsv.filename, "automatic-export-2025-04.csv")
+
+    def test_cacheVersion(self):
+        exportFile = self.writeExport("automatic-export.csv")
+        self.cache.parse(exportFile)
+        with mock.patch.object(CsvCache, "cacheVersion", CsvCache.cacheVersion + 1):
+            with mock.patch("edc.parse_csv_file", wraps=edc.parse_csv_file) as parse:
+                self.cache.parse(exportFile)
+                self.assertEqual(parse.call_count, 1)
+        self.assertEqual(len(list(self.cacheDirectory.glob(f"csv_v{CsvCache.cacheVersion + 1}_*.npz"))), 1)
+
+    def test_eviction(self):
+        exportFiles = [self.writeExport(f"export-{i}.csv", trailingLines=i) for i in range(3)]
+        cacheFiles = []
+        for i, exportFile in enumerate(exportFiles):
+            self.cache.parse(exportFile)
+            cacheFiles.append(self.cache.cacheFile(exportFile))
+            #distinct modification times, the oldest entry is evicted first
+            os.utime(cacheFiles[-1], (1000000000 + i, 1000000000 + i))
+        self.cache.evict()
+        self.assertEqual([cacheFile.exists() for cacheFile in cacheFiles], [False, True, True])
+
+    def test_parseProcess(self):
+        exportFile = self.writeExport("automatic-export.csv")
+        cache = CsvCache(Path(self.directory.name) / "processCache", EdcLogger(), parseProcesses=1)
+        try:
+            self.assertSameCsv(cache.parse(exportFile), edc.parse_csv_file(exportFile))
+            self.assertIsNotNone(cache.parsePool)
+        finally:
+            cache.close()
+
+    def test_brokenProcessPool(self):
+        class BrokenPool:
+            def submit(self, *args):
+                raise BrokenProcessPool("worker killed")
+
+            def shutdown(self, **kwargs):
+                pass
+
+        exportFile = self.writeExport("automatic-export.csv")
+        self.cache.parsePool = BrokenPool()
+        #parsed in this process, the broken pool is not used any more
+        self.assertSameCsv(self.cache.parse(exportFile), edc.parse_csv_file(exportFile))
+        self.assertIsNone(self.cache.parsePool)
+        self.assertEqual(len(list(self.cacheDirectory.glob("csv_v*.npz"))), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
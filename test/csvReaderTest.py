@@ -0,0 +1,105 @@
+import unittest
+import io
+import edc
+from typing import List
+from edc import Interval
+
+HEADER = "Datum;Cas od;Cas do;IN-859182400999999933-O;OUT-859182400999999933-O;IN-859182400604878727-O;OUT-859182400604878727-O;IN-859182400699999332-D;OUT-859182400699999332-D"
+
+
+class TestCsvReader(unittest.TestCase):
+    """The column-wise decoding of CsvReader against parse_csv_line applied line by line."""
+
+    #the way parse_csv used to read an export - one line at a time
+    def parseLineByLine(self, csv: str) -> List[Interval]:
+        lines = csv.replace("\r\n", "\n").split("\n")
+        distributorEans, consumerEans = edc.parse_csv_header(lines[0])
+        intervals: List[Interval] = []
+        for i in range(1, len(lines)):
+            if len(lines[i].strip()) == 0:
+                continue
+            explodedLine = lines[i].split(";")
+            dateStart = edc.getDate(explodedLine)
+            if len(intervals) > 0:
+                edc.check_interval_step(dateStart, intervals[-1].start, i)
+            intervals.append(edc.parse_csv_line(explodedLine, i, dateStart, distributorEans, consumerEans))
+        return intervals
+
+    def assertDecoded(self, csv: str):
+        expected = self.parseLineByLine(csv)
+        for batchSize in [2976, 3, 1]:
+            with edc.CsvReader(io.StringIO(csv, newline=None), "reader.csv", batchSize=batchSize) as reader:
+                table = edc.IntervalTable.concatenate(list(reader.batches()))
+            self.assertEqual(len(table), len(expected))
+            for row, interval in enumerate(expected):
+                decoded = table[row]
+                self.assertEqual(decoded.start, interval.start)
+                self.assertEqual((decoded.sumSharing, decoded.sumMissed, decoded.sumProduction),
+                    (interval.sumSharing, interval.sumMissed, interval.sumProduction))
+                self.assertEqual([(m.before, m.after, m.missed) for m in decoded.distributions],
+                    [(m.before, m.after, m.missed) for m in interval.distributions])
+                self.assertEqual([(m.before, m.after, m.missed) for m in decoded.consumers],
+                    [(m.before, m.after, m.missed) for m in interval.consumers])
+                self.assertEqual(list(decoded.errors), list(interval.errors))
+        return expected
+
+    def test_dstGap(self):
+        csv = HEADER + """
+30.03.2025;01:15;01:30;-0,11;-0,03;-0,2;-0,1;0,31;0,13;
+30.03.2025;01:30;01:45;-0,07;0,0;-0,13;-0,05;0,21;0,06;
+30.03.2025;01:45;03:00;-0,03;-0,01;-0,01;0,0;0,0;0,0;
+30.03.2025;03:00;03:15;-0,01;0,0;-0,06;-0,02;0,07;0,02;
+30.03.2025;03:15;03:30;-0,02;-0,01;-0,04;-0,04;0,01;0,0;
+"""
+        intervals = self.assertDecoded(csv)
+        self.assertEqual([interval.start.hour for interval in intervals], [1, 1, 1, 3, 3])
+
+    def test_dstRepeatedHour(self):
+        csv = HEADER + """
+26.10.2025;02:15;02:30;-0,11;-0,03;-0,2;-0,1;0,31;0,13;
+26.10.2025;02:30;02:45;-0,07;0,0;-0,13;-0,05;0,21;0,06;
+26.10.2025;02:45;02:00;-0,03;-0,01;-0,01;0,0;0,0;0,0;
+26.10.2025;02:00;02:15;-0,01;0,0;-0,06;-0,02;0,07;0,02;
+26.10.2025;02:15;02:30;-0,02;-0,01;-0,04;-0,04;0,01;0,0;
+"""
+        intervals = self.assertDecoded(csv)
+        self.assertEqual([interval.start.minute for interval in intervals], [15, 30, 45, 0, 15])
+        #the repeated hour stays in one hourly group, as consecutive rows with the same hour always did
+        parsedCsv = edc.parse_csv(csv, "dst.csv")
+        self.assertEqual(len(parsedCsv.getGroupedIntervals("1h")), 1)
+
+    def test_crlf(self):
+        csv = HEADER + """
+01.04.2025;00:00;00:15;-0,01;0,0;-0,06;-0,02;0,07;0,02;
+01.04.2025;00:15;00:30;-0,02;-0,01;-0,04;-0,04;0,01;0,0
+01.04.2025;00:30;00:45;-0,03;-0,03;-0,02;0,0;0,03;0,01;
+
+""".replace("\n", "\r\n")
+        self.assertEqual(len(self.assertDecoded(csv)), 3)
+
+    def test_missingValues(self):
+        csv = HEADER + """
+01.04.2025;00:00;00:15;-0,01;;-0,06;-0,02;0,06;0,02;
+01.04.2025;00:15;00:30;;;-0,04;-0,04;0,01;0,01;
+01.04.2025;00:30;00:45;-0,03;-0,03;-0,02;-0,02;;;
+01.04.2025;00:45;01:00;-0,05;-0,04;0,0;0,0;0,02;0,01;
+"""
+        intervals = self.assertDecoded(csv)
+        #after missing while before is present - no sharing and an error, both missing - zeroes
+        self.assertEqual(len(intervals[0].errors), 1)
+        self.assertEqual((intervals[0].consumers[0].before, intervals[0].consumers[0].after), (0.01, 0.01))
+        self.assertEqual((intervals[1].consumers[0].before, intervals[1].consumers[0].after), (0.0, 0.0))
+        self.assertEqual(intervals[2].sumProduction, 0.0)
+
+    def test_exponentAndInconsistentSharing(self):
+        csv = HEADER + """
+01.04.2025;00:00;00:15;-1,234e0;-1,2e0;-0,06;-0,02;0,07;0,02;
+01.04.2025;00:15;00:30;-0,02;-0,01;-0,04;-0,04;0,5;0,0;
+01.04.2025;00:30;00:45;-0,03;-0,03;-0,02;0,0;0,03;0,01;
+"""
+        intervals = self.assertDecoded(csv)
+        self.assertEqual(intervals[0].consumers[0].before, 1.234)
+
+
+if __name__ == '__main__':
+    unittest.main()
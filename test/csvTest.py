@@ -6,6 +6,9 @@ from datetime import datetime as dt
 from edc import Interval, GroupingOptions
 from functools import partial
 import time
+import copy
+import tempfile
+import numpy as np
 from dateutil.relativedelta import relativedelta
 from typing import List, Dict, Any, Optional, Set, Literal, TypedDict
 from EdcLogger import EdcLogger
@@ -5787,10 +5790,12 @@ class TestStringMethods(unittest.TestCase):
             print()
         self.xyz(["15m", "1h"])
 #        print(f"XXX: ")
-        directory = Path("../data/")
+        #sample export is a fixture, the exported files go to a temporary directory
+        file = Path(__file__).parent / "data" / "automatic-export.csv"
+        outputDirectory = tempfile.TemporaryDirectory()
+        self.addCleanup(outputDirectory.cleanup)
         logger = EdcLogger()
-        exporter = EdcExporter(str(directory.resolve()), logger)
-        file = (directory / "automatic-export.csv")
+        exporter = EdcExporter(outputDirectory.name, logger)
         x = str(file.resolve())
         m = dt.now().month
         csvDataFromFile = file.read_text()
@@ -5831,6 +5836,76 @@ class TestStringMethods(unittest.TestCase):
         print(f"{edcStartTime.strftime('%Y/%m/%d')}")
         self.assertTrue('FOO'.isupper())
     
+    def test_groupedIntervals(self):
+        #27.02.2025 23:00 - 02.03.2025 01:00, crosses a day boundary inside of a month and a month boundary
+        lines = ["Datum;Cas od;Cas do;IN-859182400999999933-O;OUT-859182400999999933-O;IN-859182400604878727-O;OUT-859182400604878727-O;IN-859182400699999332-D;OUT-859182400699999332-D"]
+        start = dt(2025, 2, 27, 23, 0)
+        for i in range(4 * 50):
+            rowStart = start + relativedelta(minutes=15 * i)
+            rowEnd = rowStart + relativedelta(minutes=15)
+            consumed1, consumed2, produced = (i * 7) % 13, (i * 5) % 11, (i * 3) % 17
+            lines.append(f"{rowStart.strftime('%d.%m.%Y;%H:%M')};{rowEnd.strftime('%H:%M')};"
+                + f"-0,{consumed1:02d};-0,{max(consumed1 - i % 4, 0):02d};-0,{consumed2:02d};-0,{max(consumed2 - i % 3, 0):02d};"
+                + f"0,{produced:02d};0,{max(produced - i % 5, 0):02d};")
+        parsedCsv = edc.parse_csv("\n".join(lines) + "\n", "grouping.csv")
+        rows = parsedCsv.getGroupedIntervals("15m")
+        for grouping, expectedGroups in [("15m", 200), ("1h", 50), ("1d", 4), ("1m", 2)]:
+            grouped = parsedCsv.getGroupedIntervals(grouping)
+            self.assertEqual(len(grouped), expectedGroups)
+            self.assertEqualIntervals(grouped, self.groupIntervalByInterval(rows, grouping))
+
+    def test_groupedIntervalsBenchmark(self):
+        parsedCsv = edc.parse_csv((Path(__file__).parent / "data" / "automatic-export.csv").read_text(), "benchmark.csv")
+        rows = parsedCsv.getGroupedIntervals("15m")
+        for grouping in ["1h", "1d", "1m"]:
+            timer = time.perf_counter()
+            expected = self.groupIntervalByInterval(rows, grouping)
+            loopTime = time.perf_counter() - timer
+            timer = time.perf_counter()
+            grouped = parsedCsv.getGroupedIntervals(grouping)
+            vectorizedTime = time.perf_counter() - timer
+            print(f"Grouping [{grouping}] of {len(rows)} rows: interval by interval {loopTime * 1000:.1f} ms, vectorized {vectorizedTime * 1000:.1f} ms")
+            self.assertEqualIntervals(grouped, expected)
+
+    def test_groupedIntervalsBatch(self):
+        parsedCsv = edc.parse_csv((Path(__file__).parent / "data" / "automatic-export.csv").read_text(), "batch.csv")
+        batch = parsedCsv.getGroupedIntervalsBatch(["15m", "1h", "1d", "1m"])
+        self.assertEqual(list(batch), ["15m", "1h", "1d", "1m"])
+        for grouping in ["15m", "1h", "1d", "1m"]:
+            grouped = parsedCsv.getGroupedIntervals(grouping)
+            batchGrouped = batch[grouping]
+            for name in ["starts", "sumSharing", "sumMissed", "sumProduction"]:
+                self.assertTrue(np.array_equal(getattr(batchGrouped, name), getattr(grouped, name)), f"{grouping} {name}")
+            for tableName in ["distributions", "consumers"]:
+                for name in ["before", "after", "missed"]:
+                    self.assertTrue(np.array_equal(getattr(getattr(batchGrouped, tableName), name), getattr(getattr(grouped, tableName), name)), f"{grouping} {tableName}.{name}")
+            self.assertEqual(batchGrouped.errors, grouped.errors)
+        with self.assertRaises(ValueError):
+            parsedCsv.getGroupedIntervalsBatch(["1h", "1w"])
+
+    #merging of consecutive intervals with the same hour / day / month, as getGroupedIntervals used to do it
+    def groupIntervalByInterval(self, rows: List[Interval], grouping: GroupingOptions) -> List[Interval]:
+        keys = {"15m": lambda start: None, "1h": lambda start: start.hour, "1d": lambda start: start.day, "1m": lambda start: start.month}
+        result: List[Interval] = []
+        for i, row in enumerate(rows):
+            if len(result) > 0 and grouping != "15m" and keys[grouping](row.start) == keys[grouping](rows[i - 1].start):
+                edc.accumulateInterval(result[-1], row)
+            else:
+                result.append(copy.deepcopy(row))
+        return result
+
+    def assertEqualIntervals(self, intervals: List[Interval], expectedIntervals: List[Interval]):
+        self.assertEqual(len(intervals), len(expectedIntervals))
+        for interval, expectedInterval in zip(intervals, expectedIntervals):
+            self.assertEqual(interval.start, expectedInterval.start)
+            self.assertEqual(interval.sumSharing, expectedInterval.sumSharing)
+            self.assertEqual(interval.sumMissed, expectedInterval.sumMissed)
+            self.assertEqual(interval.sumProduction, expectedInterval.sumProduction)
+            self.assertEqual([(m.before, m.after, m.missed) for m in interval.consumers],
+                [(m.before, m.after, m.missed) for m in expectedInterval.consumers])
+            self.assertEqual([(m.before, m.after, m.missed) for m in interval.distributions],
+                [(m.before, m.after, m.missed) for m in expectedInterval.distributions])
+
     def functionRef(self, resolver, interval):
         value = resolver(interval)
         print(f"Val: {value}")
@@ -0,0 +1,63 @@
+import unittest
+import os
+import time
+import tempfile
+import threading
+from pathlib import Path
+from DownloadWatcher import DownloadWatcher
+from EdcLogger import EdcLogger
+
+
+class TestDownloadWatcher(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = Path(self.directory.name)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    #writes the file in chunks like Chrome does and renames it when done
+    def download(self, name, chunks = 5, delay = 0.05):
+        partial = self.path / f"{name}.crdownload"
+        with open(partial, "wb") as file:
+            for i in range(chunks):
+                file.write(b"x" * 1000)
+                file.flush()
+                time.sleep(delay)
+        os.rename(partial, self.path / name)
+
+    def test_waitsForCompleteDownload(self):
+        (self.path / "old-export.csv").write_text("old")
+        with DownloadWatcher(self.path, "automatic-export", EdcLogger(), stableTime=0.2) as watcher:
+            writer = threading.Thread(target=self.download, args=("automatic-export (1).csv",))
+            writer.start()
+            downloaded = watcher.waitForDownload(5)
+            writer.join()
+        self.assertEqual(downloaded.name, "automatic-export (1).csv")
+        self.assertEqual(downloaded.stat().st_size, 5000)
+
+    def test_prefersRequestedExport(self):
+        with DownloadWatcher(self.path, "automatic-export", EdcLogger(), stableTime=0.1) as watcher:
+            (self.path / "other.csv").write_text("other")
+            (self.path / "automatic-export.csv").write_text("export")
+            self.assertEqual(watcher.waitForDownload(5).name, "automatic-export.csv")
+
+    def test_timeout(self):
+        with DownloadWatcher(self.path, "automatic-export", EdcLogger(), stableTime=0.1) as watcher:
+            (self.path / "automatic-export.csv.crdownload").write_text("partial")
+            with self.assertRaises(TimeoutError):
+                watcher.waitForDownload(0.3)
+
+    def test_polling(self):
+        with DownloadWatcher(self.path, "automatic-export", EdcLogger(), stableTime=0.1, pollInterval=0.05) as watcher:
+            watcher.close()
+            writer = threading.Thread(target=self.download, args=("automatic-export.csv",))
+            writer.start()
+            downloaded = watcher.waitForDownload(5)
+            writer.join()
+        self.assertEqual(downloaded.stat().st_size, 5000)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+import unittest
+import threading
+from EntityRegistry import EntityRegistry
+from EdcLogger import EdcLogger
+
+ATTRIBUTES = {"unique_id": "input_number.edc_data_shared_859182400699999332_monthly", "unit_of_measurement": "kWh"}
+
+
+class FakeHass:
+    """States of Home Assistant, every write is recorded."""
+
+    def __init__(self, states):
+        self.states = states
+        self.reads = 0
+        self.writes = []
+
+    def get_state(self, entityId=None, attribute=None):
+        self.reads += 1
+        return {entity: dict(state) for entity, state in self.states.items() if entity.startswith(f"{entityId}.")}
+
+    def set_state(self, entityId, state=None, attributes=None):
+        self.writes.append((entityId, state, attributes))
+        self.states[entityId] = {"state": str(state), "attributes": dict(attributes or self.states.get(entityId, {}).get("attributes", {}))}
+
+
+class TestEntityRegistry(unittest.TestCase):
+
+    def setUp(self):
+        self.hass = FakeHass({
+            "input_number.edc_data_shared_859182400699999332_monthly": {"state": "12.5", "attributes": dict(ATTRIBUTES)},
+            "input_text.edc_version": {"state": "1.5.1", "attributes": {}},
+        })
+        self.registry = EntityRegistry(self.hass, EdcLogger(), threading.BoundedSemaphore(4))
+
+    def test_refresh(self):
+        self.registry.refresh()
+        self.assertEqual(self.hass.reads, 1)
+        #only the domain of the registry
+        self.assertEqual(list(self.registry.states), ["input_number.edc_data_shared_859182400699999332_monthly"])
+        self.assertTrue(self.registry.isCurrent("input_number.edc_data_shared_859182400699999332_monthly", ATTRIBUTES))
+        self.assertFalse(self.registry.isCurrent("input_number.edc_data_shared_859182400699999332_monthly", {"unit_of_measurement": "MWh"}))
+        self.assertFalse(self.registry.isCurrent("input_number.edc_data_shared_859182400699999332_daily", ATTRIBUTES))
+
+        #queued states do not survive a refresh
+        self.registry.queueState("input_number.edc_data_shared_859182400699999332_monthly", 1.0)
+        self.registry.refresh()
+        self.assertEqual(self.registry.flush(), 0)
+
+    def test_create(self):
+        self.registry.refresh()
+        #existing with the same attributes - not written
+        self.assertFalse(self.registry.create("input_number.edc_data_shared_859182400699999332_monthly", 0.1, ATTRIBUTES))
+        self.assertEqual(self.hass.writes, [])
+
+        attributes = dict(ATTRIBUTES, unique_id="input_number.edc_data_shared_859182400699999332_daily")
+        self.assertTrue(self.registry.create("input_number.edc_data_shared_859182400699999332_daily", 0.1, attributes))
+        #known to the registry after the write, the next export does not write it again
+        self.assertFalse(self.registry.create("input_number.edc_data_shared_859182400699999332_daily", 0.1, attributes))
+        changed = dict(ATTRIBUTES, name="EDC Shared Monthly")
+        self.assertTrue(self.registry.create("input_number.edc_data_shared_859182400699999332_monthly", 0.1, changed))
+        self.assertEqual([entityId for entityId, _, _ in self.hass.writes],
+            ["input_number.edc_data_shared_859182400699999332_daily", "input_number.edc_data_shared_859182400699999332_monthly"])
+
+    def test_queueStateFlush(self):
+        self.registry.refresh()
+        self.registry.queueState("input_number.edc_data_shared_859182400699999332_monthly", 3.0)
+        self.registry.queueState("input_number.edc_data_shared_859182400699999332_monthly", 12.5)
+        self.registry.queueState("input_number.edc_data_consumer_missed_859182400999999933_monthly", 1.0)
+        self.registry.queueState("input_number.edc_data_consumer_missed_859182400999999933_monthly", 2.0)
+        #the last queued value wins, a value HA already has is not written
+        self.assertEqual(self.registry.flush(), 1)
+        self.assertEqual(self.hass.writes, [("input_number.edc_data_consumer_missed_859182400999999933_monthly", 2.0, None)])
+
+        #nothing pending after a flush, an unchanged state stays unwritten
+        self.assertEqual(self.registry.flush(), 0)
+        self.registry.queueState("input_number.edc_data_consumer_missed_859182400999999933_monthly", 2.0)
+        self.assertEqual(self.registry.flush(), 0)
+        self.assertEqual(len(self.hass.writes), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+import unittest
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime as dt, timedelta
+from pathlib import Path
+from ExportFingerprints import ExportFingerprints
+from EdcLogger import EdcLogger
+
+ENTITY = "sensor.edc_consumer_purchased_859182400999999933_1d"
+
+
+class TestExportFingerprints(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.stateFile = Path(self.directory.name) / "state" / "exportFingerprints.json"
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def rows(self, values, start=dt(2025, 4, 1)):
+        return [(start + timedelta(days=day), value) for day, value in enumerate(values)]
+
+    def test_changedRows(self):
+        fingerprints = ExportFingerprints(self.stateFile, EdcLogger())
+        rows = self.rows([1.0, 2.0, 3.0])
+        self.assertEqual(fingerprints.changedRows(ENTITY, rows), rows)
+        fingerprints.markUploaded(ENTITY)
+
+        #unchanged rows (as written to the export, with 2 decimals) are left out, changed and new rows are kept
+        changed = fingerprints.changedRows(ENTITY, self.rows([1.001, 2.5, 3.0, 4.0]))
+        self.assertEqual(changed, [(dt(2025, 4, 2), 2.5), (dt(2025, 4, 4), 4.0)])
+        #other entities are independent
+        self.assertEqual(fingerprints.changedRows("sensor.other", rows), rows)
+
+    def test_markUploaded(self):
+        fingerprints = ExportFingerprints(self.stateFile, EdcLogger())
+        rows = self.rows([1.0, 2.0])
+        fingerprints.changedRows(ENTITY, rows)
+        #a failed upload is not marked - the rows are changed again next time
+        self.assertEqual(fingerprints.changedRows(ENTITY, rows), rows)
+        fingerprints.markUploaded(ENTITY)
+        fingerprints.save()
+
+        reloaded = ExportFingerprints(self.stateFile, EdcLogger())
+        self.assertEqual(reloaded.changedRows(ENTITY, rows), [])
+        #marking without pending rows changes nothing
+        reloaded.markUploaded("sensor.other")
+        self.assertEqual(reloaded.uploaded.get("sensor.other", {}), {})
+
+    def test_retention(self):
+        fingerprints = ExportFingerprints(self.stateFile, EdcLogger(), retentionDays=10)
+        old = self.rows([1.0], start=dt(2025, 1, 1))
+        recent = self.rows([2.0, 3.0], start=dt(2025, 4, 1))
+        fingerprints.changedRows(ENTITY, old + recent)
+        fingerprints.markUploaded(ENTITY)
+        fingerprints.save()
+
+        #rows older than retentionDays before the newest row of the entity are forgotten and uploaded again
+        reloaded = ExportFingerprints(self.stateFile, EdcLogger(), retentionDays=10)
+        self.assertEqual(reloaded.changedRows(ENTITY, old + recent), old)
+
+    def test_unreadableState(self):
+        self.stateFile.parent.mkdir(parents=True)
+        self.stateFile.write_text("{broken")
+        fingerprints = ExportFingerprints(self.stateFile, EdcLogger())
+        rows = self.rows([1.0])
+        self.assertEqual(fingerprints.changedRows(ENTITY, rows), rows)
+
+    def test_parallelExport(self):
+        fingerprints = ExportFingerprints(self.stateFile, EdcLogger())
+        rows = self.rows([float(day) for day in range(30)])
+        entities = [f"{ENTITY}_{i}" for i in range(64)]
+
+        #export jobs of the parallel export, the state is saved while they run
+        def exportJob(entityName):
+            fingerprints.changedRows(entityName, rows)
+            fingerprints.markUploaded(entityName)
+            fingerprints.save()
+
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            list(pool.map(exportJob, entities))
+        fingerprints.save()
+        reloaded = ExportFingerprints(self.stateFile, EdcLogger())
+        for entityName in entities:
+            self.assertEqual(reloaded.changedRows(entityName, rows), [])
+        self.assertEqual(fingerprints.pending, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
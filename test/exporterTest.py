@@ -0,0 +1,136 @@
+import unittest
+import asyncio
+import threading
+import tempfile
+from types import SimpleNamespace
+from datetime import datetime as dt, timedelta
+from pathlib import Path
+from EdcExporter import EdcExporter
+from EdcLogger import EdcLogger
+from RecorderStatistics import RecorderStatistics
+import edc
+
+
+class FakeHass:
+    """The parts of the AppDaemon Hass API the exporter uses, the websocket of the HASS plugin runs in its own loop."""
+
+    namespace = "default"
+
+    def __init__(self, loop, recorderAccepts: bool = True):
+        self.recorderAccepts = recorderAccepts
+        self.messages = []
+        self.services = []
+        plugin = SimpleNamespace(websocket_send_json=self.websocketSendJson)
+        self.AD = SimpleNamespace(loop=loop, plugins=SimpleNamespace(get_plugin_object=lambda namespace: plugin))
+
+    async def websocketSendJson(self, silent=False, **message):
+        self.messages.append(message)
+        return {"success": self.recorderAccepts}
+
+    def call_service(self, service, **kwargs):
+        self.services.append((service, kwargs))
+
+    def get_state(self, entityId=None, attribute=None):
+        return {}
+
+    def set_state(self, entityId, **kwargs):
+        pass
+
+
+class TestEdcExporter(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.loop = asyncio.new_event_loop()
+        self.loopThread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.loopThread.start()
+
+    def tearDown(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.loopThread.join()
+        self.loop.close()
+        self.directory.cleanup()
+
+    def rows(self, count):
+        return [(dt(2025, 4, 1) + timedelta(days=day), day + 0.5) for day in range(count)]
+
+    # statistic ids of every line of the export file
+    def statisticIds(self, fileName):
+        lines = (Path(self.directory.name) / fileName).read_text().splitlines()
+        self.assertEqual(lines[0], EdcExporter.exportHeader)
+        return [line.split(";")[0] for line in lines[1:]]
+
+    def test_batchSplit(self):
+        exporter = EdcExporter(self.directory.name, EdcLogger(), batchedUpload=True, maxRowsPerFile=5)
+        exporter.uploadBatch = [("a", self.rows(2)), ("b", self.rows(3)), ("c", self.rows(6)), ("d", self.rows(1))]
+        exporter.uploadBatchedStatistics()
+        #a file is closed before it would exceed maxRowsPerFile, statistics of one entity are never split
+        self.assertEqual(self.statisticIds("statistics_export_1.csv"), ["input_number.a"] * 2 + ["input_number.b"] * 3)
+        self.assertEqual(self.statisticIds("statistics_export_2.csv"), ["input_number.c"] * 6)
+        self.assertEqual(self.statisticIds("statistics_export_3.csv"), ["input_number.d"])
+        self.assertFalse((Path(self.directory.name) / "statistics_export_4.csv").exists())
+        self.assertEqual(exporter.uploadBatch, [])
+
+    def test_recorderPayload(self):
+        recorder = RecorderStatistics(FakeHass(self.loop), EdcLogger())
+        message = recorder.statisticsMessage("edc_data_shared_859182400699999332_daily", [(dt(2025, 1, 31), 1.234), (dt(2025, 4, 1, 13, 15), 2.0)])
+        self.assertEqual(message, {
+            "type": "recorder/import_statistics",
+            "metadata": {
+                "statistic_id": "input_number.edc_data_shared_859182400699999332_daily",
+                "source": "recorder",
+                "name": None,
+                "unit_of_measurement": "kWh",
+                "has_mean": False,
+                "has_sum": True,
+            },
+            #local starts, like the file import with timezone_identifier Europe/Vienna
+            "stats": [
+                {"start": "2025-01-31T00:00:00+01:00", "state": 1.23, "sum": 0},
+                {"start": "2025-04-01T13:15:00+02:00", "state": 2.0, "sum": 0},
+            ],
+        })
+
+    def test_recorderImport(self):
+        hass = FakeHass(self.loop)
+        exporter = EdcExporter(self.directory.name, EdcLogger(), hass, exportBackend="recorder")
+        self.assertNotEqual(exporter.recorderStatistics, 'undefined')
+        exporter.uploadStatistics("statistics_export_1.csv", [("a", self.rows(2)), ("b", self.rows(3))])
+        self.assertEqual([message["metadata"]["statistic_id"] for message in hass.messages], ["input_number.a", "input_number.b"])
+        self.assertEqual([len(message["stats"]) for message in hass.messages], [2, 3])
+        self.assertEqual(hass.services, [])
+        self.assertFalse((Path(self.directory.name) / "statistics_export_1.csv").exists())
+
+    def test_fileFallback(self):
+        hass = FakeHass(self.loop, recorderAccepts=False)
+        exporter = EdcExporter(self.directory.name, EdcLogger(), hass, exportBackend="recorder")
+        exporter.uploadStatistics("statistics_export_1.csv", [("a", self.rows(2))])
+        #rejected by the recorder - exported to a file and imported by the import_statistics integration
+        self.assertEqual(len(hass.messages), 1)
+        self.assertEqual(self.statisticIds("statistics_export_1.csv"), ["input_number.a"] * 2)
+        self.assertEqual([service for service, _ in hass.services], ["import_statistics/import_from_file"])
+        self.assertTrue(hass.services[0][1]["filename"].endswith("statistics_export_1.csv"))
+
+    def test_fileBackend(self):
+        hass = FakeHass(self.loop)
+        exporter = EdcExporter(self.directory.name, EdcLogger(), hass)
+        self.assertEqual(exporter.recorderStatistics, 'undefined')
+        exporter.uploadStatistics("shared_export_859182400699999332_1d.csv", [("a", self.rows(2))])
+        self.assertEqual(hass.messages, [])
+        self.assertEqual([service for service, _ in hass.services], ["import_statistics/import_from_file"])
+
+
+    def test_parallelExport(self):
+        parsedCsv = edc.parse_csv_file(Path(__file__).parent / "data" / "automatic-export.csv")
+        exported = []
+        for exportWorkers in [1, 4]:
+            directory = Path(self.directory.name) / f"workers_{exportWorkers}"
+            directory.mkdir()
+            EdcExporter(str(directory), EdcLogger(), exportWorkers=exportWorkers).exportData(parsedCsv, ["1h", "1d", "1m"])
+            exported.append({file.name: file.read_text() for file in directory.iterdir()})
+        #the parallel export writes the same files as the sequential one
+        self.assertEqual(len(exported[0]), 3 * 9)
+        self.assertEqual(exported[1], exported[0])
+
+if __name__ == '__main__':
+    unittest.main()
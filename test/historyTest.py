@@ -0,0 +1,90 @@
+import unittest
+import tempfile
+from datetime import datetime as dt
+from dateutil.relativedelta import relativedelta
+from typing import Dict, List
+import numpy as np
+import edc
+from EdcHistory import EdcHistory
+from EdcLogger import EdcLogger
+
+PRODUCER = "859182400699999332"
+CONSUMER = "859182400999999933"
+NEW_CONSUMER = "859182400604878727"
+
+
+class TestEdcHistory(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    #export of `count` quarter-hours from start, consumer values scaled by `scale`
+    def export(self, start: dt, count: int, consumers: List[str], scale: int = 1) -> edc.Csv:
+        header = "Datum;Cas od;Cas do;" + ";".join(f"IN-{ean}-O;OUT-{ean}-O" for ean in consumers) + f";IN-{PRODUCER}-D;OUT-{PRODUCER}-D"
+        lines = [header]
+        for i in range(count):
+            rowStart = start + relativedelta(minutes=15 * i)
+            consumed = [((i + column) % 5 + 1) * scale for column in range(len(consumers))]
+            cells = ";".join(f"-0,{value:02d};0,0" for value in consumed)
+            lines.append(f"{rowStart.strftime('%d.%m.%Y;%H:%M')};{(rowStart + relativedelta(minutes=15)).strftime('%H:%M')};{cells};0,{sum(consumed):02d};0,0;")
+        return edc.parse_csv("\n".join(lines) + "\n", "history.csv")
+
+    # ean -> (start, before) of all intervals
+    def readings(self, parsedCsv: edc.Csv) -> Dict[str, List[tuple]]:
+        intervals = parsedCsv.getIntervals()
+        result = {}
+        for table, eans in [(intervals.distributions, parsedCsv.distributionEans), (intervals.consumers, parsedCsv.consumerEans)]:
+            for column, ean in enumerate(eans):
+                result[ean.name] = [(int(start), float(before)) for start, before in zip(intervals.starts, table.before[:, column])]
+        return result
+
+    def test_prependMonth(self):
+        history = EdcHistory(self.directory.name, EdcLogger())
+        april = self.export(dt(2025, 4, 10), 8, [CONSUMER])
+        march = self.export(dt(2025, 3, 10), 8, [CONSUMER])
+        history.merge(april)
+        baseTime = history.baseTime
+        history.merge(march)
+        self.assertLess(history.baseTime, baseTime)
+
+        #read back by a new instance, only the imported slots are returned
+        reopened = EdcHistory(self.directory.name, EdcLogger())
+        readings = self.readings(reopened.toCsv())
+        for ean in [PRODUCER, CONSUMER]:
+            self.assertEqual(readings[ean], self.readings(march)[ean] + self.readings(april)[ean])
+        self.assertEqual(self.readings(reopened.toCsv(dt(2025, 4, 1), dt(2025, 5, 1))), self.readings(april))
+
+    def test_newEan(self):
+        history = EdcHistory(self.directory.name, EdcLogger())
+        march = self.export(dt(2025, 3, 10), 4, [CONSUMER])
+        april = self.export(dt(2025, 4, 10), 4, [CONSUMER, NEW_CONSUMER])
+        history.merge(march)
+        history.merge(april)
+        self.assertEqual(history.consumerEans(), sorted([CONSUMER, NEW_CONSUMER]))
+
+        readings = self.readings(EdcHistory(self.directory.name, EdcLogger()).toCsv())
+        self.assertEqual(readings[CONSUMER], self.readings(march)[CONSUMER] + self.readings(april)[CONSUMER])
+        #the new EAN reads 0 before it appeared in the exports
+        self.assertEqual(readings[NEW_CONSUMER], [(start, 0.0) for start, _ in self.readings(march)[CONSUMER]] + self.readings(april)[NEW_CONSUMER])
+
+    def test_overwrite(self):
+        history = EdcHistory(self.directory.name, EdcLogger())
+        history.merge(self.export(dt(2025, 4, 10), 8, [CONSUMER, NEW_CONSUMER]))
+        slots = history.slots
+        #re-export of the same intervals with other values and without NEW_CONSUMER
+        reexport = self.export(dt(2025, 4, 10), 8, [CONSUMER], scale=2)
+        history.merge(reexport)
+        self.assertEqual(history.slots, slots)
+
+        reopened = EdcHistory(self.directory.name, EdcLogger())
+        readings = self.readings(reopened.toCsv())
+        self.assertEqual(readings[CONSUMER], self.readings(reexport)[CONSUMER])
+        self.assertEqual(readings[PRODUCER], self.readings(reexport)[PRODUCER])
+        self.assertTrue(np.isnan(reopened.eanValues(NEW_CONSUMER)).all())
+
+
+if __name__ == '__main__':
+    unittest.main()
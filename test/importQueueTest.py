@@ -0,0 +1,84 @@
+import unittest
+import threading
+from ImportQueue import ImportQueue
+from EdcLogger import EdcLogger
+
+MARCH = (2025, 3)
+APRIL = (2025, 4)
+MAY = (2025, 5)
+
+
+class TestImportQueue(unittest.TestCase):
+    """The first job blocks in the runner until released, the jobs submitted meanwhile are queued behind it."""
+
+    def setUp(self):
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.calls = []
+        self.queue = ImportQueue(self.runner, EdcLogger())
+
+    def tearDown(self):
+        self.release.set()
+        self.queue.shutdown()
+
+    def runner(self, months, groupings, retries, attempt):
+        self.calls.append((months, groupings, retries, attempt))
+        self.started.set()
+        self.release.wait(10)
+
+    def runningImport(self, months, groupings):
+        self.assertTrue(self.queue.submit(months, groupings))
+        self.assertTrue(self.started.wait(10))
+
+    #releases the running import and waits for all queued ones
+    def completeImports(self):
+        self.release.set()
+        self.queue.executor.shutdown(wait=True)
+        return self.calls[1:]
+
+    def test_coalescing(self):
+        self.runningImport([MARCH], ["1h"])
+        self.assertTrue(self.queue.submit([APRIL], ["1h"]))
+        self.assertFalse(self.queue.submit([APRIL], ["1d", "1h"]))
+        self.assertFalse(self.queue.submit([APRIL], ["1m"]))
+        self.assertEqual(self.completeImports(), [([APRIL], ["1h", "1d", "1m"], 0, 0)])
+
+    def test_runningAndPending(self):
+        self.runningImport([MARCH], ["1h", "1d"])
+        #the running import covers the request
+        self.assertFalse(self.queue.submit([MARCH], ["1d"]))
+        #more groupings than the running import - imported again after it
+        self.assertTrue(self.queue.submit([MARCH], ["1m"]))
+        #a range imports only its months which are neither running (with these groupings) nor queued
+        self.assertTrue(self.queue.submit([MARCH, APRIL, MAY], ["1h", "1d"]))
+        self.assertEqual(self.completeImports(), [([MARCH], ["1m"], 0, 0), ([APRIL, MAY], ["1h", "1d"], 0, 0)])
+
+    def test_rangeSplit(self):
+        self.runningImport([MARCH], ["1h"])
+        self.assertTrue(self.queue.submit([APRIL, MAY], ["1h", "1d"]))
+        #groupings the range imports anyway - merged
+        self.assertFalse(self.queue.submit([MAY], ["1d"]))
+        #a new grouping for one month of the range - that month only, the other keeps its groupings
+        self.assertTrue(self.queue.submit([APRIL], ["1m"]))
+        self.assertFalse(self.queue.submit([APRIL], ["1d", "15m"]))
+        self.assertEqual(self.completeImports(), [([MAY], ["1h", "1d"], 0, 0), ([APRIL], ["1h", "1d", "1m", "15m"], 0, 0)])
+
+    def test_retries(self):
+        self.runningImport([MARCH], ["1h"])
+        #retry of a failed import while the same import is running - dropped
+        self.assertFalse(self.queue.submit([MARCH], ["1h"], retries=3, attempt=1))
+        #a queued import keeps the highest retry count of the merged requests and its own attempt
+        self.assertTrue(self.queue.submit([APRIL], ["1h"], retries=0, attempt=0))
+        self.assertFalse(self.queue.submit([APRIL], ["1h"], retries=3, attempt=2))
+        #a month split off a range keeps the retries of the range
+        self.assertTrue(self.queue.submit([MAY, (2025, 6)], ["1h"], retries=3, attempt=1))
+        self.assertTrue(self.queue.submit([MAY], ["1d"]))
+        self.assertEqual(self.completeImports(), [
+            ([APRIL], ["1h"], 3, 0),
+            ([(2025, 6)], ["1h"], 3, 1),
+            ([MAY], ["1h", "1d"], 3, 1),
+        ])
+
+
+if __name__ == '__main__':
+    unittest.main()
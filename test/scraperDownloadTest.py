@@ -0,0 +1,62 @@
+import unittest
+import tempfile
+from pathlib import Path
+from EdcScraper import EdcScraper
+from EdcLogger import EdcLogger
+
+
+class PortalScraper(EdcScraper):
+    """EdcScraper without a browser: the export is recorded and a click on the download link writes the file."""
+
+    def __init__(self, downloadDirectory):
+        super().__init__("chromedriver", "user", "secret", "My group", downloadDirectory, EdcLogger(), sessionIdleTimeout=0)
+        self.exported = []
+        self.clicked = []
+
+    def acquireSession(self):
+        return "driver"
+
+    def exportMonth(self, driver, month, year, fileName):
+        self.exported.append((year, month, fileName))
+
+    def clickOnElement(self, driver, xpath, step = "element"):
+        self.clicked.append(xpath)
+        #an older export, downloaded at the same time, must not be taken for this one
+        Path(self.downloadDirectory, "automatic-export.csv").write_text("old export")
+        Path(self.downloadDirectory, f"{self.exported[len(self.clicked) - 1][2]}.csv").write_text("new export")
+
+
+class TestScraperDownload(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_scrapeDataExportName(self):
+        scraper = PortalScraper(self.directory.name)
+        dataFile = scraper.scrapeData(4, 2025)
+        (year, month, fileName), = scraper.exported
+        #a unique name of this scrape - not the fixed automatic-export and not just the newest report
+        self.assertTrue(fileName.startswith("automatic-export-2025-04-"))
+        self.assertIn(f"'{fileName}'", scraper.clicked[0])
+        self.assertNotIn("tr[1]", scraper.clicked[0])
+        self.assertEqual(dataFile, Path(self.directory.name) / f"{fileName}.csv")
+        self.assertEqual(dataFile.read_text(), "new export")
+
+    def test_scrapeMonthsExportNames(self):
+        scraper = PortalScraper(self.directory.name)
+        downloaded = []
+        scraper.scrapeMonths([(2025, 3), (2025, 4)], lambda year, month, dataFile: downloaded.append((year, month, dataFile)))
+        fileNames = [fileName for _, _, fileName in scraper.exported]
+        self.assertEqual(len(set(fileNames)), 2)
+        #every month is downloaded by the name it was exported with
+        for (year, month, dataFile), fileName, xpath in zip(downloaded, fileNames, scraper.clicked):
+            self.assertTrue(fileName.startswith(f"automatic-export-{year:04d}-{month:02d}-"))
+            self.assertIn(f"'{fileName}'", xpath)
+            self.assertEqual(dataFile, Path(self.directory.name) / "backfill" / f"{fileName}.csv")
+
+
+if __name__ == '__main__':
+    unittest.main()
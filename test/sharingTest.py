@@ -0,0 +1,151 @@
+import unittest
+import os
+import random
+import shutil
+import tempfile
+from datetime import datetime as dt
+from pathlib import Path
+from dateutil.relativedelta import relativedelta
+from typing import List
+import numpy as np
+import edc
+from edc import Interval
+
+
+#the interval by interval simulation simulateSharing and simulateSharingFast used to run, in fixed point hundredths
+def shareIntervalByInterval(intervals: List[Interval], allocations: List[float], iterations: int) -> np.ndarray:
+    shared = np.zeros((len(allocations), iterations, len(intervals)))
+    for column, interval in enumerate(intervals):
+        toShare = edc.math_round(interval.distributions[0].before * 100)
+        consumed = [edc.math_round(c.before * 100) for c in interval.consumers]
+        for iteration in range(iterations):
+            energyThisRound = toShare
+            for i in range(len(consumed)):
+                share = edc.math_min(consumed[i], edc.math_trunc(energyThisRound * (allocations[i] / 100)))
+                consumed[i] -= share
+                toShare -= share
+                shared[i, iteration, column] = share
+    return shared
+
+
+def simulateSharingIntervalByInterval(intervals: List[Interval], allocations: List[float], costsPerKwh: List[float], iterations: int):
+    shared = shareIntervalByInterval(intervals, allocations, iterations)
+    resultDetailed = [[0.0] * len(allocations) for _ in range(iterations)]
+    profitPerEan = [0.0] * len(allocations)
+    for column in range(len(intervals)):
+        for iteration in range(iterations):
+            for i in range(len(allocations)):
+                resultDetailed[iteration][i] += int(shared[i, iteration, column])
+                profitPerEan[i] += int(shared[i, iteration, column]) * costsPerKwh[i]
+    resultEan = [0.0] * len(allocations)
+    for iteration in range(iterations):
+        for i in range(len(allocations)):
+            resultDetailed[iteration][i] /= 100
+            resultEan[i] += resultDetailed[iteration][i]
+    return {
+        'profitPerEan': [costsPerKwh[i] * value for i, value in enumerate(resultEan)],
+        'sharingPerEan': resultEan,
+        'sharingPerRoundPerEan': resultDetailed,
+    }, sum(profitPerEan) / 100
+
+
+class TestSharing(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.exportCsv = edc.parse_csv_file(Path(__file__).parent / "data" / "automatic-export.csv")
+        #one producer and five consumers, two days of random readings
+        generator = random.Random(7)
+        consumers = [f"85918240099999990{i}" for i in range(5)]
+        lines = ["Datum;Cas od;Cas do;" + ";".join(f"IN-{ean}-O;OUT-{ean}-O" for ean in consumers) + ";IN-859182400699999332-D;OUT-859182400699999332-D"]
+        start = dt(2025, 4, 1)
+        for i in range(2 * 96):
+            rowStart = start + relativedelta(minutes=15 * i)
+            consumed = [f"-{generator.randint(0, 150) / 100:.2f}".replace(".", ",") for _ in consumers]
+            produced = f"{generator.randint(0, 400) / 100:.2f}".replace(".", ",")
+            lines.append(f"{rowStart.strftime('%d.%m.%Y;%H:%M')};{(rowStart + relativedelta(minutes=15)).strftime('%H:%M')};"
+                + "".join(f"{value};{value};" for value in consumed) + f"{produced};{produced};")
+        cls.randomCsv = edc.parse_csv("\n".join(lines) + "\n", "sharing.csv")
+
+    def allocations(self, generator: random.Random, consumers: int) -> List[float]:
+        weights = [generator.random() for _ in range(consumers)]
+        return [int(weight / sum(weights) * 9999) / 100 for weight in weights]
+
+    def test_shareRounds(self):
+        generator = random.Random(1)
+        for parsedCsv in [self.exportCsv, self.randomCsv]:
+            intervals = list(parsedCsv.getGroupedIntervals("15m"))
+            toShare, consumed = parsedCsv.getFixedPointData()
+            for iterations in [1, 3, 5]:
+                allocations = self.allocations(generator, len(parsedCsv.consumerEans))
+                shared = edc.shareRounds(toShare, consumed, np.array(allocations) / 100, iterations)
+                self.assertTrue(np.array_equal(shared, shareIntervalByInterval(intervals, allocations, iterations)))
+
+    def test_simulateSharing(self):
+        generator = random.Random(2)
+        for parsedCsv in [self.exportCsv, self.randomCsv]:
+            intervals = list(parsedCsv.getGroupedIntervals("15m"))
+            costsPerKwh = [generator.randint(1, 60) / 10 for _ in parsedCsv.consumerEans]
+            for iterations in [1, 5]:
+                allocations = self.allocations(generator, len(parsedCsv.consumerEans))
+                expected, expectedProfit = simulateSharingIntervalByInterval(intervals, allocations, costsPerKwh, iterations)
+                self.assertEqual(parsedCsv.simulateSharing(allocations, costsPerKwh, iterations), expected)
+                #bit-identical profit, on the cached data as well as on a list of intervals
+                self.assertEqual(parsedCsv.simulateSharingFast(None, allocations, costsPerKwh, iterations), expectedProfit)
+                self.assertEqual(parsedCsv.simulateSharingFast(intervals, allocations, costsPerKwh, iterations), expectedProfit)
+
+    def test_fixedPointData(self):
+        toShare, consumed = self.randomCsv.getFixedPointData()
+        #computed once, read-only
+        self.assertIs(self.randomCsv.getFixedPointData()[0], toShare)
+        with self.assertRaises(ValueError):
+            toShare[0] = 1
+        with self.assertRaises(ValueError):
+            consumed[0, 0] = 1
+        for column, interval in enumerate(self.randomCsv.getGroupedIntervals("15m")):
+            self.assertEqual(toShare[column], edc.math_round(interval.distributions[0].before * 100))
+            self.assertEqual(list(consumed[:, column]), [edc.math_round(c.before * 100) for c in interval.consumers])
+
+    def test_optimizeAllocationRestart(self):
+        parsedCsv = self.randomCsv
+        costsPerKwh = [3.0, 2.5, 4.0, 1.5, 3.5]
+        dataDirectory = tempfile.mkdtemp()
+        try:
+            toShare, consumed = parsedCsv.getFixedPointData()
+            np.save(os.path.join(dataDirectory, "toShare.npy"), toShare)
+            np.save(os.path.join(dataDirectory, "consumed.npy"), consumed)
+            #a restart of a worker process is the restart of the app process with the same random sequence
+            result = edc.optimizeAllocationRestart(dataDirectory, parsedCsv.distributionEans, parsedCsv.consumerEans, 3, costsPerKwh, "gradientDescend", 5, 11)
+        finally:
+            shutil.rmtree(dataDirectory)
+        self.assertEqual(result, parsedCsv.optimizeAllocationRestart(3, costsPerKwh, "gradientDescend", 5, 11))
+
+    def test_fromFixedPoint(self):
+        parsedCsv = self.randomCsv
+        costsPerKwh = [3.0, 2.5, 4.0, 1.5, 3.5]
+        allocations = [20.0, 33.33, 10.5, 25.0, 11.16]
+        fixedPointCsv = edc.Csv.fromFixedPoint(parsedCsv.distributionEans, parsedCsv.consumerEans, *parsedCsv.getFixedPointData())
+        self.assertIsNone(fixedPointCsv.getIntervals())
+        self.assertIsNone(fixedPointCsv.dateFrom)
+        self.assertEqual(fixedPointCsv.simulateSharing(allocations, costsPerKwh, 3), parsedCsv.simulateSharing(allocations, costsPerKwh, 3))
+        self.assertEqual(fixedPointCsv.optimizeAllocationRestart(2, costsPerKwh, "random", 5, 3), parsedCsv.optimizeAllocationRestart(2, costsPerKwh, "random", 5, 3))
+
+    def test_optimizeAllocationWorkers(self):
+        parsedCsv = self.randomCsv
+        costsPerKwh = [3.0, 2.5, 4.0, 1.5, 3.5]
+        for workers in [1, 2]:
+            progress = []
+            thread = parsedCsv.optimizeAllocation(3, costsPerKwh, "gradientDescend", 3, 3, lambda result, iteration: progress.append((iteration, result)), workers=workers)
+            thread.join(120)
+            self.assertFalse(thread.is_alive())
+            self.assertEqual([iteration for iteration, _ in progress], [1, 2, 3])
+            #the best result so far, consistent with the simulation of its weights
+            profits = [sum(result['profit']) for _, result in progress]
+            self.assertEqual(profits, sorted(profits))
+            best = progress[-1][1]
+            self.assertLessEqual(sum(best['weights']), 100)
+            self.assertAlmostEqual(sum(best['profit']), parsedCsv.simulateSharingFast(None, best['weights'], costsPerKwh, 3), places=6)
+
+
+if __name__ == '__main__':
+    unittest.main()